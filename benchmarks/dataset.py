@@ -0,0 +1,288 @@
+"""Generate a large dataset of users and their texture history.
+
+    DATABASE_URL=postgresql://localhost/valhalla \\
+    python -m benchmarks.dataset --users 1000000
+
+Rows are inserted in bulk, with COPY on Postgres and executemany elsewhere, and
+added to any existing data, so use a new `--seed` to add more. The number of
+skins a user has had follows a power law: most players keep their first one, a
+few change it every week. Some changes reuse a popular upload instead of a new
+one.
+
+With `--write-files`, the PNG of every upload is stored in the configured
+textures path or bucket, so the textures can be served too.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from io import BytesIO
+from typing import Any
+from uuid import UUID
+
+import anyio
+import anyio.to_thread
+from PIL import Image
+from sqlalchemy import JSON, Table, func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from valhalla import models
+from valhalla.files import Files
+
+
+@dataclass
+class Options:
+    users: int
+    seed: int = 0
+    # shape of the pareto distribution of skins per user, lower is a longer tail
+    alpha: float = 1.2
+    max_changes: int = 500
+    # share of the changes which reuse an earlier upload
+    reuse: float = 0.3
+    capes: float = 0.05
+    days: float = 5 * 365
+    batch_size: int = 10_000
+    # earlier uploads which can be reused, the first ones are the most popular
+    shared_uploads: int = 100_000
+
+
+@dataclass
+class Batch:
+    users: list[tuple[Any, ...]] = field(default_factory=list)
+    uploads: list[tuple[Any, ...]] = field(default_factory=list)
+    textures: list[tuple[Any, ...]] = field(default_factory=list)
+    # the pixels of the new uploads by hash, if their files are written
+    pixels: dict[str, bytes] = field(default_factory=dict)
+
+    def rows(self) -> dict[str, list[tuple[Any, ...]]]:
+        """The rows to insert by table, in the order of their foreign keys."""
+        return {"users": self.users, "uploads": self.uploads, "textures": self.textures}
+
+
+class Generator:
+    def __init__(
+        self, options: Options, ids: dict[str, int], *, pixels: bool = False
+    ) -> None:
+        self.options = options
+        self.pixels = pixels
+        self.rng = random.Random(options.seed)
+        self.next_ids = {name: last + 1 for name, last in ids.items()}
+        self.now = datetime.now(UTC).replace(tzinfo=None)
+        # ids of the first uploads made, which are reused
+        self.shared: list[int] = []
+
+    def next_id(self, table: str) -> int:
+        self.next_ids[table] += 1
+        return self.next_ids[table] - 1
+
+    def batch(self, count: int) -> Batch:
+        batch = Batch()
+        for _ in range(count):
+            self.add_user(batch)
+        return batch
+
+    def add_user(self, batch: Batch) -> None:
+        rng = self.rng
+        user_id = self.next_id("users")
+        batch.users.append((user_id, UUID(int=rng.getrandbits(128)), f"P{user_id}"))
+
+        changes = min(
+            int(rng.paretovariate(self.options.alpha)), self.options.max_changes
+        )
+        span = timedelta(days=self.options.days).total_seconds()
+        times = sorted(
+            self.now - timedelta(seconds=rng.random() * span) for _ in range(changes)
+        )
+        model = rng.choice(["default", "slim"])
+        for start, end in zip(times, [*times[1:], None], strict=True):
+            if self.shared and rng.random() < self.options.reuse:
+                upload_id = self.shared[int(len(self.shared) * rng.random() ** 4)]
+            else:
+                upload_id = self.add_upload(batch, user_id, start)
+            batch.textures.append(
+                (
+                    self.next_id("textures"),
+                    user_id,
+                    upload_id,
+                    "skin",
+                    {"model": model},
+                    start,
+                    end,
+                )
+            )
+
+        if rng.random() < self.options.capes:
+            start = self.now - timedelta(seconds=rng.random() * span)
+            upload_id = self.add_upload(batch, user_id, start)
+            batch.textures.append(
+                (self.next_id("textures"), user_id, upload_id, "cape", {}, start, None)
+            )
+
+    def add_upload(self, batch: Batch, user_id: int, time: datetime) -> int:
+        if self.pixels:
+            pixels = self.rng.randbytes(64 * 64 * 4)
+            # the same as hash_skin, without decoding a PNG
+            texture_hash = hashlib.sha1(pixels).hexdigest()
+            batch.pixels[texture_hash] = pixels
+        else:
+            texture_hash = self.rng.randbytes(20).hex()
+        upload_id = self.next_id("uploads")
+        batch.uploads.append((upload_id, texture_hash, user_id, time, False))
+        if len(self.shared) < self.options.shared_uploads:
+            self.shared.append(upload_id)
+        return upload_id
+
+
+def encode_png(pixels: bytes) -> bytes:
+    data = BytesIO()
+    Image.frombytes("RGBA", (64, 64), pixels).save(data, "PNG")
+    return data.getvalue()
+
+
+async def copy_rows(
+    conn: AsyncConnection, table: Table, rows: Sequence[tuple[Any, ...]]
+) -> None:
+    columns = [column.name for column in table.columns]
+    if conn.dialect.name != "postgresql":
+        await conn.execute(
+            table.insert(), [dict(zip(columns, row, strict=True)) for row in rows]
+        )
+        return
+
+    json_columns = [isinstance(column.type, JSON) for column in table.columns]
+    raw = await conn.get_raw_connection()
+    assert raw.driver_connection is not None
+    async with raw.driver_connection.cursor() as cursor:
+        statement = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+        async with cursor.copy(statement) as copy:
+            for row in rows:
+                await copy.write_row(
+                    [
+                        json.dumps(value) if is_json else value
+                        for value, is_json in zip(row, json_columns, strict=True)
+                    ]
+                )
+
+
+async def last_ids(conn: AsyncConnection) -> dict[str, int]:
+    ids = {}
+    for model in (models.User, models.Upload, models.Texture):
+        last = await conn.scalar(select(func.coalesce(func.max(model.id), 0)))
+        ids[model.__tablename__] = last or 0
+    return ids
+
+
+async def write_files(files: Files, pixels: dict[str, bytes], workers: int) -> None:
+    limiter = anyio.CapacityLimiter(workers)
+
+    async def write(texture_hash: str, data: bytes) -> None:
+        async with limiter:
+            png = await anyio.to_thread.run_sync(encode_png, data)
+            await files.put_file(texture_hash, png)
+
+    async with anyio.create_task_group() as tg:
+        for texture_hash, data in pixels.items():
+            tg.start_soon(write, texture_hash, data)
+
+
+async def generate(
+    engine: AsyncEngine,
+    options: Options,
+    *,
+    files: Files | None = None,
+    workers: int = 16,
+) -> dict[str, int]:
+    """Add the users of a dataset, committing every batch.
+
+    Returns the number of rows added to each table.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+        generator = Generator(options, await last_ids(conn), pixels=files is not None)
+
+    added = dict.fromkeys(generator.next_ids, 0)
+    for start in range(0, options.users, options.batch_size):
+        batch = generator.batch(min(options.batch_size, options.users - start))
+        async with engine.begin() as conn:
+            for table, rows in batch.rows().items():
+                await copy_rows(conn, models.Base.metadata.tables[table], rows)
+                added[table] += len(rows)
+        if files is not None:
+            await write_files(files, batch.pixels, workers)
+
+    if engine.dialect.name == "postgresql":
+        async with engine.begin() as conn:
+            # COPY with explicit ids leaves the sequences behind
+            for table in added:
+                await conn.execute(
+                    text(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'),"
+                        f" (SELECT max(id) FROM {table}))"
+                    )
+                )
+    return added
+
+
+async def main(args: argparse.Namespace) -> None:
+    from valhalla.config import settings
+    from valhalla.database import engine
+    from valhalla.files import get_filesystem, get_s3_http
+
+    options = Options(
+        users=args.users,
+        seed=args.seed,
+        alpha=args.alpha,
+        max_changes=args.max_changes,
+        reuse=args.reuse,
+        capes=args.capes,
+        days=args.days,
+        batch_size=args.batch_size,
+        shared_uploads=args.shared_uploads,
+    )
+    http = get_s3_http()
+    files = Files(get_filesystem(settings, http)) if args.write_files else None
+    start = time.perf_counter()
+    try:
+        added = await generate(engine, options, files=files, workers=args.workers)
+    finally:
+        await http.aclose()
+    elapsed = time.perf_counter() - start
+
+    rows = sum(added.values())
+    print(", ".join(f"{count} {table}" for table, count in added.items()))
+    print(f"{rows / elapsed:.0f} rows/s in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=1.2,
+        help="pareto shape of the skins per user, lower is a longer tail",
+    )
+    parser.add_argument("--max-changes", type=int, default=500)
+    parser.add_argument(
+        "--reuse", type=float, default=0.3, help="share of changes to earlier uploads"
+    )
+    parser.add_argument(
+        "--capes", type=float, default=0.05, help="share of users with a cape"
+    )
+    parser.add_argument("--days", type=float, default=5 * 365, help="history span")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="users")
+    parser.add_argument(
+        "--shared-uploads",
+        type=int,
+        default=100_000,
+        help="earlier uploads which changes can reuse",
+    )
+    parser.add_argument("--write-files", action="store_true")
+    parser.add_argument("--workers", type=int, default=16, help="PNG writers")
+    anyio.run(main, parser.parse_args())
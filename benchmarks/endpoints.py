@@ -0,0 +1,340 @@
+"""Measure the latency and throughput of the main API endpoints.
+
+    python -m benchmarks.endpoints --save baseline.json
+    python -m benchmarks.endpoints --compare baseline.json
+
+A dataset from `benchmarks.dataset` is generated into a temporary SQLite
+database, or the database of `--database-url`. The app is called in-process, or
+over HTTP with `--uvicorn`. Statements per request are only counted in-process.
+
+Saved results can be compared with later runs, which exits with an error if a
+scenario got slower than `--threshold`.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import Any
+from uuid import NAMESPACE_OID, UUID, uuid5
+
+import anyio
+import httpx
+
+scenarios = ["user", "bulk", "history", "upload", "login"]
+
+
+@dataclass
+class Result:
+    requests: int
+    errors: int
+    rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    queries_per_request: float | None
+
+
+@dataclass
+class Client:
+    http: httpx.AsyncClient
+    users: list[tuple[UUID, str]]
+    skins: list[bytes]
+    rng: random.Random
+
+    def user(self) -> tuple[UUID, str]:
+        return self.rng.choice(self.users)
+
+
+async def seed(count: int, seed: int) -> None:
+    from benchmarks import dataset
+    from valhalla.config import get_settings
+    from valhalla.database import engine
+    from valhalla.files import Files, get_filesystem, get_s3_http
+
+    files = Files(get_filesystem(get_settings(), get_s3_http()))
+    options = dataset.Options(users=count, seed=seed, days=365)
+    await dataset.generate(engine, options, files=files)
+
+
+async def load_users(count: int) -> list[tuple[UUID, str]]:
+    from sqlalchemy import select
+
+    from valhalla import models
+    from valhalla.auth import token_from_user
+    from valhalla.database import SessionLocal
+
+    async with SessionLocal() as db:
+        users = await db.scalars(
+            select(models.User).order_by(models.User.id).limit(count)
+        )
+        return [
+            (user.uuid, token_from_user(user, expire_in=timedelta(hours=1)))
+            for user in users
+        ]
+
+
+async def get_user(client: Client) -> httpx.Response:
+    uuid, _ = client.user()
+    return await client.http.get(f"/api/v1/user/{uuid}")
+
+
+async def bulk(client: Client) -> httpx.Response:
+    uuids = [str(client.user()[0]) for _ in range(50)]
+    return await client.http.post("/api/v1/bulk_textures", json={"uuids": uuids})
+
+
+async def history(client: Client) -> httpx.Response:
+    uuid, _ = client.user()
+    return await client.http.get(f"/api/v1/history/{uuid}", params={"limit": 10})
+
+
+async def upload(client: Client) -> httpx.Response:
+    _, token = client.user()
+    return await client.http.put(
+        "/api/v1/textures",
+        headers={"authorization": f"Bearer {token}"},
+        files={"file": ("skin.png", client.rng.choice(client.skins), "image/png")},
+        data={"type": "skin"},
+    )
+
+
+async def login(client: Client) -> httpx.Response:
+    uuid, _ = client.user()
+    name = f"P{uuid.hex[:8]}"
+    response = await client.http.post("/api/v1/auth/minecraft", data={"name": name})
+    if response.is_error:
+        return response
+    return await client.http.post(
+        "/api/v1/auth/minecraft/callback",
+        data={"name": name, "verifyToken": response.json()["verifyToken"]},
+    )
+
+
+requests: dict[str, Callable[[Client], Awaitable[httpx.Response]]] = {
+    "user": get_user,
+    "bulk": bulk,
+    "history": history,
+    "upload": upload,
+    "login": login,
+}
+
+
+@contextmanager
+def count_statements() -> Iterator[list[int]]:
+    from sqlalchemy import event
+
+    from valhalla.database import engine
+
+    count = [0]
+
+    def before_cursor_execute(*args: object) -> None:
+        count[0] += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield count
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+async def measure(
+    client: Client, scenario: str, args: argparse.Namespace, *, in_process: bool
+) -> Result:
+    request = requests[scenario]
+    for _ in range(args.warmup):
+        await request(client)
+
+    latencies: list[float] = []
+    errors = 0
+    limit = anyio.Semaphore(args.concurrency)
+
+    async def run() -> None:
+        nonlocal errors
+        async with limit:
+            start = time.perf_counter()
+            response = await request(client)
+            latencies.append(time.perf_counter() - start)
+            errors += response.is_error
+
+    with count_statements() as statements:
+        start = time.perf_counter()
+        async with anyio.create_task_group() as tg:
+            for _ in range(args.requests):
+                tg.start_soon(run)
+        elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return Result(
+        requests=args.requests,
+        errors=errors,
+        rps=args.requests / elapsed,
+        p50_ms=quantiles[49] * 1000,
+        p95_ms=quantiles[94] * 1000,
+        p99_ms=quantiles[98] * 1000,
+        queries_per_request=statements[0] / args.requests if in_process else None,
+    )
+
+
+@contextmanager
+def serve(args: argparse.Namespace) -> Iterator[str]:
+    port = 8765
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "valhalla.app:app",
+            f"--port={port}",
+            f"--workers={args.workers}",
+            "--log-level=warning",
+        ],
+        env={**os.environ, "RATELIMIT_ENABLED": "false"},
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(url)
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    from benchmarks.dataset import encode_png
+    from valhalla import mojang
+    from valhalla.app import app
+    from valhalla.limit import limiter
+
+    rng = random.Random(args.seed)
+    skins = [encode_png(rng.randbytes(64 * 64 * 4)) for _ in range(args.skins)]
+    if not args.no_seed:
+        await seed(args.users, args.seed)
+    users = await load_users(args.users)
+
+    results: dict[str, Result] = {}
+    if args.uvicorn:
+        with serve(args) as url:
+            async with httpx.AsyncClient(base_url=url, timeout=60) as http:
+                client = Client(http, users, skins, rng)
+                for scenario in args.scenarios:
+                    if scenario == "login":
+                        # needs Mojang, which is only replaced in-process
+                        continue
+                    results[scenario] = await measure(
+                        client, scenario, args, in_process=False
+                    )
+    else:
+        limiter.enabled = False
+
+        async def has_joined(
+            *, username: str, server_id: str
+        ) -> mojang.HasJoinedResponse:
+            uuid = uuid5(NAMESPACE_OID, username)
+            return mojang.HasJoinedResponse(id=uuid, name=username)
+
+        mojang.has_joined = has_joined
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as http:
+            client = Client(http, users, skins, rng)
+            for scenario in args.scenarios:
+                results[scenario] = await measure(
+                    client, scenario, args, in_process=True
+                )
+
+    return {
+        "environment": {
+            "mode": "uvicorn" if args.uvicorn else "in-process",
+            "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+            "python": platform.python_version(),
+            "users": args.users,
+            "concurrency": args.concurrency,
+        },
+        "results": {name: asdict(result) for name, result in results.items()},
+    }
+
+
+def report(
+    run: dict[str, Any], baseline: dict[str, Any] | None, threshold: float
+) -> bool:
+    """Print the results, and return whether any got slower than the baseline."""
+    regressed = False
+    print(f"{'':>8} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8} errors")
+    for name, result in run["results"].items():
+        queries = result["queries_per_request"]
+        line = (
+            f"{name:>8} {result['rps']:9.1f} {result['p50_ms']:7.1f}ms"
+            f" {result['p95_ms']:7.1f}ms {result['p99_ms']:7.1f}ms"
+            f" {'-' if queries is None else f'{queries:.1f}':>8} {result['errors']}"
+        )
+        before = baseline and baseline["results"].get(name)
+        if before:
+            change = result["p95_ms"] / before["p95_ms"] - 1
+            line += f"  p95 {change:+.0%} against the baseline"
+            if change > threshold:
+                line += " (regressed)"
+                regressed = True
+        print(line)
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--database-url",
+        help="defaults to a new SQLite database in a temporary directory",
+    )
+    parser.add_argument("--no-seed", action="store_true", help="use the existing users")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--skins", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenarios", nargs="+", choices=scenarios, default=scenarios)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument(
+        "--uvicorn", action="store_true", help="serve the app over HTTP"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--save", type=Path, help="write the results as JSON")
+    parser.add_argument("--compare", type=Path, help="JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="p95 increase counted as a regression",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # the settings are read when valhalla is first imported
+        os.environ["DATABASE_URL"] = (
+            args.database_url or f"sqlite:///{directory}/valhalla.db"
+        )
+        os.environ["TEXTURES_PATH"] = f"{directory}/textures"
+        os.environ.setdefault("SECRET_KEY", "benchmark")
+        run = anyio.run(main, args)
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    regressed = report(run, baseline, args.threshold)
+    if args.save:
+        args.save.write_text(json.dumps(run, indent=2))
+    sys.exit(1 if regressed else 0)
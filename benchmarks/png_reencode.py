@@ -0,0 +1,52 @@
+"""Report the bytes saved by re-encoding a corpus of skins.
+
+    python -m benchmarks.png_reencode [directory ...]
+
+Every PNG in the directories is re-encoded like an upload would be. Egress is
+saved in the same proportion as storage, for each time a texture is served.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from valhalla import image
+
+default_corpus = Path(image.__file__).parent / "tests" / "assets" / "good"
+
+
+def main(args: argparse.Namespace) -> None:
+    original_total = optimized_total = count = 0
+    elapsed = 0.0
+    for directory in args.directories:
+        for path in sorted(directory.rglob("*.png")):
+            data = path.read_bytes()
+            start = time.perf_counter()
+            try:
+                _, optimized = image.prepare_skin(data)
+            except Exception as e:
+                print(f"{path}: skipped, {e}")
+                continue
+            elapsed += time.perf_counter() - start
+            count += 1
+            original_total += len(data)
+            optimized_total += len(optimized)
+            if args.verbose:
+                print(f"{path}: {len(data)} -> {len(optimized)} bytes")
+
+    if not count:
+        print("No skins found")
+        return
+    saved = original_total - optimized_total
+    print(
+        f"{count} skins: {original_total} -> {optimized_total} bytes, "
+        f"saved {saved} bytes ({saved / original_total:.1%}), "
+        f"{elapsed / count * 1000:.1f}ms per skin"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directories", nargs="*", type=Path, default=[default_corpus])
+    parser.add_argument("-v", "--verbose", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+"""Compare texture uploads to S3 through worker threads and the async client.
+
+Run it against any S3 compatible endpoint, e.g. `moto_server` or MinIO:
+
+    AWS_ACCESS_KEY_ID=testing AWS_SECRET_ACCESS_KEY=testing \\
+    AWS_ENDPOINT_URL=http://localhost:5000 \\
+    python -m benchmarks.s3_upload --bucket textures
+
+Reports the upload latency, and the most worker threads in use at once.
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from io import BytesIO
+
+import anyio
+import anyio.to_thread
+import boto3
+
+from valhalla.files import S3Path, get_s3_client, get_s3_http
+
+
+async def measure(
+    name: str, upload: Callable[[int], Awaitable[None]], args: argparse.Namespace
+) -> None:
+    latencies: list[float] = []
+    peak_threads = threading.active_count()
+    limit = anyio.Semaphore(args.concurrency)
+
+    async def run(n: int) -> None:
+        nonlocal peak_threads
+        async with limit:
+            start = time.perf_counter()
+            await upload(n)
+            latencies.append(time.perf_counter() - start)
+            peak_threads = max(peak_threads, threading.active_count())
+
+    start = time.perf_counter()
+    async with anyio.create_task_group() as tg:
+        for n in range(args.uploads):
+            tg.start_soon(run, n)
+    elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:>8}: {args.uploads / elapsed:8.1f} uploads/s"
+        f"  p50 {quantiles[49] * 1000:7.1f}ms"
+        f"  p95 {quantiles[94] * 1000:7.1f}ms"
+        f"  peak threads {peak_threads}"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    data = os.urandom(args.size)
+    s3_client = get_s3_client()
+    s3_client.create_bucket(Bucket=args.bucket)
+    run_id = time.time_ns()
+
+    async def threaded(n: int) -> None:
+        # what uploads did before: a new client and blocking calls in a thread
+        def put() -> None:
+            client = boto3.client("s3") if args.new_clients else s3_client
+            client.upload_fileobj(BytesIO(data), args.bucket, f"threaded/{run_id}/{n}")
+
+        await anyio.to_thread.run_sync(put)
+
+    root = S3Path(s3_client, get_s3_http(), args.bucket, f"async/{run_id}")
+
+    async def native(n: int) -> None:
+        await (root / str(n)).write_bytes(data, content_type="image/png")
+
+    await measure("threaded", threaded, args)
+    await measure("async", native, args)
+    await get_s3_http().aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bucket", default="valhalla-benchmark")
+    parser.add_argument("--uploads", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--size", type=int, default=8 * 1024, help="bytes")
+    parser.add_argument(
+        "--new-clients",
+        action="store_true",
+        help="create a boto3 client for every threaded upload",
+    )
+    anyio.run(main, parser.parse_args())
@@ -0,0 +1,84 @@
+"""Compare serving local textures with StaticFiles and the texture route.
+
+    python -m benchmarks.texture_serving
+
+Both apps are called in-process, so this measures the time spent in the
+application rather than the network.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import anyio
+import httpx
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+
+from valhalla import static
+from valhalla.config import settings
+from valhalla.files import FilePath
+
+
+async def measure(
+    name: str, app: FastAPI, keys: list[str], args: argparse.Namespace
+) -> None:
+    transport = httpx.ASGITransport(app=app)
+    limit = anyio.Semaphore(args.concurrency)
+    revalidated = 0
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+
+        async def fetch(key: str) -> None:
+            nonlocal revalidated
+            async with limit:
+                resp = await http.get(f"/textures/{key}")
+                resp.raise_for_status()
+                # what a cache does once it has the texture
+                resp = await http.get(
+                    f"/textures/{key}",
+                    headers={"If-None-Match": resp.headers["etag"]},
+                )
+                revalidated += resp.status_code == httpx.codes.NOT_MODIFIED
+
+        start = time.perf_counter()
+        async with anyio.create_task_group() as tg:
+            for _ in range(args.requests):
+                tg.start_soon(fetch, random.choice(keys))
+        elapsed = time.perf_counter() - start
+
+    print(
+        f"{name:>12}: {args.requests * 2 / elapsed:8.1f} requests/s"
+        f"  {revalidated}/{args.requests} revalidations answered with 304"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        root = FilePath(Path(directory))
+        keys = [os.urandom(20).hex() for _ in range(args.textures)]
+        for key in keys:
+            await (root / key).create(os.urandom(args.size))
+
+        mount = FastAPI()
+        mount.mount("/textures", StaticFiles(directory=directory))
+
+        route = FastAPI()
+        route.include_router(static.router)
+        settings.textures_path = directory
+        settings.textures_shard_depth = 0
+
+        await measure("StaticFiles", mount, keys, args)
+        await measure("route", route, keys, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--textures", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--size", type=int, default=8 * 1024, help="bytes")
+    anyio.run(main, parser.parse_args())
@@ -0,0 +1,191 @@
+"""Maintenance commands, run with `python -m valhalla <command>`."""
+
+import argparse
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from pathlib import Path
+
+import anyio
+
+from . import derivatives, garbage, partitioning, retention
+from .api.v1.textures import upload_expiry
+from .config import settings
+from .crud import CRUD
+from .database import SessionLocal, engine
+from .files import Files, S3Path, get_filesystem, get_s3_client, get_s3_http, relayout
+
+
+def relayout_command(args: argparse.Namespace) -> None:
+    moved = relayout(args.path, args.depth, workers=args.workers)
+    print(f"Moved {moved} textures")
+
+
+@asynccontextmanager
+async def connect() -> AsyncGenerator[tuple[CRUD, Files]]:
+    http = get_s3_http()
+    try:
+        async with SessionLocal() as db:
+            yield CRUD(db), Files(get_filesystem(settings, http))
+    finally:
+        await http.aclose()
+
+
+async def backfill_derivatives(workers: int) -> int:
+    async with connect() as (crud, files):
+        return await derivatives.backfill(crud, files, workers=workers)
+
+
+def derivatives_command(args: argparse.Namespace) -> None:
+    rendered = anyio.run(backfill_derivatives, args.workers)
+    print(f"Rendered the derivatives of {rendered} skins")
+
+
+async def collect_garbage(args: argparse.Namespace) -> None:
+    grace = timedelta(hours=args.grace_period)
+    async with connect() as (crud, files):
+        uploads = await garbage.collect_uploads(
+            crud, files, grace=grace, batch_size=args.batch_size, dry_run=args.dry_run
+        )
+        stored = await garbage.collect_files(
+            crud, files, grace=grace, batch_size=args.batch_size, dry_run=args.dry_run
+        )
+        staged = 0
+        if settings.textures_bucket is not None:
+            staging = S3Path(
+                get_s3_client(),
+                get_s3_http(),
+                settings.textures_bucket,
+                settings.textures_staging_path,
+            )
+            staged = await garbage.collect_staged(
+                staging,
+                # kept until they can no longer be completed
+                grace=max(grace, upload_expiry),
+                batch_size=args.batch_size,
+                dry_run=args.dry_run,
+            )
+    deleted = "Would delete" if args.dry_run else "Deleted"
+    print(
+        f"{deleted} {uploads} unused uploads, {stored} orphaned files"
+        f" and {staged} abandoned staged uploads"
+    )
+
+
+def gc_command(args: argparse.Namespace) -> None:
+    anyio.run(collect_garbage, args)
+
+
+async def compact_history(args: argparse.Namespace) -> tuple[int, int]:
+    async with connect() as (crud, _):
+        return await retention.compact(
+            crud,
+            keep_last=args.keep_last,
+            keep_days=args.keep_days,
+            batch_size=args.batch_size,
+        )
+
+
+def compact_command(args: argparse.Namespace) -> None:
+    if args.keep_last is None and args.keep_days is None:
+        args.parser.error("set --keep-last or --keep-days")
+    archived, pruned = anyio.run(compact_history, args)
+    print(f"Archived {archived} textures and deleted {pruned} superseded changes")
+
+
+async def partition(args: argparse.Namespace) -> None:
+    if engine.dialect.name != "postgresql":
+        args.parser.error("partitioning needs a Postgres database")
+    async with engine.begin() as conn:
+        if args.undo:
+            await conn.run_sync(partitioning.unpartition_textures)
+        else:
+            await conn.run_sync(partitioning.partition_textures, args.partitions)
+    await engine.dispose()
+
+
+def partition_command(args: argparse.Namespace) -> None:
+    anyio.run(partition, args)
+    if args.undo:
+        print("Merged the partitions of the textures table")
+    else:
+        print(f"Partitioned the textures table into {args.partitions}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m valhalla")
+    commands = parser.add_subparsers(required=True)
+
+    relayout_parser = commands.add_parser(
+        "relayout",
+        help="move local textures into the layout of TEXTURES_SHARD_DEPTH",
+        description="Stop the server before moving the textures, and start it "
+        "again with the new TEXTURES_SHARD_DEPTH afterwards.",
+    )
+    relayout_parser.add_argument(
+        "path", nargs="?", type=Path, default=Path(settings.textures_path)
+    )
+    relayout_parser.add_argument(
+        "--depth", type=int, default=settings.textures_shard_depth
+    )
+    relayout_parser.add_argument("--workers", type=int, default=16)
+    relayout_parser.set_defaults(func=relayout_command)
+
+    derivatives_parser = commands.add_parser(
+        "derivatives",
+        help="render the faces and busts of skins uploaded before they were "
+        "rendered on upload",
+    )
+    derivatives_parser.add_argument("--workers", type=int, default=16)
+    derivatives_parser.set_defaults(func=derivatives_command)
+
+    gc_parser = commands.add_parser(
+        "gc",
+        help="delete the uploads no texture uses, the stored files no upload has, "
+        "and the direct uploads which were never completed",
+    )
+    gc_parser.add_argument(
+        "--grace-period",
+        type=float,
+        default=24,
+        help="hours to keep new uploads and files for (default: %(default)s)",
+    )
+    gc_parser.add_argument("--batch-size", type=int, default=1000)
+    gc_parser.add_argument(
+        "--dry-run", action="store_true", help="only count what would be deleted"
+    )
+    gc_parser.set_defaults(func=gc_command)
+
+    compact_parser = commands.add_parser(
+        "compact",
+        help="move old texture history to the archive table",
+        description="Ended textures are kept if they are one of the last "
+        "--keep-last of their user and type, or ended less than --keep-days ago. "
+        "Only the latest change of each user is kept for the change feed.",
+    )
+    compact_parser.add_argument(
+        "--keep-last", type=int, default=settings.history_keep_last
+    )
+    compact_parser.add_argument(
+        "--keep-days", type=float, default=settings.history_keep_days
+    )
+    compact_parser.add_argument("--batch-size", type=int, default=1000, help="users")
+    compact_parser.set_defaults(func=compact_command, parser=compact_parser)
+
+    partition_parser = commands.add_parser(
+        "partition",
+        help="split the textures table into partitions by user, on Postgres",
+        description="The table is locked while all of its rows are copied.",
+    )
+    partition_parser.add_argument("--partitions", type=int, default=16)
+    partition_parser.add_argument(
+        "--undo", action="store_true", help="merge the partitions into one table"
+    )
+    partition_parser.set_defaults(func=partition_command, parser=partition_parser)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
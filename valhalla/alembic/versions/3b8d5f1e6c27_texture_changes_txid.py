@@ -0,0 +1,31 @@
+"""texture changes txid
+
+Revision ID: 3b8d5f1e6c27
+Revises: 9f1c3e5a7b42
+Create Date: 2026-10-19 21:12:36.804715
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3b8d5f1e6c27"
+down_revision = "9f1c3e5a7b42"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # new databases get their tables and indexes when the app starts
+    if not sa.inspect(op.get_bind()).has_table("texture_changes"):
+        return
+    # the changes made before this are not returned by the feed on Postgres,
+    # so clients should get a new cursor
+    op.add_column("texture_changes", sa.Column("txid", sa.BigInteger(), nullable=True))
+    op.create_index("ix_texture_changes_txid", "texture_changes", ["txid"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_texture_changes_txid", "texture_changes")
+    op.drop_column("texture_changes", "txid")
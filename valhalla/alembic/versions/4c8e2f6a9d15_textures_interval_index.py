@@ -0,0 +1,31 @@
+"""textures interval index
+
+Revision ID: 4c8e2f6a9d15
+Revises: b1d4e7a0c2f3
+Create Date: 2026-10-19 11:03:17.204881
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4c8e2f6a9d15"
+down_revision = "b1d4e7a0c2f3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # new databases get their tables and indexes when the app starts
+    if not sa.inspect(op.get_bind()).has_table("textures"):
+        return
+    op.create_index(
+        "ix_textures_user_id_tex_type_start_time_end_time",
+        "textures",
+        ["user_id", "tex_type", "start_time", "end_time"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_textures_user_id_tex_type_start_time_end_time", "textures")
@@ -0,0 +1,38 @@
+"""upload derivatives
+
+Revision ID: 7d3a9c1e5b20
+Revises: 4c8e2f6a9d15
+Create Date: 2026-10-19 14:26:52.730114
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7d3a9c1e5b20"
+down_revision = "4c8e2f6a9d15"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # new databases get their tables when the app starts
+    if not sa.inspect(op.get_bind()).has_table("uploads"):
+        return
+    # existing skins get their derivatives with `python -m valhalla derivatives`
+    op.add_column(
+        "uploads",
+        sa.Column(
+            "has_derivatives",
+            sa.Boolean(),
+            nullable=False,
+            server_default=sa.false(),
+        ),
+    )
+
+
+def downgrade() -> None:
+    # sqlite can't drop columns in place
+    with op.batch_alter_table("uploads") as batch_op:
+        batch_op.drop_column("has_derivatives")
@@ -0,0 +1,35 @@
+"""partition textures
+
+Revision ID: 9f1c3e5a7b42
+Revises: e2b7f4c81a36
+Create Date: 2026-10-19 18:05:44.102937
+
+"""
+
+import sqlalchemy as sa
+from alembic import context, op
+
+from valhalla.partitioning import partition_textures, unpartition_textures
+
+# revision identifiers, used by Alembic.
+revision = "9f1c3e5a7b42"
+down_revision = "e2b7f4c81a36"
+branch_labels = None
+depends_on = None
+
+
+def applies() -> bool:
+    bind = op.get_bind()
+    return bind.dialect.name == "postgresql" and sa.inspect(bind).has_table("textures")
+
+
+def upgrade() -> None:
+    # opt in with `alembic -x textures_partitions=16 upgrade head`
+    partitions = context.get_x_argument(as_dictionary=True).get("textures_partitions")
+    if partitions and applies():
+        partition_textures(op.get_bind(), int(partitions))
+
+
+def downgrade() -> None:
+    if applies():
+        unpartition_textures(op.get_bind())
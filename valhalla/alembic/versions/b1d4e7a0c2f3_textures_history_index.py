@@ -0,0 +1,29 @@
+"""textures history index
+
+Revision ID: b1d4e7a0c2f3
+Revises: 6ca6cdcf1416
+Create Date: 2026-10-19 10:12:41.518270
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b1d4e7a0c2f3"
+down_revision = "6ca6cdcf1416"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # new databases get their tables and indexes when the app starts
+    if not sa.inspect(op.get_bind()).has_table("textures"):
+        return
+    op.create_index(
+        "ix_textures_user_id_tex_type_id", "textures", ["user_id", "tex_type", "id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_textures_user_id_tex_type_id", "textures")
@@ -0,0 +1,27 @@
+"""textures upload index
+
+Revision ID: e2b7f4c81a36
+Revises: 7d3a9c1e5b20
+Create Date: 2026-10-19 17:24:08.519342
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e2b7f4c81a36"
+down_revision = "7d3a9c1e5b20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # new databases get their tables and indexes when the app starts
+    if not sa.inspect(op.get_bind()).has_table("textures"):
+        return
+    op.create_index("ix_textures_upload_id", "textures", ["upload_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_textures_upload_id", "textures")
@@ -1,11 +1,13 @@
 from fastapi import APIRouter
 
-from . import auth, bulk, history, legacy, textures, user
+from . import auth, bulk, changes, history, jobs, legacy, textures, user
 
 router = APIRouter()
 router.include_router(auth.router)
 router.include_router(bulk.router)
+router.include_router(changes.router)
 router.include_router(history.router)
+router.include_router(jobs.router)
 router.include_router(legacy.router)
 router.include_router(textures.router)
 router.include_router(user.router)
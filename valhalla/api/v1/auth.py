@@ -7,7 +7,7 @@ from expiringdict import ExpiringDict
 from fastapi import APIRouter, Depends, Form, HTTPException, Request, Response
 from fastapi.responses import RedirectResponse
 
-from ... import auth, mojang, xbox
+from ... import auth, metrics, mojang, xbox
 from ...config import settings
 from ...crud import CRUD
 from ...schemas import LoginMinecraftHandshakeResponse, LoginResponse
@@ -72,19 +72,18 @@ async def minecraft_login_callback(
         server_id=settings.server_id,
     )
 
-    user = await crud.get_or_create_user(joined.id, joined.name)
+    user = await crud.transaction(
+        lambda crud: crud.get_or_create_user(joined.id, joined.name)
+    )
     token = auth.token_from_user(user, expire_in=timedelta(hours=1))
     auth_header = f"Bearer {token}"
 
     response.headers["Authorization"] = token
 
-    try:
-        return LoginResponse(
-            access_token=auth_header,
-            user_id=user.uuid,
-        )
-    finally:
-        await crud.db.commit()
+    return LoginResponse(
+        access_token=auth_header,
+        user_id=user.uuid,
+    )
 
 
 xboxlive: StarletteOAuth2App = OAuth().register(
@@ -110,12 +109,15 @@ async def xbox_login_callback(
     if not request.client:
         raise HTTPException(400)
     try:
-        token = await xboxlive.authorize_access_token(request)
+        with metrics.outbound_request_seconds.labels("microsoft").time():
+            token = await xboxlive.authorize_access_token(request)
         profile = await xbox.login_with_xbox(token["access_token"])
     except (OAuthError, xbox.XboxLoginError) as e:
         raise HTTPException(403, str(e)) from None
     else:
-        user = await crud.get_or_create_user(profile.id, profile.name)
+        user = await crud.transaction(
+            lambda crud: crud.get_or_create_user(profile.id, profile.name)
+        )
         expires = timedelta(days=365)
         token = auth.token_from_user(user, expire_in=expires)
 
@@ -129,5 +131,4 @@ async def xbox_login_callback(
             expires=int(expires.total_seconds()),
         )
 
-        await crud.db.commit()
         return response
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Annotated
 
 from fastapi import APIRouter, Depends
@@ -6,7 +7,7 @@ from valhalla.api.v1.utils import get_textures_url
 
 from ...crud import CRUD
 from ...schemas import BulkRequest, BulkResponse
-from .user import get_user_textures
+from .user import user_textures_response
 
 router = APIRouter(tags=["User information"])
 
@@ -16,14 +17,18 @@ async def bulk_request_textures(
     body: BulkRequest,
     crud: Annotated[CRUD, Depends()],
     textures_url: str = Depends(get_textures_url),
+    at: datetime | None = None,
 ) -> BulkResponse:
     """Bulk request several user textures.
 
-    If a requested user does not have any textures, it is ignored.
+    If a requested user does not have any textures, it is ignored. Pass `at` to
+    get the textures the users had at that time.
     """
+    users = await crud.resolve_uuids(body.uuids)
+    textures = await crud.get_users_textures(users, at=at)
     return BulkResponse(
         users=[
-            await get_user_textures(user, None, crud, textures_url)
-            async for user in crud.resolve_uuids(body.uuids)
+            user_textures_response(user, textures.get(user.id, {}), textures_url)
+            for user in users
         ]
     )
@@ -0,0 +1,91 @@
+from collections.abc import AsyncGenerator, Iterable
+from typing import Annotated
+from uuid import UUID
+
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette import status
+
+from ...crud import CRUD
+from ...events import broker
+from ...schemas import BulkRequest, ProfileChangeEvent, ProfileChanges
+
+router = APIRouter(tags=["User information"])
+
+max_subscription_profiles = 10_000
+keepalive_interval = 15
+
+
+@router.get("/changes")
+async def get_profile_changes(
+    crud: Annotated[CRUD, Depends()],
+    since: Annotated[int | None, Query(ge=0)] = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+) -> ProfileChanges:
+    """Get the profiles whose textures changed since a cursor.
+
+    Call this without `since` to get the current cursor, then pass the returned
+    `cursor` on each following request to receive only the profiles that
+    changed in between. If `hasMore` is true, request again right away.
+    """
+    if since is None:
+        cursor = await crud.get_changes_cursor()
+        return ProfileChanges(cursor=cursor, profile_ids=[], has_more=False)
+
+    changes = await crud.get_changed_users(since, limit=limit + 1)
+    has_more = len(changes) > limit
+    if has_more:
+        # users changed by the same transaction share a cursor, so they must be
+        # on the same page, even if there are more of them than the limit
+        next_cursor = changes[limit][1]
+        changes = [change for change in changes if change[1] < next_cursor]
+        if not changes:
+            changes = await crud.get_changed_users(since, until=next_cursor)
+    return ProfileChanges(
+        cursor=changes[-1][1] if changes else since,
+        profile_ids=[uuid for uuid, _ in changes],
+        has_more=has_more,
+    )
+
+
+@router.post("/changes/subscribe", response_class=StreamingResponse)
+async def subscribe_profile_changes(body: BulkRequest) -> StreamingResponse:
+    """Subscribe to texture changes of several users.
+
+    The response is an event stream which sends a `change` event with the
+    `profileId` whenever one of the users changes their textures. If the client
+    falls too far behind, a `resync` event is sent instead and all of the users
+    should be requested again.
+    """
+    if len(body.uuids) > max_subscription_profiles:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"Cannot subscribe to more than {max_subscription_profiles} users",
+        )
+
+    return StreamingResponse(
+        stream_profile_changes(body.uuids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_profile_changes(
+    profile_ids: Iterable[UUID],
+) -> AsyncGenerator[str]:
+    with broker.subscribe(profile_ids) as sub:
+        while True:
+            with anyio.move_on_after(keepalive_interval) as scope:
+                changes = await sub.get()
+            if scope.cancelled_caught:
+                yield ": keepalive\n\n"
+            elif changes is None:
+                yield "event: resync\ndata: {}\n\n"
+            else:
+                yield "".join(
+                    "event: change\ndata: "
+                    f"{ProfileChangeEvent(profile_id=p).model_dump_json(by_alias=True)}"
+                    "\n\n"
+                    for p in changes
+                )
@@ -3,7 +3,7 @@ from typing import Annotated
 from urllib.parse import urljoin
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 
 from valhalla.api.v1.utils import get_textures_url
 
@@ -19,10 +19,20 @@ async def get_current_user_texture_history(
     user: Annotated[models.User, Depends(require_user)],
     crud: Annotated[CRUD, Depends()],
     textures_url: Annotated[str, Depends(get_textures_url)],
-    limit: int | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
     at: datetime | None = None,
+    before: int | None = None,
+    type: str | None = None,
 ) -> schemas.UserTextureHistory:
-    return await get_user_texture_history(user, limit, at, crud, textures_url)
+    """Get the texture history of the current user.
+
+    At most `limit` entries are returned for each type. To page through the
+    history of a texture type, pass the `type` and the `id` of the last entry
+    received as `before`.
+    """
+    return await get_user_texture_history(
+        user, limit, at, before, type, crud, textures_url
+    )
 
 
 @router.get("/history/{user_id}")
@@ -30,30 +40,45 @@ async def get_user_texture_history_by_uuid(
     crud: Annotated[CRUD, Depends()],
     textures_url: Annotated[str, Depends(get_textures_url)],
     user_id: UUID,
-    limit: int | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
     at: datetime | None = None,
+    before: int | None = None,
+    type: str | None = None,
 ) -> schemas.UserTextureHistory:
+    """Get the texture history of a user.
+
+    At most `limit` entries are returned for each type. To page through the
+    history of a texture type, pass the `type` and the `id` of the last entry
+    received as `before`.
+    """
     user = await crud.get_user_by_uuid(user_id)
     if user is None:
         raise HTTPException(404)
 
-    return await get_user_texture_history(user, limit, at, crud, textures_url)
+    return await get_user_texture_history(
+        user, limit, at, before, type, crud, textures_url
+    )
 
 
 async def get_user_texture_history(
     user: models.User,
-    limit: int | None,
+    limit: int,
     at: datetime | None,
+    before: int | None,
+    tex_type: str | None,
     crud: CRUD,
     textures_url: str,
 ) -> schemas.UserTextureHistory:
-    textures = await crud.get_user_textures_history(user, limit=limit, at=at)
+    textures = await crud.get_user_textures_history(
+        user, limit=limit, at=at, before=before, tex_type=tex_type
+    )
     return schemas.UserTextureHistory(
         profile_id=user.uuid,
         profile_name=user.name,
         textures={
             key: [
                 schemas.TextureHistoryEntry(
+                    id=entry.id,
                     url=urljoin(textures_url, entry.upload.hash),
                     metadata=entry.meta,
                     start_time=entry.start_time,
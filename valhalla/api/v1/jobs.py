@@ -0,0 +1,35 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Query
+
+from ... import models, schemas
+from ...auth import require_user
+from ...crud import CRUD
+
+router = APIRouter(tags=["Jobs"])
+
+
+@router.get("/jobs")
+async def get_jobs(
+    user: Annotated[models.User, Depends(require_user)],
+    crud: Annotated[CRUD, Depends()],
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> list[schemas.Job]:
+    """Get the latest background jobs started by the current user's uploads.
+
+    For example, the faces and busts of a skin are rendered by a job after it
+    is uploaded.
+    """
+    jobs = await crud.get_user_jobs(user, limit=limit)
+    return [
+        schemas.Job(
+            id=job.id,
+            kind=job.kind,
+            status=job.status,
+            attempts=job.attempts,
+            error=job.error,
+            created_time=job.created_time,
+            finished_time=job.finished_time,
+        )
+        for job in jobs
+    ]
@@ -1,26 +1,31 @@
 from collections.abc import AsyncGenerator, AsyncIterable
+from datetime import timedelta
 from typing import Annotated, Any
+from uuid import uuid4
 
 import anyio.to_thread
 import httpx
 from anyio import TemporaryFile
 from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, UploadFile
+from joserfc.errors import JoseError
 from pydantic import BaseModel, Json
 from starlette import status
 
-from valhalla.config import settings
+from valhalla.config import Settings, get_settings, settings
 
-from ... import image, models, schemas
-from ...auth import require_user
+from ... import derivatives, image, models, schemas
+from ...auth import require_user, token_from_upload, upload_from_token
 from ...byteconv import mb
 from ...crud import CRUD
-from ...files import Files
+from ...files import Files, S3Path, get_s3_client, get_s3_http
 from .user import get_user_textures
 from .utils import get_textures_url
 
 router = APIRouter(tags=["Texture Uploads"])
 
 max_upload_size = 5 * mb
+# how long clients have to upload to the bucket and complete the upload
+upload_expiry = timedelta(minutes=15)
 
 
 @router.get("/textures")
@@ -92,8 +97,10 @@ async def post_texture(
     body: schemas.TexturePost,
 ) -> None:
     file = await download_file(str(body.file), max_upload_size)
-    await upload_file(user, body.type, file, body.meta, crud, files)
-    await crud.db.commit()
+    texture_hash = await store_texture(body.type, file, files)
+    await crud.transaction(
+        lambda crud: upload_file(user, body.type, texture_hash, body.meta, crud)
+    )
 
 
 @router.put("/textures")
@@ -107,29 +114,115 @@ async def put_texture(
     meta: Annotated[Json[dict[str, str]] | None, Form()] = None,
 ) -> None:
     body = await read_upload(iter_upload_file(file), file_size)
-    await upload_file(user, type, body, meta, crud, files)
-    await crud.db.commit()
+    texture_hash = await store_texture(type, body, files)
+    await crud.transaction(
+        lambda crud: upload_file(user, type, texture_hash, meta, crud)
+    )
+
+
+def check_texture_type(texture_type: str) -> None:
+    if texture_type in settings.texture_type_denylist:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, "That texture type is not allowed"
+        )
+
+
+async def store_texture(texture_type: str, file: bytes, files: Files) -> str:
+    """Validate a texture and store it, before its upload is recorded.
+
+    This keeps the image processing and the storage out of the transaction, and
+    out of the write queue. Storing is idempotent, and the files of uploads
+    which fail to commit are removed by the garbage collector. Returns the hash.
+    """
+    check_texture_type(texture_type)
+    texture_hash, file = await anyio.to_thread.run_sync(image.prepare_skin, file)
+    await files.put_file(texture_hash, file)
+    return texture_hash
 
 
 async def upload_file(
     user: models.User,
     texture_type: str,
-    file: bytes,
+    texture_hash: str,
     meta: dict[str, str] | None,
     crud: CRUD,
-    files: Files,
 ) -> None:
-    if texture_type in settings.texture_type_denylist:
+    """Record the upload of a stored texture and use it."""
+    upload, _ = await crud.put_upload(user, texture_hash)
+    if texture_type == "skin" and not upload.has_derivatives:
+        await crud.add_job(derivatives.job_kind, {"hash": texture_hash}, user=user)
+
+    await crud.put_texture(user, texture_type, upload, meta or {})
+
+
+def get_staging(
+    config: Annotated[Settings, Depends(get_settings)],
+    http: Annotated[httpx.AsyncClient, Depends(get_s3_http)],
+) -> S3Path:
+    if config.textures_bucket is None:
         raise HTTPException(
-            status.HTTP_400_BAD_REQUEST, "That texture type is not allowed"
+            status.HTTP_404_NOT_FOUND, "Direct uploads need a textures bucket"
         )
-    texture_hash = await anyio.to_thread.run_sync(image.gen_skin_hash, file)
-    upload = await crud.get_upload(texture_hash)
-    if not upload:
-        await anyio.to_thread.run_sync(files.put_file, texture_hash, file)
-        upload = await crud.put_upload(user, texture_hash)
+    return S3Path(
+        get_s3_client(), http, config.textures_bucket, config.textures_staging_path
+    )
 
-    await crud.put_texture(user, texture_type, upload, meta or {})
+
+@router.post("/textures/uploads")
+async def create_texture_upload(
+    staging: Annotated[S3Path, Depends(get_staging)],
+    user: Annotated[models.User, Depends(require_user)],
+    body: schemas.TextureUploadRequest,
+) -> schemas.TextureUploadIntent:
+    """Start an upload straight to the textures bucket.
+
+    POST the texture to `url` as `multipart/form-data`, with all of the `fields`
+    followed by the texture as `file`. Then call `/textures/uploads/complete`
+    with the `token` to use it.
+    """
+    check_texture_type(body.type)
+    key = uuid4().hex
+    url, fields = await (staging / key).presigned_post(
+        content_type="image/png",
+        max_size=max_upload_size,
+        expires_in=int(upload_expiry.total_seconds()),
+    )
+    token = token_from_upload(user, body, key, expire_in=upload_expiry)
+    return schemas.TextureUploadIntent(url=url, fields=fields, token=token)
+
+
+@router.post("/textures/uploads/complete")
+async def complete_texture_upload(
+    crud: Annotated[CRUD, Depends()],
+    files: Annotated[Files, Depends()],
+    staging: Annotated[S3Path, Depends(get_staging)],
+    user: Annotated[models.User, Depends(require_user)],
+    body: schemas.TextureUploadComplete,
+) -> None:
+    """Validate a texture uploaded to the bucket and use it."""
+    try:
+        upload, key = upload_from_token(body.token, user)
+    except JoseError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e)) from None
+
+    file = staging / key
+    try:
+        data = await file.read_bytes()
+    except FileNotFoundError:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, "The texture was not uploaded"
+        ) from None
+
+    # the staged texture is only used once, even if it is rejected
+    try:
+        if len(data) > max_upload_size:
+            raise HTTPException(status.HTTP_413_CONTENT_TOO_LARGE)
+        texture_hash = await store_texture(upload.type, data, files)
+        await crud.transaction(
+            lambda crud: upload_file(user, upload.type, texture_hash, upload.meta, crud)
+        )
+    finally:
+        await file.delete()
 
 
 @router.delete("/textures")
@@ -138,8 +231,7 @@ async def delete_texture(
     crud: Annotated[CRUD, Depends()],
     type: schemas.TextureType,
 ) -> None:
-    await crud.put_texture(user, type, None)
-    await crud.db.commit()
+    await crud.transaction(lambda crud: crud.put_texture(user, type, None))
 
 
 class DeleteTexture(BaseModel):
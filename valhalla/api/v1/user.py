@@ -6,7 +6,7 @@ from uuid import UUID
 from fastapi import APIRouter, Depends, Path, Request
 from fastapi.exceptions import HTTPException
 
-from ... import models, schemas
+from ... import image, models, schemas
 from ...crud import CRUD
 from ...limit import limiter
 from .utils import get_textures_url
@@ -57,14 +57,31 @@ async def get_user_textures(
     textures_url: str,
 ) -> schemas.UserTextures:
     textures = await crud.get_user_textures(user, at=at)
+    return user_textures_response(user, textures, textures_url)
+
+
+def user_textures_response(
+    user: models.User,
+    textures: dict[str, models.Texture],
+    textures_url: str,
+) -> schemas.UserTextures:
     return schemas.UserTextures(
         profile_id=user.uuid,
         profile_name=user.name,
-        textures={
-            k: schemas.Texture(
-                url=urljoin(textures_url, v.upload.hash),
-                metadata=v.meta,
-            )
-            for k, v in textures.items()
-        },
+        textures={k: texture_response(v, textures_url) for k, v in textures.items()},
+    )
+
+
+def texture_response(texture: models.Texture, textures_url: str) -> schemas.Texture:
+    upload = texture.upload
+    derivatives = None
+    if texture.tex_type == "skin" and upload.has_derivatives:
+        derivatives = {
+            name: urljoin(textures_url, image.derivative_key(upload.hash, name))
+            for name in image.derivative_names
+        }
+    return schemas.Texture(
+        url=urljoin(textures_url, upload.hash),
+        metadata=texture.meta,
+        derivatives=derivatives,
     )
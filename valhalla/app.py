@@ -1,18 +1,45 @@
+import logging
 import os
 from collections.abc import AsyncGenerator, Awaitable, Callable
 from contextlib import asynccontextmanager
 from typing import Any
 
+import anyio
 from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.responses import RedirectResponse
-from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
 
 import valhalla
 
-from . import api, limit, models
-from .config import settings
-from .database import engine
+from . import api, limit, metrics, models, static
+from .config import EventsBackend, settings
+from .database import engine, writer
+from .events import PostgresBackend, broker
+from .files import get_s3_http
+from .worker import queue
+
+logger = logging.getLogger(__name__)
+
+
+async def supervise(
+    run: Callable[[], Awaitable[None]], *, delay: float = 1, max_delay: float = 60
+) -> None:
+    """Run a background task, starting it again after a delay if it fails.
+
+    The tasks share a task group, so that one failing would otherwise cancel
+    the others, and stop the app.
+    """
+    while True:
+        try:
+            await run()
+        except Exception:
+            logger.exception(
+                "%s failed, restarting in %gs", getattr(run, "__qualname__", run), delay
+            )
+        else:
+            return
+        await anyio.sleep(delay)
+        delay = min(delay * 2, max_delay)
 
 
 @asynccontextmanager
@@ -21,11 +48,33 @@ async def app_lifespan(app: FastAPI) -> AsyncGenerator[None, Any]:
         await session.run_sync(models.Base.metadata.create_all)
 
     if settings.textures_bucket:
-        from .files import verify_aws_credentials
+        from .files import load_s3_credentials, verify_aws_credentials
 
         verify_aws_credentials()
+        await anyio.to_thread.run_sync(load_s3_credentials)
 
-    yield
+    # created once, instead of by the first requests, which includes listing
+    # the files of the disk cache
+    await anyio.to_thread.run_sync(static.get_texture_storage)
+
+    if settings.events_backend is EventsBackend.POSTGRES:
+        broker.backend = PostgresBackend(settings.database_url)
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(supervise, broker.run)
+        if writer is not None:
+            tg.start_soon(supervise, writer.run)
+        if settings.jobs_in_process:
+            tg.start_soon(supervise, queue.run)
+        yield
+        tg.cancel_scope.cancel()
+
+    static.get_texture_storage.cache_clear()
+    if get_s3_http.cache_info().currsize:
+        await get_s3_http().aclose()
+        get_s3_http.cache_clear()
+
+    metrics.mark_process_dead()
 
 
 app = FastAPI(
@@ -66,10 +115,11 @@ async def redirect_http_to_https(
 
 
 app.add_middleware(SessionMiddleware, secret_key=settings.secret_key)
+metrics.setup(app)
 
 app.include_router(api.router, prefix="/api")
 
 if settings.textures_bucket is None:
     os.makedirs(settings.textures_path, exist_ok=True)
-    static_textures = StaticFiles(directory=settings.textures_path)
-    app.mount("/textures", static_textures, name="textures")
+if settings.textures_bucket is None or settings.textures_disk_cache_path:
+    app.include_router(static.router)
@@ -8,7 +8,7 @@ from joserfc import jwk, jwt
 from joserfc.errors import JoseError
 from starlette import status
 
-from . import models
+from . import models, schemas
 from .config import settings
 from .crud import CRUD
 
@@ -57,5 +57,39 @@ def token_from_user(user: models.User, *, expire_in: timedelta) -> str:
 
 async def user_from_token(token: str, crud: CRUD) -> models.User | None:
     claims = jwt.decode(token, key=jose_key, algorithms=["HS256"]).claims
-    sid = claims["sid"]
+    sid = claims.get("sid")
+    if sid is None:
+        # not a login token
+        return None
     return await crud.get_user(sid)
+
+
+def token_from_upload(
+    user: models.User,
+    upload: schemas.TextureUploadRequest,
+    key: str,
+    *,
+    expire_in: timedelta,
+) -> str:
+    header = {"alg": "HS256"}
+    claims = {
+        "upload": key,
+        "uid": user.id,
+        "type": upload.type,
+        "meta": upload.meta,
+        "iat": datetime.now(UTC),
+        "exp": datetime.now(UTC) + expire_in,
+    }
+    return jwt.encode(header, claims, key=jose_key)
+
+
+def upload_from_token(
+    token: str, user: models.User
+) -> tuple[schemas.TextureUploadRequest, str]:
+    """Get the upload started with a token and the key it was uploaded to."""
+    claims = jwt.decode(token, key=jose_key, algorithms=["HS256"]).claims
+    jwt.JWTClaimsRegistry(exp={"essential": True}).validate(claims)
+    if claims.get("uid") != user.id or "upload" not in claims:
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "Invalid upload token")
+    upload = schemas.TextureUploadRequest(type=claims["type"], meta=claims["meta"])
+    return upload, claims["upload"]
@@ -5,6 +5,8 @@ from urllib.parse import urlparse
 from pydantic import AnyHttpUrl, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from .byteconv import gb, mb
+
 async_sql_drivers = {
     "sqlite": "sqlite+aiosqlite",
     "postgres": "postgresql+psycopg",
@@ -37,6 +39,11 @@ def generate_server_id() -> str:
     return s.replace("-", "")
 
 
+class EventsBackend(Enum):
+    LOCAL = "local"
+    POSTGRES = "postgres"
+
+
 class Settings(BaseSettings):
     env: Env = Env.PRODUCTION
     debug: bool = False
@@ -46,11 +53,63 @@ class Settings(BaseSettings):
     secret_key: str = "dev"
     database_url: str = "sqlite:///./valhalla.db"
 
+    # connection pool, not used for in-memory sqlite databases
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30
+    database_pool_recycle: int = -1
+    database_pool_pre_ping: bool = False
+
+    # pragmas applied to every sqlite connection
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout: int = 5000
+    sqlite_mmap_size: int = 256 * mb
+
+    # read-only queries are spread over these databases, if set
+    database_replica_urls: list[str] = []
+    # seconds that reads of a user go to the primary after that user changed.
+    # The changes are only known to the process which made them, so with several
+    # workers or nodes, a request served by another process can still read from
+    # a replica which hasn't seen the change. Route the requests of a client to
+    # the same process if it must read its own writes.
+    database_replica_max_lag: float = 10
+
+    # apply all writes from a single task, for SQLite under concurrent load
+    database_write_queue: bool = False
+
+    # run background jobs in the app, or only in `python -m valhalla.worker`
+    jobs_in_process: bool = True
+    job_concurrency: int = Field(default=4, ge=1)
+    job_max_attempts: int = Field(default=5, ge=1)
+
+    # texture history kept by `python -m valhalla compact`, the rest is archived.
+    # Ended textures are kept if they are one of the last N of their user and
+    # type, or ended less than the number of days ago.
+    history_keep_last: int | None = None
+    history_keep_days: float | None = None
+
     # TODO this should be saved in the database
     server_id: str = Field(default_factory=generate_server_id)
 
     textures_bucket: str | None = None
     textures_path: str = "textures"
+    # losslessly re-encode uploaded textures to store and serve fewer bytes
+    optimize_textures: bool = True
+    # nest local textures in directories named after their hash, e.g. ab/cd/<hash>
+    textures_shard_depth: int = Field(default=0, ge=0, le=4)
+    # bytes of popular textures from the bucket served from memory, 0 to disable.
+    # Local textures are sent from their files, which the OS keeps in memory.
+    texture_cache_size: int = 64 * mb
+    # bucket prefix for uploads which are not yet validated, which must not be the
+    # textures path. Abandoned uploads are deleted by `python -m valhalla gc`, or
+    # can be expired by a lifecycle rule of the bucket for the prefix.
+    textures_staging_path: str = "staging"
+    # connections kept open to S3, shared by all requests
+    s3_max_connections: int = 100
+    # cache textures from the bucket on the local disk, to serve them from here
+    textures_disk_cache_path: str | None = None
+    textures_disk_cache_size: int = 10 * gb
     textures_url: AnyHttpUrl | None = None
 
     xbox_live_client_id: str | None = None
@@ -63,12 +122,18 @@ class Settings(BaseSettings):
         "scope": "XboxLive.signin offline_access"
     }
 
+    # use "postgres" to deliver texture change events across nodes
+    events_backend: EventsBackend = EventsBackend.LOCAL
+
     aws_access_key_id: str | None = None
     aws_secret_access_key: str | None = None
 
     def get_database_url(self) -> str:
         return resolve_db(self.database_url)
 
+    def get_database_replica_urls(self) -> list[str]:
+        return [resolve_db(url) for url in self.database_replica_urls]
+
     def get_textures_url(self) -> str | None:
         if self.textures_url is None:
             return None
@@ -2,26 +2,130 @@
 # mypy has it disabled in pyproject.toml
 # pyright: reportGeneralTypeIssues=false
 from collections import defaultdict
-from collections.abc import AsyncIterator
-from dataclasses import dataclass
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass, field
 from datetime import UTC, datetime
-from typing import Annotated
+from typing import Annotated, Any
 from uuid import UUID
 
+from expiringdict import ExpiringDict
 from fastapi import Depends
+from sqlalchemy import BigInteger, ColumnElement, Text, and_, cast, or_, true
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from sqlalchemy.sql import update
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.sql import delete, update
 from sqlalchemy.sql.expression import func
 
 from . import models
-from .db import get_db
+from .config import settings
+from .db import get_db, get_replica_db, get_writer
+from .events import record_change
+from .jobs import record_job
+from .writer import Writer
+
+# users whose changes might not have reached the replicas yet, only those made
+# by this process
+recent_writers: dict[int, bool] = ExpiringDict(
+    10_000, settings.database_replica_max_lag
+)
+
+
+def as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+
+def active_at(at: datetime | None) -> ColumnElement[bool]:
+    """Filter for the textures that were active at the time `at`.
+
+    If `at` is None, filter for the currently active textures.
+    """
+    if at is None:
+        return models.Texture.end_time.is_(None)
+    at = as_utc(at)
+    return and_(
+        models.Texture.start_time <= at,
+        or_(models.Texture.end_time.is_(None), models.Texture.end_time > at),
+    )
+
+
+def upload_in_use() -> ColumnElement[bool]:
+    """Filter for the uploads used by a texture, current, old or archived."""
+    return or_(
+        select(models.Texture.id)
+        .where(models.Texture.upload_id == models.Upload.id)
+        .exists(),
+        select(models.ArchivedTexture.id)
+        .where(models.ArchivedTexture.upload_id == models.Upload.id)
+        .exists(),
+    )
+
+
+def is_postgres(session: AsyncSession) -> bool:
+    return session.get_bind().dialect.name == "postgresql"
+
+
+def insert(
+    session: AsyncSession, model: type[models.Base]
+) -> postgresql.Insert | sqlite.Insert:
+    """Create an INSERT statement supporting ON CONFLICT for the session dialect."""
+    if is_postgres(session):
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def current_txid() -> ColumnElement[int]:
+    """The id of the current transaction on Postgres."""
+    return cast(cast(func.pg_current_xact_id(), Text), BigInteger)
+
+
+def oldest_running_txid() -> ColumnElement[int]:
+    """The id of the oldest transaction still running on Postgres.
+
+    The changes of this transaction and of later ones may not be visible yet.
+    """
+    xmin = func.pg_snapshot_xmin(func.pg_current_snapshot())
+    return cast(cast(xmin, Text), BigInteger)
 
 
 @dataclass
 class CRUD:
     db: Annotated[AsyncSession, Depends(get_db)]
+    replica: Annotated[AsyncSession | None, Depends(get_replica_db)] = None
+    writer: Annotated[Writer | None, Depends(get_writer)] = None
+    wrote: bool = field(default=False, init=False)
+
+    def reader(self, *users: models.User) -> AsyncSession:
+        """Get the session to use for read-only queries.
+
+        This is a replica, unless there are none or the replica might not have
+        seen a change made by this request or recently by one of the users.
+        Only the changes made by this process are known, so reads served by
+        other workers or nodes may not see them until the replicas catch up.
+        """
+        if (
+            self.replica is None
+            or self.wrote
+            or any(user.id in recent_writers for user in users)
+        ):
+            return self.db
+        return self.replica
+
+    async def transaction[T](self, op: Callable[[CRUD], Awaitable[T]]) -> T:
+        """Run write operations and commit them.
+
+        With the write queue enabled, the operations are run by the writer,
+        in a batch with the writes of other requests.
+        """
+        self.wrote = True
+        if self.writer is None:
+            result = await op(self)
+            await self.db.commit()
+            return result
+        return await self.writer.submit(lambda db: op(CRUD(db)))
 
     async def get_user(self, user_id: int) -> models.User | None:
         result = await self.db.execute(
@@ -30,16 +134,21 @@ class CRUD:
         return result.scalar()
 
     async def get_user_by_uuid(self, uuid: UUID) -> models.User | None:
-        result = await self.db.execute(
+        result = await self.reader().execute(
             select(models.User).where(models.User.uuid == uuid).limit(1)
         )
         return result.scalar()
 
-    async def resolve_uuids(self, uuids: list[UUID]) -> AsyncIterator[models.User]:
-        for uid in uuids:
-            usr = await self.get_user_by_uuid(uid)
-            if usr:
-                yield usr
+    async def resolve_uuids(self, uuids: list[UUID]) -> list[models.User]:
+        """Get the users with the given uuids, in the same order.
+
+        Unknown uuids are skipped.
+        """
+        result = await self.reader().scalars(
+            select(models.User).where(models.User.uuid.in_(uuids))
+        )
+        users = {user.uuid: user for user in result}
+        return [users[uid] for uid in uuids if uid in users]
 
     async def get_user_textures(
         self,
@@ -47,24 +156,40 @@ class CRUD:
         *,
         at: datetime | None = None,
     ) -> dict[str, models.Texture]:
-        result = await self.db.execute(
+        textures = await self.get_users_textures([user], at=at)
+        return textures.get(user.id, {})
+
+    async def get_users_textures(
+        self,
+        users: list[models.User],
+        *,
+        at: datetime | None = None,
+    ) -> dict[int, dict[str, models.Texture]]:
+        """Get the textures of several users, as they were at the time `at`.
+
+        The result is keyed by user id, then texture type.
+        """
+        user_ids = [user.id for user in users]
+        result = await self.reader(*users).scalars(
             select(models.Texture)
             .options(selectinload(models.Texture.upload))
             .where(
+                # lets Postgres skip the partitions of other users
+                models.Texture.user_id.in_(user_ids),
                 models.Texture.id.in_(
                     select(func.max(models.Texture.id))
                     .where(
-                        models.Texture.user_id == user.id,
-                        models.Texture.end_time == None  # noqa: E711
-                        if at is None
-                        else models.Texture.end_time < at,
+                        models.Texture.user_id.in_(user_ids),
+                        active_at(at),
                     )
-                    .order_by(models.Texture.tex_type)
-                    .group_by(models.Texture.tex_type)
-                )
+                    .group_by(models.Texture.user_id, models.Texture.tex_type)
+                ),
             )
         )
-        return {item.tex_type: item for item in result.scalars()}
+        textures: dict[int, dict[str, models.Texture]] = defaultdict(dict)
+        for item in result:
+            textures[item.user_id][item.tex_type] = item
+        return dict(textures)
 
     async def get_user_textures_history(
         self,
@@ -72,39 +197,128 @@ class CRUD:
         *,
         limit: int | None = None,
         at: datetime | None = None,
+        before: int | None = None,
+        tex_type: str | None = None,
     ) -> dict[str, list[models.Texture]]:
-        result = await self.db.stream_scalars(
-            select(models.Texture)
-            .options(selectinload(models.Texture.upload))
-            .where(
-                models.Texture.user_id == user.id,
-                *(() if at is None else (models.Texture.end_time < at,)),
+        """Get the texture history of a user, newest first.
+
+        `limit` applies to each texture type. `before` is a texture id to
+        continue from when paging through the history.
+        """
+        filters = [
+            models.Texture.user_id == user.id,
+            *(() if at is None else (models.Texture.start_time <= as_utc(at),)),
+            *(() if before is None else (models.Texture.id < before,)),
+            *(() if tex_type is None else (models.Texture.tex_type == tex_type,)),
+        ]
+        texture: type[models.Texture] = models.Texture
+        query = select(texture).where(*filters)
+        if limit is not None:
+            rank = (
+                func.row_number()
+                .over(
+                    partition_by=models.Texture.tex_type,
+                    order_by=models.Texture.id.desc(),
+                )
+                .label("rank")
+            )
+            ranked = select(models.Texture, rank).where(*filters).subquery()
+            texture = aliased(models.Texture, ranked)
+            query = select(texture).where(ranked.c.rank <= limit)
+
+        result = await self.reader(user).scalars(
+            query.options(selectinload(texture.upload)).order_by(
+                texture.tex_type, texture.id.desc()
             )
-            .order_by(models.Texture.tex_type, models.Texture.id.desc())
-            .group_by(models.Texture.tex_type, models.Texture.id),
         )
 
         results: dict[str, list[models.Texture]] = defaultdict(list)
-        async for item in result:
-            if item.tex_type in results and len(results[item.tex_type]) == limit:
-                continue
+        for item in result:
             results[item.tex_type].append(item)
 
         return dict(results)
 
-    async def get_or_create_user(self, uuid: UUID, name: str) -> models.User:
-        user = await self.get_user_by_uuid(uuid)
-        if user is None:
-            user = models.User(uuid=uuid, name=name)
-            self.db.add(user)
+    async def get_user_ids(self, after: int, *, limit: int) -> list[int]:
+        result = await self.db.scalars(
+            select(models.User.id)
+            .where(models.User.id > after)
+            .order_by(models.User.id)
+            .limit(limit)
+        )
+        return list(result)
 
-            await self.db.commit()
-            await self.db.refresh(user)
-        elif user.name != name:
-            user.name = name
+    async def archive_textures(
+        self,
+        user_ids: list[int],
+        *,
+        keep_last: int | None,
+        keep_since: datetime | None,
+    ) -> int:
+        """Move the ended textures of users to the archive, except those kept.
 
-            await self.db.commit()
+        A texture is kept if it is one of the last `keep_last` of its user and
+        type, or ended after `keep_since`. Returns the number archived.
+        """
+        self.wrote = True
+        rank = (
+            func.row_number()
+            .over(
+                partition_by=(models.Texture.user_id, models.Texture.tex_type),
+                order_by=models.Texture.id.desc(),
+            )
+            .label("rank")
+        )
+        ranked = (
+            select(models.Texture.id, models.Texture.end_time, rank)
+            .where(models.Texture.user_id.in_(user_ids))
+            .subquery()
+        )
+        archived = select(ranked.c.id).where(
+            ranked.c.end_time.is_not(None),
+            *(() if keep_last is None else (ranked.c.rank > keep_last,)),
+            *(() if keep_since is None else (ranked.c.end_time < keep_since,)),
+        )
+        ids = list(await self.db.scalars(archived))
+        if not ids:
+            return 0
+
+        columns = [
+            "id",
+            "user_id",
+            "upload_id",
+            "tex_type",
+            "meta",
+            "start_time",
+            "end_time",
+        ]
+        selected = and_(
+            models.Texture.user_id.in_(user_ids), models.Texture.id.in_(ids)
+        )
+        await self.db.execute(
+            insert(self.db, models.ArchivedTexture).from_select(
+                columns,
+                select(*(getattr(models.Texture, c) for c in columns)).where(selected),
+            )
+        )
+        await self.db.execute(delete(models.Texture).where(selected))
+        return len(ids)
 
+    async def get_or_create_user(self, uuid: UUID, name: str) -> models.User:
+        """Create a user or update its name in a single statement.
+
+        This does not commit.
+        """
+        self.wrote = True
+        stmt = insert(self.db, models.User).values(uuid=uuid, name=name)
+        user = await self.db.scalar(
+            stmt.on_conflict_do_update(
+                index_elements=[models.User.uuid],
+                set_={models.User.name: stmt.excluded.name},
+            ).returning(models.User),
+            execution_options={"populate_existing": True},
+        )
+        assert user is not None
+        recent_writers[user.id] = True
         return user
 
     async def get_upload(self, texture_hash: str) -> models.Upload | None:
@@ -113,13 +327,131 @@ class CRUD:
         )
         return results.scalar()
 
-    async def put_upload(self, user: models.User, texture_hash: str) -> models.Upload:
-        upload = models.Upload(
-            hash=texture_hash,
-            user_id=user.id,
+    async def put_upload(
+        self, user: models.User, texture_hash: str
+    ) -> tuple[models.Upload, bool]:
+        """Get or create the upload of a texture.
+
+        An existing upload gets a new upload time, so that the garbage collector
+        doesn't take it for an unused one while it's being used again. Returns
+        the upload and whether it was created.
+        """
+        self.wrote = True
+        while True:
+            upload = await self.db.scalar(
+                insert(self.db, models.Upload)
+                .values(hash=texture_hash, user_id=user.id)
+                .on_conflict_do_nothing(index_elements=[models.Upload.hash])
+                .returning(models.Upload)
+            )
+            if upload is not None:
+                return upload, True
+
+            upload = await self.db.scalar(
+                update(models.Upload)
+                .where(models.Upload.hash == texture_hash)
+                .values(upload_time=func.current_timestamp())
+                .returning(models.Upload)
+                .execution_options(populate_existing=True)
+            )
+            # otherwise it was just deleted by the garbage collector
+            if upload is not None:
+                return upload, False
+
+    async def add_job(
+        self,
+        kind: str,
+        payload: dict[str, Any],
+        *,
+        user: models.User | None = None,
+    ) -> models.Job:
+        """Add a background job, which runs after the session commits."""
+        self.wrote = True
+        job = models.Job(kind=kind, payload=payload, user_id=user.id if user else None)
+        self.db.add(job)
+        record_job(self.db.sync_session)
+        return job
+
+    async def get_user_jobs(self, user: models.User, *, limit: int) -> list[models.Job]:
+        """Get the latest jobs done for a user."""
+        result = await self.reader(user).scalars(
+            select(models.Job)
+            .where(models.Job.user_id == user.id)
+            .order_by(models.Job.id.desc())
+            .limit(limit)
+        )
+        return list(result)
+
+    async def get_unreferenced_uploads(
+        self, after: int, *, before: datetime, limit: int
+    ) -> list[models.Upload]:
+        """Get the uploads before a time which are not used by any texture, by id."""
+        result = await self.db.scalars(
+            select(models.Upload)
+            .where(
+                models.Upload.id > after,
+                models.Upload.upload_time < before,
+                ~upload_in_use(),
+            )
+            .order_by(models.Upload.id)
+            .limit(limit)
+        )
+        return list(result)
+
+    async def delete_uploads(
+        self, upload_ids: list[int], *, before: datetime
+    ) -> list[str]:
+        """Delete the uploads which are still not used by any texture.
+
+        Uploads used again since `before` are kept. Returns the hashes of the
+        deleted uploads.
+        """
+        self.wrote = True
+        result = await self.db.scalars(
+            delete(models.Upload)
+            .where(
+                models.Upload.id.in_(upload_ids),
+                models.Upload.upload_time < before,
+                ~upload_in_use(),
+            )
+            .returning(models.Upload.hash)
+        )
+        return list(result)
+
+    async def get_known_hashes(self, hashes: Iterable[str]) -> set[str]:
+        """Get the hashes which have an upload."""
+        result = await self.db.scalars(
+            select(models.Upload.hash).where(models.Upload.hash.in_(hashes))
+        )
+        return set(result)
+
+    async def get_uploads_without_derivatives(
+        self, after: int, *, limit: int
+    ) -> list[models.Upload]:
+        """Get the uploads used as skins which have no derivatives, by id."""
+        result = await self.db.scalars(
+            select(models.Upload)
+            .where(
+                models.Upload.id > after,
+                models.Upload.has_derivatives.is_(False),
+                models.Upload.id.in_(
+                    select(models.Texture.upload_id).where(
+                        models.Texture.tex_type == "skin"
+                    )
+                ),
+            )
+            .order_by(models.Upload.id)
+            .limit(limit)
+        )
+        return list(result)
+
+    async def set_has_derivatives(self, upload_ids: list[int]) -> None:
+        self.wrote = True
+        await self.db.execute(
+            update(models.Upload)
+            .where(models.Upload.id.in_(upload_ids))
+            .values({models.Upload.has_derivatives: True})
         )
-        self.db.add(upload)
-        return upload
 
     async def put_texture(
         self,
@@ -128,11 +460,18 @@ class CRUD:
         upload: models.Upload | None,
         meta: dict[str, str] | None = None,
     ) -> None:
+        """Replace the active texture of a type.
+
+        This does not commit, so that an upload is written in one transaction.
+        """
+        self.wrote = True
+        recent_writers[user.id] = True
         await self.db.execute(
             update(models.Texture)
             .where(
                 models.Texture.user_id == user.id,
                 models.Texture.tex_type == tex_type,
+                models.Texture.end_time.is_(None),
             )
             .values({models.Texture.end_time: datetime.now(UTC)}),
         )
@@ -145,4 +484,91 @@ class CRUD:
                     meta=meta or {},
                 )
             )
-        await self.db.commit()
+        self.db.add(
+            models.TextureChange(
+                user_id=user.id,
+                tex_type=tex_type,
+                txid=current_txid() if is_postgres(self.db) else None,
+            )
+        )
+        record_change(self.db.sync_session, user.uuid)
+
+    async def get_changes_cursor(self) -> int:
+        reader = self.reader()
+        if is_postgres(reader):
+            result = await reader.execute(select(oldest_running_txid() - 1))
+            return result.scalar_one()
+        result = await reader.execute(select(func.max(models.TextureChange.id)))
+        return result.scalar() or 0
+
+    async def get_changed_users(
+        self, since: int, *, until: int | None = None, limit: int | None = None
+    ) -> list[tuple[UUID, int]]:
+        """Get the users whose textures changed after the cursor `since`.
+
+        Each user is returned once along with the cursor of their latest change,
+        ordered by that cursor.
+
+        On Postgres, the cursor is the id of the transaction which made the
+        change, and only the changes of transactions older than every running
+        one are returned. Later changes may be committed before the running
+        transactions, which would then be skipped by a client of the feed. Users
+        changed by the same transaction share a cursor.
+
+        SQLite has a single writer, so its ids are in the order of the commits.
+        """
+        reader = self.reader()
+        if is_postgres(reader):
+            cursor = models.TextureChange.txid
+            visible = cursor < oldest_running_txid()
+        else:
+            cursor = models.TextureChange.id
+            visible = true()
+        latest = func.max(cursor)
+        query = (
+            select(models.User.uuid, latest)
+            .join(models.User, models.User.id == models.TextureChange.user_id)
+            .where(cursor > since, visible)
+            .group_by(models.User.id, models.User.uuid)
+            .order_by(latest)
+            .limit(limit)
+        )
+        if until is not None:
+            query = query.having(latest <= until)
+        result = await reader.execute(query)
+        return [(uuid, cursor) for uuid, cursor in result]
+
+    async def prune_changes(self, user_ids: list[int]) -> int:
+        """Delete the changes of users which are followed by a later change.
+
+        The change feed only returns the latest change of each user, so this
+        doesn't change what it returns. Returns the number of changes deleted.
+        """
+        self.wrote = True
+        rank = (
+            func.row_number()
+            .over(
+                partition_by=models.TextureChange.user_id,
+                # by transaction on Postgres, see `get_changed_users`
+                order_by=(
+                    func.coalesce(models.TextureChange.txid, 0).desc(),
+                    models.TextureChange.id.desc(),
+                ),
+            )
+            .label("rank")
+        )
+        ranked = (
+            select(models.TextureChange.id, rank)
+            .where(models.TextureChange.user_id.in_(user_ids))
+            .subquery()
+        )
+        ids = list(await self.db.scalars(select(ranked.c.id).where(ranked.c.rank > 1)))
+        if not ids:
+            return 0
+        await self.db.execute(
+            delete(models.TextureChange).where(
+                models.TextureChange.user_id.in_(user_ids),
+                models.TextureChange.id.in_(ids),
+            )
+        )
+        return len(ids)
@@ -1,6 +1,85 @@
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from time import perf_counter
+from typing import Any
 
-from .config import settings
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, make_url
+from sqlalchemy.engine.interfaces import DBAPIConnection
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
 
-engine = create_async_engine(settings.get_database_url())
-SessionLocal = async_sessionmaker[AsyncSession](engine)
+from . import metrics
+from .config import Settings, settings
+from .writer import Writer
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool which records how long checkouts wait for a connection."""
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.db_pool_checkout_seconds.observe(perf_counter() - start)
+
+
+def set_sqlite_pragmas(config: Settings, dbapi_connection: DBAPIConnection) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={config.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={config.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA busy_timeout={config.sqlite_busy_timeout:d}")
+    cursor.execute(f"PRAGMA mmap_size={config.sqlite_mmap_size:d}")
+    cursor.close()
+
+
+def create_engine(url: str, config: Settings, *, name: str) -> AsyncEngine:
+    options: dict[str, Any] = {}
+    if make_url(url).database not in (None, "", ":memory:"):
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=config.database_pool_size,
+            max_overflow=config.database_max_overflow,
+            pool_timeout=config.database_pool_timeout,
+            pool_recycle=config.database_pool_recycle,
+            pool_pre_ping=config.database_pool_pre_ping,
+        )
+
+    engine = create_async_engine(url, **options)
+    if engine.dialect.name == "sqlite":
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def connect(
+            dbapi_connection: DBAPIConnection, connection_record: ConnectionPoolEntry
+        ) -> None:
+            set_sqlite_pragmas(config, dbapi_connection)
+            # the driver only begins transactions before data changes, so a
+            # SAVEPOINT would start its own and its RELEASE would commit it
+            dbapi_connection.isolation_level = None  # type: ignore[attr-defined]
+
+        @event.listens_for(engine.sync_engine, "begin")
+        def begin(conn: Connection) -> None:
+            conn.exec_driver_sql("BEGIN")
+
+    metrics.track_engine(engine, name)
+    return engine
+
+
+engine = create_engine(settings.get_database_url(), settings, name="primary")
+# objects stay usable after a commit, instead of raising on lazy loads
+SessionLocal = async_sessionmaker[AsyncSession](engine, expire_on_commit=False)
+
+replica_engines = [
+    create_engine(url, settings, name=f"replica{n}")
+    for n, url in enumerate(settings.get_database_replica_urls())
+]
+ReplicaSessionLocals = [
+    async_sessionmaker[AsyncSession](replica, expire_on_commit=False)
+    for replica in replica_engines
+]
+
+writer = Writer(SessionLocal) if settings.database_write_queue else None
@@ -1,11 +1,30 @@
 from collections.abc import AsyncGenerator
+from itertools import cycle
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .database import SessionLocal
+from .database import ReplicaSessionLocals, SessionLocal, writer
+from .writer import Writer
+
+_replicas = cycle(ReplicaSessionLocals)
 
 
 async def get_db() -> AsyncGenerator[AsyncSession]:
     db: AsyncSession
     async with SessionLocal() as db:
         yield db
+
+
+async def get_replica_db() -> AsyncGenerator[AsyncSession | None]:
+    """Get a session for one of the read replicas, if there are any."""
+    if not ReplicaSessionLocals:
+        yield None
+        return
+
+    db: AsyncSession
+    async with next(_replicas)() as db:
+        yield db
+
+
+def get_writer() -> Writer | None:
+    return writer
@@ -0,0 +1,73 @@
+"""Rendering of the faces and busts of skins, after they are uploaded."""
+
+from typing import Any
+
+import anyio
+import anyio.to_thread
+from PIL import UnidentifiedImageError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import image, models
+from .config import settings
+from .crud import CRUD
+from .files import Files, get_filesystem, get_s3_http
+
+job_kind = "derivatives"
+
+
+async def render(files: Files, texture_hash: str) -> None:
+    """Render the derivatives of a stored skin and store them next to it."""
+    data = await (files.fs / texture_hash).read_bytes()
+    images = await anyio.to_thread.run_sync(image.render_derivatives, data)
+    await files.put_derivatives(texture_hash, images)
+
+
+async def render_job(db: AsyncSession, payload: dict[str, Any]) -> None:
+    crud = CRUD(db)
+    upload = await crud.get_upload(payload["hash"])
+    if upload is None or upload.has_derivatives:
+        return
+    await render(Files(get_filesystem(settings, get_s3_http())), upload.hash)
+    await crud.set_has_derivatives([upload.id])
+
+
+async def backfill(
+    crud: CRUD, files: Files, *, workers: int = 16, batch_size: int = 100
+) -> int:
+    """Render the faces and busts of the skins which don't have them yet.
+
+    Skins whose file is missing or unreadable are skipped. Returns the number
+    of skins rendered.
+    """
+    limiter = anyio.CapacityLimiter(workers)
+    rendered = 0
+    after = 0
+    while uploads := await crud.get_uploads_without_derivatives(
+        after, limit=batch_size
+    ):
+        done: list[int] = []
+        async with anyio.create_task_group() as tg:
+            for upload in uploads:
+                tg.start_soon(backfill_upload, files, upload, limiter, done)
+
+        await crud.set_has_derivatives(done)
+        await crud.db.commit()
+        rendered += len(done)
+        after = uploads[-1].id
+    return rendered
+
+
+async def backfill_upload(
+    files: Files,
+    upload: models.Upload,
+    limiter: anyio.CapacityLimiter,
+    done: list[int],
+) -> None:
+    async with limiter:
+        try:
+            await render(files, upload.hash)
+        except FileNotFoundError:
+            return
+        except UnidentifiedImageError:
+            return
+        done.append(upload.id)
@@ -0,0 +1,235 @@
+"""Fan-out of texture change notifications to subscribed clients.
+
+Changes recorded on a database session are published once it commits.
+"""
+
+import asyncio
+import json
+import logging
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from typing import Protocol, override
+from uuid import UUID
+
+import psycopg
+from sqlalchemy import event, make_url
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+changed_profiles_key = "changed_profiles"
+
+
+class Subscription:
+    """A set of profiles watched by a single client connection.
+
+    Pending changes are coalesced per profile, so the buffer never holds more
+    than one entry per watched profile. If it still grows past `max_pending`,
+    the buffer is dropped and the client is told to resynchronize instead.
+    """
+
+    def __init__(self, profile_ids: Iterable[UUID], *, max_pending: int) -> None:
+        self.profile_ids = frozenset(profile_ids)
+        self.max_pending = max_pending
+        self.overflowed = False
+        self._pending: dict[UUID, None] = {}
+        self._ready = asyncio.Event()
+
+    def push(self, profile_id: UUID) -> None:
+        if self.overflowed or profile_id in self._pending:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.resync()
+        else:
+            self._pending[profile_id] = None
+            self._ready.set()
+
+    def resync(self) -> None:
+        """Drop the pending changes, and tell the client to resynchronize."""
+        self.overflowed = True
+        self._pending.clear()
+        self._ready.set()
+
+    async def get(self) -> list[UUID] | None:
+        """Wait for changes and take all of the pending ones.
+
+        Returns None if changes were dropped and the client has to resynchronize.
+        """
+        await self._ready.wait()
+        self._ready.clear()
+        if self.overflowed:
+            self.overflowed = False
+            return None
+        pending = list(self._pending)
+        self._pending.clear()
+        return pending
+
+
+class Backend(Protocol):
+    """Delivers published changes to the brokers of every node."""
+
+    def publish(self, profile_id: UUID) -> None: ...
+    async def run(
+        self, dispatch: Callable[[UUID], None], resync: Callable[[], None]
+    ) -> None: ...
+
+
+def libpq_url(database_url: str) -> str:
+    """Convert a database URL of the settings to one psycopg can connect to.
+
+    The SQLAlchemy URLs name the driver, like `postgresql+psycopg://`.
+    """
+    url = make_url(database_url).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+class PostgresBackend(Backend):
+    """Cross-node delivery using Postgres LISTEN/NOTIFY.
+
+    If a connection is lost, both are opened again after a delay, doubling up
+    to `max_retry_delay` while the database can't be reached. Changes of other
+    nodes might have been missed meanwhile, so every client resynchronizes.
+
+    Changes wait in an outbox until they're sent. If more than `max_outbox`
+    pile up, they're dropped, and the clients of every node are told to
+    resynchronize instead.
+    """
+
+    channel = "valhalla_texture_changes"
+
+    def __init__(
+        self,
+        database_url: str,
+        *,
+        retry_delay: float = 1,
+        max_retry_delay: float = 60,
+        max_outbox: int = 10_000,
+    ) -> None:
+        self.conninfo = libpq_url(database_url)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # None asks every node to resynchronize
+        self._outbox: asyncio.Queue[UUID | None] = asyncio.Queue(max_outbox)
+
+    @override
+    def publish(self, profile_id: UUID) -> None:
+        self._put(profile_id)
+
+    def _put(self, profile_id: UUID | None) -> None:
+        try:
+            self._outbox.put_nowait(profile_id)
+        except asyncio.QueueFull:
+            logger.warning("Dropped %d texture change events", self._outbox.qsize())
+            while not self._outbox.empty():
+                self._outbox.get_nowait()
+            self._outbox.put_nowait(None)
+
+    @override
+    async def run(
+        self, dispatch: Callable[[UUID], None], resync: Callable[[], None]
+    ) -> None:
+        delay = self.retry_delay
+        while True:
+            try:
+                async with (
+                    await psycopg.AsyncConnection.connect(
+                        self.conninfo, autocommit=True
+                    ) as listener,
+                    await psycopg.AsyncConnection.connect(
+                        self.conninfo, autocommit=True
+                    ) as sender,
+                    asyncio.TaskGroup() as tg,
+                ):
+                    await listener.execute(f"LISTEN {self.channel}")
+                    delay = self.retry_delay
+                    resync()
+                    tg.create_task(self._send(sender))
+                    async for notify in listener.notifies():
+                        profile_id = json.loads(notify.payload)
+                        if profile_id is None:
+                            resync()
+                        else:
+                            dispatch(UUID(profile_id))
+            except* psycopg.OperationalError:
+                logger.warning(
+                    "Lost the connection for texture change events, "
+                    "reconnecting in %gs",
+                    delay,
+                    exc_info=True,
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    async def _send(self, conn: psycopg.AsyncConnection) -> None:
+        while True:
+            profile_id = await self._outbox.get()
+            payload = None if profile_id is None else str(profile_id)
+            try:
+                await conn.execute(
+                    "SELECT pg_notify(%s, %s)", (self.channel, json.dumps(payload))
+                )
+            except psycopg.OperationalError:
+                # sent again once reconnected
+                self._put(profile_id)
+                raise
+
+
+class Broker:
+    def __init__(self, *, max_pending: int = 1000) -> None:
+        self.max_pending = max_pending
+        self.backend: Backend | None = None
+        self._subscriptions: dict[UUID, set[Subscription]] = {}
+
+    @contextmanager
+    def subscribe(self, profile_ids: Iterable[UUID]) -> Iterator[Subscription]:
+        sub = Subscription(profile_ids, max_pending=self.max_pending)
+        for profile_id in sub.profile_ids:
+            self._subscriptions.setdefault(profile_id, set()).add(sub)
+        try:
+            yield sub
+        finally:
+            for profile_id in sub.profile_ids:
+                subs = self._subscriptions[profile_id]
+                subs.discard(sub)
+                if not subs:
+                    del self._subscriptions[profile_id]
+
+    def publish(self, profile_id: UUID) -> None:
+        if self.backend is None:
+            self.dispatch(profile_id)
+        else:
+            self.backend.publish(profile_id)
+
+    def dispatch(self, profile_id: UUID) -> None:
+        for sub in self._subscriptions.get(profile_id, ()):
+            sub.push(profile_id)
+
+    def resync(self) -> None:
+        """Tell every client to resynchronize, as changes might have been missed."""
+        for subs in self._subscriptions.values():
+            for sub in subs:
+                sub.resync()
+
+    async def run(self) -> None:
+        """Receive changes from the backend until cancelled."""
+        if self.backend is not None:
+            await self.backend.run(self.dispatch, self.resync)
+
+
+broker = Broker()
+
+
+def record_change(session: Session, profile_id: UUID) -> None:
+    """Publish a profile change once the session commits."""
+    session.info.setdefault(changed_profiles_key, set()).add(profile_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session: Session) -> None:
+    for profile_id in session.info.pop(changed_profiles_key, ()):
+        broker.publish(profile_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session) -> None:
+    session.info.pop(changed_profiles_key, None)
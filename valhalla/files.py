@@ -1,96 +1,769 @@
+import asyncio
+import os
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from dataclasses import dataclass
-from io import BytesIO
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from functools import cache, partial
 from pathlib import Path
 from typing import TYPE_CHECKING, Annotated, Protocol, Self, override
+from urllib.parse import quote, unquote
+from uuid import uuid4
 
+import anyio
+import anyio.to_thread
 import boto3
-import botocore.exceptions
+import httpx
+from botocore.credentials import Credentials, RefreshableCredentials
 from fastapi import Depends
 
-from .config import Settings, get_settings
+from . import metrics
+from .config import Settings, get_settings, settings
+from .image import derivative_key
 
 if TYPE_CHECKING:
     from mypy_boto3_s3 import S3Client
+    from mypy_boto3_s3.type_defs import ObjectIdentifierTypeDef
+
+# how long the signed S3 requests are valid for
+s3_request_expiry = 60
+# the most keys S3 deletes in one request
+s3_max_delete = 1000
+
+
+@dataclass
+class StoredFile:
+    key: str
+    modified: datetime
 
 
 class Filesystem(Protocol):
-    def exists(self) -> bool: ...
-    def write_bytes(self, data: bytes, *, content_type: str | None = None) -> int: ...
+    async def exists(self) -> bool: ...
+    async def read_bytes(self) -> bytes:
+        """Read the file, raising FileNotFoundError if it doesn't exist."""
+        ...
+
+    async def write_bytes(
+        self, data: bytes, *, content_type: str | None = None
+    ) -> int: ...
+    async def create(self, data: bytes, *, content_type: str | None = None) -> bool:
+        """Write the file, unless it already exists.
+
+        Returns whether the file was written.
+        """
+        ...
+
+    async def touch(self, *, content_type: str | None = None) -> bool:
+        """Update the modification time of the file.
+
+        Returns False if the file doesn't exist.
+        """
+        ...
+
+    async def modified(self) -> datetime | None:
+        """Get the modification time of the file, or None if it doesn't exist."""
+        ...
+
+    async def delete(self) -> None:
+        """Delete the file, if it exists."""
+        ...
+
+    def iter_files(self) -> AsyncIterator[StoredFile]:
+        """List the files in this directory, without holding all of them at once."""
+        ...
+
+    async def delete_many(self, keys: list[str]) -> None:
+        """Delete the files in this directory with the keys, if they exist."""
+        ...
+
     def __truediv__(self, key: str) -> Self: ...
 
 
+def shard_path(key: str, depth: int) -> Path:
+    """Get the path of a file nested in directories named after its key.
+
+    With a depth of 2, `abcdef` is stored as `ab/cd/abcdef`.
+    """
+    return Path(*(key[n * 2 : n * 2 + 2] for n in range(depth)), key)
+
+
 @dataclass
 class FilePath(Filesystem):
     path: Path
+    # directories of files put in this one are nested in
+    shard_depth: int = 0
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("file", "exists"))
+    async def exists(self) -> bool:
+        return await anyio.Path(self.path).exists()
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("file", "read"))
+    async def read_bytes(self) -> bytes:
+        return await anyio.Path(self.path).read_bytes()
 
     @override
-    def exists(self) -> bool:
-        return self.path.exists()
+    @metrics.timed(metrics.storage_seconds.labels("file", "write"))
+    async def write_bytes(self, data: bytes, *, content_type: str | None = None) -> int:
+        temp = await anyio.to_thread.run_sync(self._write_temp, data)
+        await anyio.Path(temp).replace(self.path)
+        return len(data)
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("file", "create"))
+    async def create(self, data: bytes, *, content_type: str | None = None) -> bool:
+        return await anyio.to_thread.run_sync(self._create, data)
+
+    def _write_temp(self, data: bytes) -> Path:
+        # write a temporary file first, so the file is never seen half written
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_name(f".{self.path.name}.{uuid4().hex}")
+        temp.write_bytes(data)
+        return temp
+
+    def _create(self, data: bytes) -> bool:
+        temp = self._write_temp(data)
+        try:
+            # linking fails if the file exists, unlike renaming
+            self.path.hardlink_to(temp)
+        except FileExistsError:
+            return False
+        finally:
+            temp.unlink()
+        return True
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("file", "touch"))
+    async def touch(self, *, content_type: str | None = None) -> bool:
+        try:
+            await anyio.to_thread.run_sync(os.utime, self.path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("file", "modified"))
+    async def modified(self) -> datetime | None:
+        try:
+            stat = await anyio.Path(self.path).stat()
+        except FileNotFoundError:
+            return None
+        return datetime.fromtimestamp(stat.st_mtime, UTC)
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("file", "delete"))
+    async def delete(self) -> None:
+        await anyio.Path(self.path).unlink(missing_ok=True)
+
+    @override
+    async def iter_files(self) -> AsyncIterator[StoredFile]:
+        chunks = self._scan()
+        while chunk := await anyio.to_thread.run_sync(next, chunks, None):
+            for file in chunk:
+                yield file
+
+    def _scan(self, chunk_size: int = 1000) -> Iterator[list[StoredFile]]:
+        chunk: list[StoredFile] = []
+        for dirpath, _, names in os.walk(self.path):
+            for name in names:
+                # skip temporary files of unfinished writes
+                if name.startswith("."):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+                chunk.append(
+                    StoredFile(name, datetime.fromtimestamp(stat.st_mtime, UTC))
+                )
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
 
     @override
-    def write_bytes(self, data: bytes, *, content_type: str | None = None) -> int:
-        return self.path.write_bytes(data)
+    @metrics.timed(metrics.storage_seconds.labels("file", "delete_many"))
+    async def delete_many(self, keys: list[str]) -> None:
+        def delete() -> None:
+            for key in keys:
+                (self / key).path.unlink(missing_ok=True)
+
+        await anyio.to_thread.run_sync(delete)
 
     @override
     def __truediv__(self, key: str) -> Self:
-        return type(self)(self.path / key)
+        return type(self)(self.path / shard_path(key, self.shard_depth))
+
+
+def relayout(root: Path, shard_depth: int, *, workers: int = 16) -> int:
+    """Move the files of a local texture directory to another shard depth.
+
+    Returns the number of files moved.
+    """
+
+    def move(path: Path) -> bool:
+        target = root / shard_path(path.name, shard_depth)
+        if target == path:
+            return False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        path.replace(target)
+        return True
+
+    files = [
+        Path(dirpath, name)
+        for dirpath, _, names in os.walk(root)
+        for name in names
+        # skip temporary files of unfinished writes
+        if not name.startswith(".")
+    ]
+    with ThreadPoolExecutor(workers) as pool:
+        moved = sum(pool.map(move, files))
+
+    # remove the directories of the old layout
+    for dirpath, _, _ in os.walk(root, topdown=False):
+        if Path(dirpath) != root:
+            with suppress(OSError):
+                os.rmdir(dirpath)
+    return moved
+
+
+def s3_credentials(s3_client: S3Client) -> Credentials | None:
+    # the credentials the client signs with, which it doesn't otherwise expose
+    return s3_client._request_signer._credentials  # type: ignore[attr-defined]  # noqa: SLF001
+
+
+def credentials_current(s3_client: S3Client) -> bool:
+    """Check that signing with the client's credentials won't refresh them.
+
+    Temporary credentials, like those of an instance role, are refreshed with
+    blocking requests shortly before they expire.
+    """
+    credentials = s3_credentials(s3_client)
+    return (
+        not isinstance(credentials, RefreshableCredentials)
+        or not credentials.refresh_needed()
+    )
+
+
+async def run_signer[T](s3_client: S3Client, sign: Callable[[], T]) -> T:
+    """Sign a request on the event loop, or in a thread if it may block."""
+    if credentials_current(s3_client):
+        return sign()
+    return await anyio.to_thread.run_sync(sign)
+
+
+def load_s3_credentials() -> None:
+    """Create the S3 client and fetch its credentials, which can block.
+
+    Run when the app starts, so that the first requests don't wait for them.
+    """
+    credentials = s3_credentials(get_s3_client())
+    if credentials is not None:
+        credentials.get_frozen_credentials()
 
 
 @dataclass
 class S3Path(Filesystem):
+    """Object in an S3 bucket.
+
+    The requests are signed by boto3, but sent with an async HTTP client, so
+    they don't hold a worker thread while waiting on S3.
+    """
+
     s3_client: S3Client
+    http: httpx.AsyncClient
     bucket: str
     path: str
 
+    async def sign(self, method: str, **params: str) -> str:
+        return await run_signer(
+            self.s3_client,
+            partial(
+                self.s3_client.generate_presigned_url,
+                method,
+                Params={"Bucket": self.bucket, "Key": self.path, **params},
+                ExpiresIn=s3_request_expiry,
+            ),
+        )
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("s3", "exists"))
+    async def exists(self) -> bool:
+        response = await self.http.head(await self.sign("head_object"))
+        if response.status_code == httpx.codes.NOT_FOUND:
+            return False
+        response.raise_for_status()
+        return True
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("s3", "read"))
+    async def read_bytes(self) -> bytes:
+        response = await self.http.get(await self.sign("get_object"))
+        if response.status_code == httpx.codes.NOT_FOUND:
+            raise FileNotFoundError(self.path)
+        response.raise_for_status()
+        return response.content
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("s3", "write"))
+    async def write_bytes(self, data: bytes, *, content_type: str | None = None) -> int:
+        response = await self.put(data, content_type)
+        response.raise_for_status()
+        return len(data)
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("s3", "create"))
+    async def create(self, data: bytes, *, content_type: str | None = None) -> bool:
+        response = await self.put(data, content_type, if_none_match="*")
+        # 409 means another conditional write of the key is in progress
+        if response.status_code in (
+            httpx.codes.PRECONDITION_FAILED,
+            httpx.codes.CONFLICT,
+        ):
+            return False
+        response.raise_for_status()
+        return True
+
+    async def put(
+        self,
+        data: bytes,
+        content_type: str | None,
+        *,
+        if_none_match: str | None = None,
+    ) -> httpx.Response:
+        params = {}
+        headers = {}
+        if if_none_match is not None:
+            params["IfNoneMatch"] = headers["If-None-Match"] = if_none_match
+        if content_type is not None:
+            params["ContentType"] = headers["Content-Type"] = content_type
+        return await self.http.put(
+            await self.sign("put_object", **params), content=data, headers=headers
+        )
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("s3", "touch"))
+    async def touch(self, *, content_type: str | None = None) -> bool:
+        # an object can only be copied onto itself with new metadata
+        params = {
+            "CopySource": f"{self.bucket}/{self.path}",
+            "MetadataDirective": "REPLACE",
+        }
+        headers = {
+            "x-amz-copy-source": quote(params["CopySource"]),
+            "x-amz-metadata-directive": "REPLACE",
+        }
+        if content_type is not None:
+            params["ContentType"] = headers["Content-Type"] = content_type
+        response = await self.http.put(
+            await self.sign("copy_object", **params), headers=headers
+        )
+        if response.status_code == httpx.codes.NOT_FOUND:
+            return False
+        response.raise_for_status()
+        return True
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("s3", "modified"))
+    async def modified(self) -> datetime | None:
+        response = await self.http.head(await self.sign("head_object"))
+        if response.status_code == httpx.codes.NOT_FOUND:
+            return None
+        response.raise_for_status()
+        return parsedate_to_datetime(response.headers["Last-Modified"])
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("s3", "delete"))
+    async def delete(self) -> None:
+        response = await self.http.delete(await self.sign("delete_object"))
+        response.raise_for_status()
+
+    @override
+    async def iter_files(self) -> AsyncIterator[StoredFile]:
+        prefix = f"{self.path}/"
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        # up to 1000 keys a page, listed in a thread since boto3 blocks
+        pages = iter(paginator.paginate(Bucket=self.bucket, Prefix=prefix))
+        while page := await anyio.to_thread.run_sync(next, pages, None):
+            for obj in page.get("Contents", []):
+                yield StoredFile(obj["Key"].removeprefix(prefix), obj["LastModified"])
+
+    @override
+    @metrics.timed(metrics.storage_seconds.labels("s3", "delete_many"))
+    async def delete_many(self, keys: list[str]) -> None:
+        for start in range(0, len(keys), s3_max_delete):
+            objects: list[ObjectIdentifierTypeDef] = [
+                {"Key": f"{self.path}/{key}"}
+                for key in keys[start : start + s3_max_delete]
+            ]
+            response = await anyio.to_thread.run_sync(
+                partial(
+                    self.s3_client.delete_objects,
+                    Bucket=self.bucket,
+                    Delete={"Objects": objects, "Quiet": True},
+                )
+            )
+            if errors := response.get("Errors"):
+                raise OSError(errors[0].get("Message"))
+
+    async def presigned_post(
+        self, *, content_type: str, max_size: int, expires_in: int
+    ) -> tuple[str, dict[str, str]]:
+        """Sign a form which uploads a file straight to the bucket.
+
+        Returns the url to POST the form to, and its fields.
+        """
+        post = await run_signer(
+            self.s3_client,
+            partial(
+                self.s3_client.generate_presigned_post,
+                self.bucket,
+                self.path,
+                Fields={"Content-Type": content_type},
+                Conditions=[
+                    {"Content-Type": content_type},
+                    ["content-length-range", 1, max_size],
+                ],
+                ExpiresIn=expires_in,
+            ),
+        )
+        return post["url"], post["fields"]
+
+    @override
+    def __truediv__(self, key: str) -> Self:
+        return type(self)(self.s3_client, self.http, self.bucket, f"{self.path}/{key}")
+
+
+class TextureCache:
+    """LRU cache of file contents, limited by their total size.
+
+    Textures are stored by their hash and never change, so the entries never
+    need to be invalidated.
+    """
+
+    def __init__(self, max_size: int, *, name: str = "memory") -> None:
+        self.max_size = max_size
+        self.name = name
+        self.size = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> bytes | None:
+        data = self._entries.get(key)
+        if data is None:
+            metrics.texture_cache_requests.labels(self.name, "miss").inc()
+            return None
+        metrics.texture_cache_requests.labels(self.name, "hit").inc()
+        self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if key in self._entries or len(data) > self.max_size:
+            return
+        self._entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+        metrics.texture_cache_bytes.labels(self.name).set(self.size)
+
+    def discard(self, key: str) -> None:
+        data = self._entries.pop(key, None)
+        if data is not None:
+            self.size -= len(data)
+            metrics.texture_cache_bytes.labels(self.name).set(self.size)
+
+
+@dataclass
+class CachedPath(Filesystem):
+    """Keeps the contents of the files read from `fs` in a `TextureCache`."""
+
+    fs: Filesystem
+    cache: TextureCache
+    key: str = ""
+
+    @override
+    async def exists(self) -> bool:
+        return self.key in self.cache or await self.fs.exists()
+
+    @override
+    async def read_bytes(self) -> bytes:
+        data = self.cache.get(self.key)
+        if data is None:
+            data = await self.fs.read_bytes()
+            self.cache.put(self.key, data)
+        return data
+
     @override
-    def exists(self) -> bool:
+    async def write_bytes(self, data: bytes, *, content_type: str | None = None) -> int:
+        return await self.fs.write_bytes(data, content_type=content_type)
+
+    @override
+    async def create(self, data: bytes, *, content_type: str | None = None) -> bool:
+        return await self.fs.create(data, content_type=content_type)
+
+    @override
+    async def touch(self, *, content_type: str | None = None) -> bool:
+        return await self.fs.touch(content_type=content_type)
+
+    @override
+    async def modified(self) -> datetime | None:
+        return await self.fs.modified()
+
+    @override
+    async def delete(self) -> None:
+        self.cache.discard(self.key)
+        await self.fs.delete()
+
+    @override
+    def iter_files(self) -> AsyncIterator[StoredFile]:
+        return self.fs.iter_files()
+
+    @override
+    async def delete_many(self, keys: list[str]) -> None:
+        for key in keys:
+            self.cache.discard(f"{self.key}/{key}" if self.key else key)
+        await self.fs.delete_many(keys)
+
+    @override
+    def __truediv__(self, key: str) -> Self:
+        return type(self)(
+            self.fs / key, self.cache, f"{self.key}/{key}" if self.key else key
+        )
+
+
+class DiskCache:
+    """Files kept on the local disk, limited by their total size.
+
+    The least recently read files are removed once the cache is full. Files
+    left by a previous run are reused, which are listed when it is created, so
+    it should be created when the app starts.
+    """
+
+    def __init__(self, root: Path, max_size: int, *, name: str = "disk") -> None:
+        self.root = FilePath(root, shard_depth=2)
+        self.max_size = max_size
+        self.name = name
+        self.size = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._fills: dict[str, asyncio.Future[bytes]] = {}
+
+        root.mkdir(parents=True, exist_ok=True)
+        files = [
+            (entry.stat(), entry.name)
+            for entry in root.rglob("*")
+            if entry.is_file() and not entry.name.startswith(".")
+        ]
+        for stat, name in sorted(files, key=lambda file: file[0].st_mtime):
+            self._entries[unquote(name)] = stat.st_size
+            self.size += stat.st_size
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def _path(self, key: str) -> FilePath:
+        # keys may be paths, but are stored as a single file
+        return self.root / quote(key, safe="")
+
+    async def get(self, key: str) -> bytes | None:
+        if key in self._entries:
+            try:
+                data = await self._path(key).read_bytes()
+            except FileNotFoundError:
+                self.size -= self._entries.pop(key)
+            else:
+                metrics.texture_cache_requests.labels(self.name, "hit").inc()
+                self._entries.move_to_end(key)
+                return data
+        metrics.texture_cache_requests.labels(self.name, "miss").inc()
+        return None
+
+    async def put(self, key: str, data: bytes) -> None:
+        if key in self._entries or len(data) > self.max_size:
+            return
+        # added before writing, so that concurrent puts of the key write it once
+        self._entries[key] = len(data)
+        self.size += len(data)
         try:
-            self.s3_client.head_object(Bucket=self.bucket, Key=self.path)
-        except botocore.exceptions.ClientError as e:
-            if e.response.get("Error", {}).get("Code") == "404":
-                return False
+            await self._path(key).write_bytes(data)
+        except BaseException:
+            await self.discard(key)
             raise
-        else:
-            return True
+        if key not in self._entries:
+            # evicted or discarded while it was written
+            await self._path(key).delete()
+        while self.size > self.max_size and self._entries:
+            evicted, size = self._entries.popitem(last=False)
+            self.size -= size
+            await anyio.Path(self._path(evicted).path).unlink(missing_ok=True)
+        metrics.texture_cache_bytes.labels(self.name).set(self.size)
+
+    async def discard(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self.size -= size
+            metrics.texture_cache_bytes.labels(self.name).set(self.size)
+        await self._path(key).delete()
+
+    async def fetch(self, key: str, load: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Get a file from the cache, or load it and add it to the cache.
+
+        Concurrent misses of the same key wait for a single load.
+        """
+        data = await self.get(key)
+        if data is not None:
+            return data
+
+        fill = self._fills.get(key)
+        if fill is None:
+            fill = self._fills[key] = asyncio.ensure_future(self._fill(key, load))
+            fill.add_done_callback(lambda _: self._fills.pop(key, None))
+        # a cancelled request shouldn't cancel the load for the others
+        return await asyncio.shield(fill)
+
+    async def _fill(self, key: str, load: Callable[[], Awaitable[bytes]]) -> bytes:
+        data = await load()
+        await self.put(key, data)
+        return data
+
+
+@dataclass
+class TieredPath(Filesystem):
+    """Storage in `fs`, with the files read from or written to it also kept in
+    a `DiskCache`.
+    """
+
+    fs: Filesystem
+    cache: DiskCache
+    key: str = ""
 
     @override
-    def write_bytes(self, data: bytes, *, content_type: str | None = None) -> int:
-        extra = {}
-        if content_type is not None:
-            extra["ContentType"] = content_type
-        self.s3_client.upload_fileobj(BytesIO(data), self.bucket, self.path, extra)
-        return len(data)
+    async def exists(self) -> bool:
+        return self.key in self.cache or await self.fs.exists()
+
+    @override
+    async def read_bytes(self) -> bytes:
+        return await self.cache.fetch(self.key, self.fs.read_bytes)
+
+    @override
+    async def write_bytes(self, data: bytes, *, content_type: str | None = None) -> int:
+        size = await self.fs.write_bytes(data, content_type=content_type)
+        await self.cache.put(self.key, data)
+        return size
+
+    @override
+    async def create(self, data: bytes, *, content_type: str | None = None) -> bool:
+        created = await self.fs.create(data, content_type=content_type)
+        await self.cache.put(self.key, data)
+        return created
+
+    @override
+    async def touch(self, *, content_type: str | None = None) -> bool:
+        return await self.fs.touch(content_type=content_type)
+
+    @override
+    async def modified(self) -> datetime | None:
+        return await self.fs.modified()
+
+    @override
+    async def delete(self) -> None:
+        await self.cache.discard(self.key)
+        await self.fs.delete()
+
+    @override
+    def iter_files(self) -> AsyncIterator[StoredFile]:
+        return self.fs.iter_files()
+
+    @override
+    async def delete_many(self, keys: list[str]) -> None:
+        for key in keys:
+            await self.cache.discard(f"{self.key}/{key}" if self.key else key)
+        await self.fs.delete_many(keys)
 
     @override
     def __truediv__(self, key: str) -> Self:
-        return type(self)(self.s3_client, self.bucket, f"{self.path}/{key}")
+        return type(self)(
+            self.fs / key, self.cache, f"{self.key}/{key}" if self.key else key
+        )
+
+
+@cache
+def get_s3_client() -> S3Client:
+    """Get the S3 client shared by all requests.
+
+    Creating a client loads the credentials, endpoints and service models, which
+    is too slow to do for every upload.
+    """
+    return boto3.client("s3")
+
+
+@cache
+def get_s3_http() -> httpx.AsyncClient:
+    """Get the HTTP client shared by all S3 requests, to reuse its connections."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=settings.s3_max_connections)
+    )
+
+
+@cache
+def get_disk_cache() -> DiskCache:
+    assert settings.textures_disk_cache_path is not None
+    return DiskCache(
+        Path(settings.textures_disk_cache_path), settings.textures_disk_cache_size
+    )
+
+
+def get_local_filesystem(config: Settings) -> FilePath:
+    path = Path(config.textures_path)
+    path.mkdir(parents=True, exist_ok=True)
+    return FilePath(path, config.textures_shard_depth)
 
 
-def get_filesystem(config: Annotated[Settings, Depends(get_settings)]) -> Filesystem:
+def get_filesystem(
+    config: Annotated[Settings, Depends(get_settings)],
+    http: Annotated[httpx.AsyncClient, Depends(get_s3_http)],
+) -> Filesystem:
     bucket = config.textures_bucket
     if bucket is None:
         # bucket not set, use local files for storage
-        path = Path(config.textures_path)
-        if not path.exists():
-            path.mkdir(parents=True)
-        return FilePath(path)
+        return get_local_filesystem(config)
 
     # use s3 for storage
-    s3_client = boto3.client("s3")
-    return S3Path(s3_client, bucket, config.textures_path)
+    fs = S3Path(get_s3_client(), http, bucket, config.textures_path)
+    if config.textures_disk_cache_path is not None:
+        return TieredPath(fs, get_disk_cache())
+    return fs
 
 
 @dataclass
 class Files:
     fs: Annotated[Filesystem, Depends(get_filesystem)]
 
-    def put_file(self, skin_hash: str, data: bytes) -> None:
-        """Save a texture to the file system"""
+    async def put_file(self, skin_hash: str, data: bytes) -> None:
+        """Save a texture to the file system
 
-        file = self.fs / skin_hash
+        Textures are stored by their hash, so it doesn't matter if another
+        upload already wrote the same one. Its modification time is updated
+        then, so that the garbage collector leaves it for the new upload.
+        """
+        path = self.fs / skin_hash
+        while not await path.create(data, content_type="image/png"):
+            if await path.touch(content_type="image/png"):
+                return
 
-        if not file.exists():
-            file.write_bytes(data, content_type="image/png")
+    async def put_derivatives(self, skin_hash: str, images: dict[str, bytes]) -> None:
+        """Save the images rendered from a texture next to it."""
+        async with anyio.create_task_group() as tg:
+            for name, data in images.items():
+                path = self.fs / derivative_key(skin_hash, name)
+                tg.start_soon(partial(path.create, data, content_type="image/png"))
 
 
 def verify_aws_credentials() -> None:
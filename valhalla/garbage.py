@@ -0,0 +1,152 @@
+"""Removal of uploads no texture uses, and of stored files no upload has.
+
+Both go through the uploads or the stored files in batches, which are deleted
+as they go, so an interrupted collection is resumed by running it again. Direct
+uploads to the bucket which were never completed are removed from the staging
+prefix too.
+"""
+
+import re
+from datetime import UTC, datetime, timedelta
+
+import anyio
+
+from . import image
+from .crud import CRUD
+from .files import Files, Filesystem
+
+texture_key = re.compile(image.texture_key_pattern)
+
+
+def upload_keys(texture_hash: str) -> list[str]:
+    """Get the keys of a texture and the images rendered from it."""
+    return [
+        texture_hash,
+        *(image.derivative_key(texture_hash, name) for name in image.derivative_names),
+    ]
+
+
+async def collect_uploads(
+    crud: CRUD,
+    files: Files,
+    *,
+    grace: timedelta,
+    batch_size: int = 1000,
+    dry_run: bool = False,
+) -> int:
+    """Delete the uploads older than `grace` which no texture uses, and their files.
+
+    Returns the number of uploads deleted, or that would be with `dry_run`.
+    """
+    before = datetime.now(UTC) - grace
+    collected = 0
+    after = 0
+    while uploads := await crud.get_unreferenced_uploads(
+        after, before=before, limit=batch_size
+    ):
+        after = uploads[-1].id
+        if dry_run:
+            collected += len(uploads)
+            continue
+
+        hashes = await crud.delete_uploads(
+            [upload.id for upload in uploads], before=before
+        )
+        await crud.db.commit()
+        # files left by an interruption here are found by collect_files
+        await files.fs.delete_many(await old_keys(files, hashes, before=before))
+        collected += len(hashes)
+    return collected
+
+
+async def old_keys(files: Files, hashes: list[str], *, before: datetime) -> list[str]:
+    """Get the keys of the files of deleted uploads to remove.
+
+    A texture which was stored again since `before` is about to get a new
+    upload, so it's kept. Its derivatives are rendered again for that upload.
+    """
+    keys: list[str] = []
+
+    async def check(texture_hash: str) -> None:
+        modified = await (files.fs / texture_hash).modified()
+        if modified is None or modified < before:
+            keys.append(texture_hash)
+        keys.extend(upload_keys(texture_hash)[1:])
+
+    async with anyio.create_task_group() as tg:
+        for texture_hash in hashes:
+            tg.start_soon(check, texture_hash)
+    return keys
+
+
+async def collect_files(
+    crud: CRUD,
+    files: Files,
+    *,
+    grace: timedelta,
+    batch_size: int = 1000,
+    dry_run: bool = False,
+) -> int:
+    """Delete the stored textures older than `grace` which have no upload.
+
+    Textures are stored before their upload is committed, so the grace period
+    has to be longer than any upload takes. Returns the number of files
+    deleted, or that would be with `dry_run`.
+    """
+    before = datetime.now(UTC) - grace
+    collected = 0
+    batch: list[str] = []
+    async for file in files.fs.iter_files():
+        # other files are left alone. Staged uploads have hex keys which would
+        # match, so TEXTURES_STAGING_PATH must not be the textures path itself.
+        # Under it, they are listed with their prefix, like `staging/<key>`.
+        if file.modified < before and texture_key.match(file.key):
+            batch.append(file.key)
+        if len(batch) >= batch_size:
+            collected += await collect_batch(crud, files, batch, dry_run=dry_run)
+            batch = []
+    if batch:
+        collected += await collect_batch(crud, files, batch, dry_run=dry_run)
+    return collected
+
+
+async def collect_staged(
+    staging: Filesystem,
+    *,
+    grace: timedelta,
+    batch_size: int = 1000,
+    dry_run: bool = False,
+) -> int:
+    """Delete the staged uploads older than `grace`, which were never completed.
+
+    A staged upload can only be completed until its token expires, so `grace`
+    should be longer than that. Returns the number of files deleted, or that
+    would be with `dry_run`.
+    """
+    before = datetime.now(UTC) - grace
+    collected = 0
+    batch: list[str] = []
+    async for file in staging.iter_files():
+        if file.modified < before:
+            batch.append(file.key)
+        if len(batch) >= batch_size:
+            if not dry_run:
+                await staging.delete_many(batch)
+            collected += len(batch)
+            batch = []
+    if batch and not dry_run:
+        await staging.delete_many(batch)
+    return collected + len(batch)
+
+
+async def collect_batch(
+    crud: CRUD, files: Files, keys: list[str], *, dry_run: bool
+) -> int:
+    hashes = {key.split("-", 1)[0] for key in keys}
+    known = await crud.get_known_hashes(hashes)
+    # don't keep a transaction open while listing the next batch
+    await crud.db.commit()
+    orphans = [key for key in keys if key.split("-", 1)[0] not in known]
+    if orphans and not dry_run:
+        await files.fs.delete_many(orphans)
+    return len(orphans)
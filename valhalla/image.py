@@ -4,8 +4,11 @@ from io import BytesIO
 from fastapi import HTTPException
 from PIL import Image, UnidentifiedImageError
 
+from . import metrics
+from .config import settings
 
-def gen_skin_hash(image_data: bytes) -> str:
+
+def open_skin(image_data: bytes) -> Image.Image:
     try:
         image = Image.open(BytesIO(image_data))
     except UnidentifiedImageError as e:
@@ -27,5 +30,128 @@ def gen_skin_hash(image_data: bytes) -> str:
     if not valid or width not in sizes:
         raise HTTPException(400, "Unsupported image size")
 
+    return image
+
+
+def hash_skin(image: Image.Image) -> str:
+    with metrics.image_seconds.labels("decode").time():
+        image.load()
     # Create a hash of the image and use it as the filename.
-    return hashlib.sha1(image.tobytes()).hexdigest()
+    with metrics.image_seconds.labels("hash").time():
+        return hashlib.sha1(image.tobytes()).hexdigest()
+
+
+def gen_skin_hash(image_data: bytes) -> str:
+    return hash_skin(open_skin(image_data))
+
+
+def png_bit_depth(image_data: bytes) -> int:
+    # the IHDR chunk comes first, with the bit depth after the width and height
+    return image_data[24]
+
+
+def optimize_png(image: Image.Image, image_data: bytes) -> bytes:
+    """Losslessly re-encode a PNG as small as possible.
+
+    Ancillary chunks like text, timestamps and color profiles are dropped. The
+    pixels and their mode are unchanged, so the hash of the skin is too. PNGs
+    with 16 bits per sample are kept as they are, since Pillow loads and saves
+    them with 8.
+    """
+    if png_bit_depth(image_data) == 16:
+        return image_data
+    data = BytesIO()
+    with metrics.image_seconds.labels("optimize").time():
+        image.save(data, "PNG", optimize=True, icc_profile=None)
+    optimized = data.getvalue()
+    if (
+        len(optimized) < len(image_data)
+        and Image.open(BytesIO(optimized)).mode == image.mode
+    ):
+        return optimized
+    return image_data
+
+
+def prepare_skin(image_data: bytes) -> tuple[str, bytes]:
+    """Validate a skin and get its hash and the bytes to store."""
+    image = open_skin(image_data)
+    if settings.optimize_textures:
+        image_data = optimize_png(image, image_data)
+    return hash_skin(image), image_data
+
+
+# sizes in pixels that the faces and busts of skins are rendered at
+derivative_sizes = (32, 64, 128)
+derivative_names = [
+    f"{kind}-{size}" for kind in ("face", "bust") for size in derivative_sizes
+]
+
+
+# the keys of textures, and of the images rendered from them
+texture_key_pattern = "^[0-9a-f]+(-(face|bust)-[0-9]+)?$"
+
+
+def derivative_key(texture_hash: str, name: str) -> str:
+    """Get the key an image rendered from a texture is stored under."""
+    return f"{texture_hash}-{name}"
+
+
+def _crop(skin: Image.Image, box: tuple[int, int, int, int]) -> Image.Image:
+    # boxes are in the pixels of a 64 wide skin, so scale them for HD skins
+    scale = skin.width // 64
+    left, top, right, bottom = (n * scale for n in box)
+    return skin.crop((left, top, right, bottom))
+
+
+def _overlay(
+    base: Image.Image, skin: Image.Image, box: tuple[int, int, int, int]
+) -> None:
+    layer = _crop(skin, box)
+    # like the game, ignore the hat of old skins if it is fully opaque
+    if skin.width == skin.height or layer.getextrema()[3][0] < 255:
+        base.alpha_composite(layer)
+
+
+def render_face(skin: Image.Image) -> Image.Image:
+    """Render the front of the head with the hat on top, 8x8 pixels scaled."""
+    skin = skin.convert("RGBA")
+    # the base layer is always opaque in game
+    face = _crop(skin, (8, 8, 16, 16)).convert("RGB").convert("RGBA")
+    _overlay(face, skin, (40, 8, 48, 16))
+    return face
+
+
+def render_bust(skin: Image.Image) -> Image.Image:
+    """Render the front of the head and the top of the body, 16x16 pixels scaled.
+
+    The arms are left out, since their width depends on the model of the skin.
+    """
+    skin = skin.convert("RGBA")
+    scale = skin.width // 64
+    body = _crop(skin, (20, 20, 28, 28)).convert("RGB").convert("RGBA")
+    if skin.width == skin.height:
+        # old skins have no jacket layer
+        _overlay(body, skin, (20, 36, 28, 44))
+
+    bust = Image.new("RGBA", (16 * scale, 16 * scale))
+    bust.paste(render_face(skin), (4 * scale, 0))
+    bust.paste(body, (4 * scale, 8 * scale))
+    return bust
+
+
+def render_derivatives(image_data: bytes) -> dict[str, bytes]:
+    """Render the face and bust of a skin at each of the derivative sizes.
+
+    The images are keyed by their name in `derivative_names`.
+    """
+    skin = Image.open(BytesIO(image_data))
+    images: dict[str, bytes] = {}
+    for kind, render in (("face", render_face), ("bust", render_bust)):
+        rendered = render(skin)
+        for size in derivative_sizes:
+            data = BytesIO()
+            rendered.resize((size, size), Image.Resampling.NEAREST).save(
+                data, "PNG", optimize=True
+            )
+            images[f"{kind}-{size}"] = data.getvalue()
+    return images
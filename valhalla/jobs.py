@@ -0,0 +1,195 @@
+"""Background jobs, recorded in the database so they survive restarts.
+
+Jobs are added in the transaction of the request which needs them, and run
+after it commits by the queue in the app, or in a separate worker process
+started with `python -m valhalla.worker`.
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Mapping
+from datetime import UTC, datetime, timedelta
+from typing import Any
+from weakref import WeakSet
+
+import anyio
+from sqlalchemy import event, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+
+from . import metrics, models
+
+logger = logging.getLogger(__name__)
+
+type Handler = Callable[[AsyncSession, dict[str, Any]], Awaitable[None]]
+
+jobs_added_key = "jobs_added"
+
+_queues: WeakSet[JobQueue] = WeakSet()
+
+
+class JobQueue:
+    """Run the jobs of the kinds in `handlers`, at most `concurrency` at a time.
+
+    Failed jobs are retried with an exponential backoff, until they have been
+    attempted `max_attempts` times. A job which is still running after `lease`
+    is assumed to have been lost with its worker, and is run again. While the
+    database can't be reached, the queue polls less often, up to every
+    `max_poll_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        handlers: Mapping[str, Handler],
+        *,
+        concurrency: int = 4,
+        max_attempts: int = 5,
+        retry_delay: timedelta = timedelta(seconds=10),
+        lease: timedelta = timedelta(minutes=5),
+        poll_interval: float = 5,
+        max_poll_interval: float = 60,
+    ) -> None:
+        self.session_factory = session_factory
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._running = 0
+        self._wakeup = asyncio.Event()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def claim(self, limit: int) -> list[models.Job]:
+        """Mark up to `limit` jobs which are due as running, and get them."""
+        now = datetime.now(UTC)
+        due = (
+            select(models.Job.id)
+            .where(
+                models.Job.kind.in_(self.handlers),
+                models.Job.status.in_(("pending", "running")),
+                models.Job.run_after <= now,
+            )
+            .order_by(models.Job.run_after)
+            .limit(limit)
+            # other workers skip the jobs being claimed, instead of waiting
+            .with_for_update(skip_locked=True)
+        )
+        async with self.session_factory() as db:
+            result = await db.scalars(
+                update(models.Job)
+                .where(models.Job.id.in_(due))
+                .values(
+                    status="running",
+                    attempts=models.Job.attempts + 1,
+                    run_after=now + self.lease,
+                )
+                .returning(models.Job)
+            )
+            jobs = list(result)
+            await db.commit()
+        return jobs
+
+    async def finish(self, job: models.Job, error: Exception | None) -> None:
+        now = datetime.now(UTC)
+        values: dict[str, Any] = {"status": "done", "error": None}
+        if error is not None:
+            values["error"] = f"{type(error).__name__}: {error}"
+            if job.attempts < self.max_attempts:
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                values.update(status="pending", run_after=now + delay)
+            else:
+                values["status"] = "failed"
+        if values["status"] != "pending":
+            values["finished_time"] = now
+
+        async with self.session_factory() as db:
+            await db.execute(
+                update(models.Job).where(models.Job.id == job.id).values(values)
+            )
+            await db.commit()
+        metrics.jobs.labels(job.kind, values["status"]).inc()
+
+    async def run_job(self, job: models.Job) -> None:
+        error = None
+        try:
+            async with self.session_factory() as db:
+                await self.handlers[job.kind](db, job.payload)
+                await db.commit()
+        except Exception as e:
+            error = e
+        await self.finish(job, error)
+
+    async def run_once(self) -> int:
+        """Run the jobs which are due until there are none left.
+
+        Returns the number of jobs run.
+        """
+        count = 0
+        while jobs := await self.claim(self.concurrency):
+            async with anyio.create_task_group() as tg:
+                for job in jobs:
+                    tg.start_soon(self.run_job, job)
+            count += len(jobs)
+        return count
+
+    async def run(self) -> None:
+        """Run jobs as they become due, until cancelled."""
+        _queues.add(self)
+        try:
+            async with anyio.create_task_group() as tg:
+                delay = self.poll_interval
+                while True:
+                    self._wakeup.clear()
+                    free = self.concurrency - self._running
+                    try:
+                        jobs = await self.claim(free) if free else []
+                    except Exception:
+                        logger.exception("Failed to claim jobs, retrying in %gs", delay)
+                        await anyio.sleep(delay)
+                        delay = min(delay * 2, self.max_poll_interval)
+                        continue
+                    delay = self.poll_interval
+                    for job in jobs:
+                        self._running += 1
+                        tg.start_soon(self._run_and_release, job)
+                    if len(jobs) < free:
+                        # jobs added by other processes are found by polling
+                        with anyio.move_on_after(self.poll_interval):
+                            await self._wakeup.wait()
+                    else:
+                        await self._wakeup.wait()
+        finally:
+            _queues.discard(self)
+
+    async def _run_and_release(self, job: models.Job) -> None:
+        try:
+            await self.run_job(job)
+        except Exception:
+            # the job is run again once its lease expires
+            logger.exception("Failed to finish job %s", job.id)
+        finally:
+            self._running -= 1
+            self.wake()
+
+
+def record_job(session: Session) -> None:
+    """Wake the queues in this process once the session commits."""
+    session.info[jobs_added_key] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_queues(session: Session) -> None:
+    if session.info.pop(jobs_added_key, False):
+        for queue in _queues:
+            queue.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_jobs(session: Session) -> None:
+    session.info.pop(jobs_added_key, None)
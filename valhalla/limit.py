@@ -4,6 +4,8 @@ from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 
+from . import metrics
+
 limiter = Limiter(key_func=get_remote_address)
 
 
@@ -12,6 +14,7 @@ def _rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> Re
     Build a simple JSON response that includes the details of the rate limit
     that was hit. If no limit is hit, the countdown is added to headers.
     """
+    metrics.rate_limited.labels(metrics.route_name(request.scope)).inc()
     response = JSONResponse(
         {
             "error": "RateLimitExceeded",
@@ -0,0 +1,284 @@
+"""Prometheus metrics, served at `/metrics`.
+
+When running several worker processes, set `PROMETHEUS_MULTIPROC_DIR` to an
+empty directory shared by them, so that the metrics of all workers are summed.
+"""
+
+import os
+from collections.abc import Callable, Coroutine
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import wraps
+from time import perf_counter
+from typing import Any
+from weakref import WeakKeyDictionary
+
+from fastapi import FastAPI, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, ExecutionContext
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import QueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+multiprocess_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# finer than the default buckets, for the many fast operations
+fast_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+http_request_seconds = Histogram(
+    "valhalla_http_request_seconds",
+    "Time to respond to a request, by route",
+    ["method", "route", "status"],
+    buckets=fast_buckets,
+)
+http_request_db_statements = Histogram(
+    "valhalla_http_request_db_statements",
+    "SQL statements executed for a request, by route",
+    ["route"],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 32, 64),
+)
+http_request_db_seconds = Histogram(
+    "valhalla_http_request_db_seconds",
+    "Time spent executing SQL statements for a request, by route",
+    ["route"],
+    buckets=fast_buckets,
+)
+rate_limited = Counter(
+    "valhalla_rate_limited_requests",
+    "Requests rejected by a rate limit, by route",
+    ["route"],
+)
+
+db_statement_seconds = Histogram(
+    "valhalla_db_statement_seconds",
+    "Time to execute a SQL statement",
+    ["engine"],
+    buckets=fast_buckets,
+)
+db_pool_checkout_seconds = Histogram(
+    "valhalla_db_pool_checkout_seconds",
+    "Time spent waiting to check out a database connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+db_pool_size = Gauge(
+    "valhalla_db_pool_size",
+    "Connections kept in the pool",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+db_pool_checked_out = Gauge(
+    "valhalla_db_pool_checked_out",
+    "Connections currently in use",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+db_pool_overflow = Gauge(
+    "valhalla_db_pool_overflow",
+    "Connections opened beyond the pool size",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+
+texture_cache_requests = Counter(
+    "valhalla_texture_cache_requests",
+    "Texture reads from a cache, by whether the texture was cached",
+    ["cache", "result"],
+)
+texture_cache_bytes = Gauge(
+    "valhalla_texture_cache_bytes",
+    "Size of the cached textures",
+    ["cache"],
+    multiprocess_mode="livesum",
+)
+
+storage_seconds = Histogram(
+    "valhalla_storage_seconds",
+    "Time of texture storage operations, by backend",
+    ["backend", "operation"],
+    buckets=fast_buckets,
+)
+image_seconds = Histogram(
+    "valhalla_image_seconds",
+    "Time to process uploaded images, by step",
+    ["step"],
+    buckets=fast_buckets,
+)
+outbound_request_seconds = Histogram(
+    "valhalla_outbound_request_seconds",
+    "Time of requests to other services, like Mojang's session server",
+    ["service"],
+)
+
+jobs = Counter(
+    "valhalla_jobs",
+    "Background job attempts, by whether the job is done, retried or failed",
+    ["kind", "status"],
+)
+
+
+type AsyncFunction[**P, T] = Callable[P, Coroutine[Any, Any, T]]
+
+
+def timed[**P, T](
+    histogram: Histogram,
+) -> Callable[[AsyncFunction[P, T]], AsyncFunction[P, T]]:
+    """Observe how long calls of an async function take."""
+
+    def decorator(func: AsyncFunction[P, T]) -> AsyncFunction[P, T]:
+        @wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            start = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+@dataclass
+class RequestStats:
+    statements: int = 0
+    db_seconds: float = 0
+
+
+# the statements of the request being handled, if any
+request_stats = ContextVar[RequestStats | None]("request_stats", default=None)
+
+
+class PoolTracker:
+    """Reports the connections checked out of a pool as they change.
+
+    The gauges are updated by pool events instead of read from the pool when
+    scraped, so that they can be summed over worker processes.
+    """
+
+    def __init__(self, engine: AsyncEngine, name: str, size: int) -> None:
+        self.size = size
+        self.checked_out = 0
+        self.checked_out_gauge = db_pool_checked_out.labels(name)
+        self.overflow_gauge = db_pool_overflow.labels(name)
+        db_pool_size.labels(name).set(size)
+        event.listen(engine.sync_engine, "checkout", self.checkout)
+        event.listen(engine.sync_engine, "checkin", self.checkin)
+
+    def checkout(self, *args: object) -> None:
+        self.update(1)
+
+    def checkin(self, *args: object) -> None:
+        self.update(-1)
+
+    def update(self, change: int) -> None:
+        self.checked_out += change
+        self.checked_out_gauge.set(self.checked_out)
+        self.overflow_gauge.set(max(self.checked_out - self.size, 0))
+
+
+def track_engine(engine: AsyncEngine, name: str) -> None:
+    """Report the pool usage and the statement times of an engine."""
+    if isinstance(engine.pool, QueuePool):
+        PoolTracker(engine, name, engine.pool.size())
+
+    statement_seconds = db_statement_seconds.labels(name)
+    # by execution, as connections may be shared, like SQLite's in memory ones
+    starts = WeakKeyDictionary[ExecutionContext, float]()
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn: Connection,
+        cursor: object,
+        statement: str,
+        parameters: object,
+        context: ExecutionContext,
+        executemany: bool,  # noqa: FBT001
+    ) -> None:
+        starts[context] = perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(
+        conn: Connection,
+        cursor: object,
+        statement: str,
+        parameters: object,
+        context: ExecutionContext,
+        executemany: bool,  # noqa: FBT001
+    ) -> None:
+        elapsed = perf_counter() - starts.pop(context)
+        statement_seconds.observe(elapsed)
+        if (stats := request_stats.get()) is not None:
+            stats.statements += 1
+            stats.db_seconds += elapsed
+
+
+def route_name(scope: Scope) -> str:
+    """The path template of the route handling a request."""
+    # set by the router, so unmatched paths don't each add a label value
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+class RequestMetricsMiddleware:
+    """Records the latency and the SQL statements of every request."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - start
+            request_stats.reset(token)
+            route = route_name(scope)
+            http_request_seconds.labels(scope["method"], route, str(status)).observe(
+                elapsed
+            )
+            http_request_db_statements.labels(route).observe(stats.statements)
+            http_request_db_seconds.labels(route).observe(stats.db_seconds)
+
+
+def mark_process_dead() -> None:
+    """Stop reporting the live gauges of this process to the other workers."""
+    if multiprocess_dir is not None:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+async def metrics() -> Response:
+    registry = REGISTRY
+    if multiprocess_dir is not None:
+        # read the metrics written by every worker process
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def setup(app: FastAPI) -> None:
+    app.add_api_route("/metrics", metrics, include_in_schema=False)
+    # added last, so that it is the outermost middleware and times the others
+    app.add_middleware(RequestMetricsMiddleware)
@@ -4,7 +4,7 @@ from datetime import datetime
 from typing import Any
 from uuid import UUID
 
-from sqlalchemy import ForeignKey, func
+from sqlalchemy import BigInteger, ForeignKey, Index, false, func
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -26,10 +26,10 @@ class User(Base):
     name: Mapped[str] = mapped_column()
 
     textures: Mapped[list[Texture]] = relationship(
-        back_populates="user", init=False, lazy="selectin", repr=False
+        back_populates="user", init=False, lazy="raise", repr=False
     )
     uploads: Mapped[list[Upload]] = relationship(
-        back_populates="user", init=False, lazy="selectin", repr=False
+        back_populates="user", init=False, lazy="raise", repr=False
     )
 
 
@@ -41,6 +41,8 @@ class Upload(Base):
     upload_time: Mapped[datetime] = mapped_column(
         insert_default=func.current_timestamp(), default=None
     )
+    # whether the face and bust images of the skin have been rendered
+    has_derivatives: Mapped[bool] = mapped_column(default=False, server_default=false())
 
     user: Mapped[User] = relationship(back_populates="uploads", init=False, repr=False)
     textures: Mapped[list[Texture]] = relationship(
@@ -50,6 +52,17 @@ class Upload(Base):
 
 class Texture(Base):
     __tablename__ = "textures"
+    __table_args__ = (
+        Index("ix_textures_user_id_tex_type_id", "user_id", "tex_type", "id"),
+        Index(
+            "ix_textures_user_id_tex_type_start_time_end_time",
+            "user_id",
+            "tex_type",
+            "start_time",
+            "end_time",
+        ),
+        Index("ix_textures_upload_id", "upload_id"),
+    )
 
     id: Mapped[int] = mapped_column(init=False, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
@@ -64,8 +77,77 @@ class Texture(Base):
     end_time: Mapped[datetime | None] = mapped_column(default=None)
 
     user: Mapped[User] = relationship(
-        back_populates="textures", init=False, lazy="selectin", repr=False
+        back_populates="textures", init=False, lazy="raise", repr=False
     )
     upload: Mapped[Upload] = relationship(
         back_populates="textures", init=False, lazy="selectin", repr=False
     )
+
+
+class ArchivedTexture(Base):
+    """Texture history moved out of `textures` by compaction.
+
+    Rows keep the id they had in `textures`.
+    """
+
+    __tablename__ = "textures_archive"
+    __table_args__ = (
+        Index("ix_textures_archive_user_id_tex_type_id", "user_id", "tex_type", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    upload_id: Mapped[int] = mapped_column(ForeignKey("uploads.id"), index=True)
+    tex_type: Mapped[str] = mapped_column()
+    meta: Mapped[Any] = mapped_column(JSON)
+    start_time: Mapped[datetime] = mapped_column()
+    end_time: Mapped[datetime] = mapped_column()
+    archive_time: Mapped[datetime] = mapped_column(
+        insert_default=func.current_timestamp(), default=None
+    )
+
+
+class TextureChange(Base):
+    """Append-only log of texture changes.
+
+    The id is used as the cursor for the change feed. On Postgres, ids are not
+    given in the order of the commits, so the id of the transaction which made
+    the change is used instead, see `CRUD.get_changed_users`.
+    """
+
+    __tablename__ = "texture_changes"
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    tex_type: Mapped[str] = mapped_column()
+    change_time: Mapped[datetime] = mapped_column(
+        insert_default=func.current_timestamp(), default=None
+    )
+    txid: Mapped[int | None] = mapped_column(BigInteger, default=None, index=True)
+
+
+class Job(Base):
+    """Background work, run by a `jobs.JobQueue`."""
+
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    kind: Mapped[str] = mapped_column()
+    payload: Mapped[Any] = mapped_column(JSON, default_factory=dict)
+    # the user the job was done for, if any
+    user_id: Mapped[int | None] = mapped_column(
+        ForeignKey("users.id"), default=None, index=True
+    )
+    # pending, running, done or failed
+    status: Mapped[str] = mapped_column(default="pending")
+    attempts: Mapped[int] = mapped_column(default=0)
+    error: Mapped[str | None] = mapped_column(default=None)
+    created_time: Mapped[datetime] = mapped_column(
+        insert_default=func.current_timestamp(), default=None
+    )
+    # when a pending job is next run, or when a running job is given up on
+    run_after: Mapped[datetime] = mapped_column(
+        insert_default=func.current_timestamp(), default=None
+    )
+    finished_time: Mapped[datetime | None] = mapped_column(default=None)
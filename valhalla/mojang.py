@@ -3,6 +3,7 @@ from uuid import UUID
 import httpx
 from fastapi import HTTPException
 
+from . import metrics
 from .schemas import BaseModel
 
 # ?username=username&serverId=hash&ip=ip"
@@ -14,6 +15,7 @@ class HasJoinedResponse(BaseModel):
     name: str
 
 
+@metrics.timed(metrics.outbound_request_seconds.labels("mojang"))
 async def has_joined(*, username: str, server_id: str) -> HasJoinedResponse:
     """Validates a login against Mojang's servers
 
@@ -0,0 +1,39 @@
+"""Compaction of the texture history, by the retention settings.
+
+Old history is moved to the `textures_archive` table, so the `textures` table
+and its indexes only hold the current textures and the history kept. The
+`texture_changes` log only keeps the latest change of each user.
+"""
+
+from datetime import UTC, datetime, timedelta
+
+from .crud import CRUD
+
+
+async def compact(
+    crud: CRUD,
+    *,
+    keep_last: int | None,
+    keep_days: float | None,
+    batch_size: int = 1000,
+) -> tuple[int, int]:
+    """Archive the history of all users, `batch_size` users at a time.
+
+    With neither `keep_last` nor `keep_days`, all of the history is archived.
+    Each batch is committed on its own. Returns the number of textures archived
+    and of changes deleted.
+    """
+    keep_since = None
+    if keep_days is not None:
+        keep_since = datetime.now(UTC) - timedelta(days=keep_days)
+
+    archived = pruned = 0
+    after = 0
+    while user_ids := await crud.get_user_ids(after, limit=batch_size):
+        archived += await crud.archive_textures(
+            user_ids, keep_last=keep_last, keep_since=keep_since
+        )
+        pruned += await crud.prune_changes(user_ids)
+        await crud.db.commit()
+        after = user_ids[-1]
+    return archived, pruned
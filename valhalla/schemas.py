@@ -1,6 +1,6 @@
 from datetime import UTC, datetime
 from functools import partial
-from typing import Annotated
+from typing import Annotated, Literal
 from uuid import UUID
 
 from fastapi import File, Form, HTTPException, UploadFile, status
@@ -47,12 +47,17 @@ class LoginResponse(BaseModel):
 class Texture(BaseModel):
     url: str
     metadata: dict[str, str] | None = None
+    # images rendered from skins, like `face-64`, by their name
+    derivatives: dict[str, str] | None = None
 
     model_config = ConfigDict(
         json_schema_extra={
             "example": {
                 "url": "https://textures.minelittlepony-mod.com/textures/4bbd43fd83ee1053c42994c4bf1db9496ede6b73",
                 "metadata": {"model": "default"},
+                "derivatives": {
+                    "face-64": "https://textures.minelittlepony-mod.com/textures/4bbd43fd83ee1053c42994c4bf1db9496ede6b73-face-64",
+                },
             }
         }
     )
@@ -82,6 +87,7 @@ class UserTextures(BaseModel):
 
 
 class TextureHistoryEntry(BaseModel):
+    id: int
     url: str
     metadata: dict[str, str] | None = None
     start_time: Timestamp
@@ -90,6 +96,7 @@ class TextureHistoryEntry(BaseModel):
     model_config = ConfigDict(
         json_schema_extra={
             "example": {
+                "id": 42,
                 "url": "https://textures.minelittlepony-mod.com/textures/4bbd43fd83ee1053c42994c4bf1db9496ede6b73",
                 "metadata": {
                     "model": "default",
@@ -113,6 +120,7 @@ class UserTextureHistory(BaseModel):
                 "profileName": "Sollace",
                 "textures": [
                     {
+                        "id": 42,
                         "url": "https://textures.minelittlepony-mod.com/textures/4bbd43fd83ee1053c42994c4bf1db9496ede6b73",
                         "metadata": {
                             "model": "default",
@@ -126,6 +134,26 @@ class UserTextureHistory(BaseModel):
     )
 
 
+class ProfileChanges(BaseModel):
+    cursor: int
+    profile_ids: list[UUID]
+    has_more: bool
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "cursor": 1024,
+                "profileIds": ["51aa42eb7aef4b6ab758ab0fadac5ab5"],
+                "hasMore": False,
+            }
+        }
+    )
+
+
+class ProfileChangeEvent(BaseModel):
+    profile_id: UUID
+
+
 class TextureUpload(BaseModel):
     type: str = Form()
     file: UploadFile = File(media_type="image/png")
@@ -150,6 +178,35 @@ class TexturePost(BaseModel):
     meta: dict[str, str] | None = None
 
 
+class TextureUploadRequest(BaseModel):
+    type: TextureType
+    meta: dict[str, str] | None = None
+
+
+class TextureUploadIntent(BaseModel):
+    url: str
+    fields: dict[str, str]
+    token: str
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "url": "https://bucket.s3.amazonaws.com/",
+                "fields": {
+                    "Content-Type": "image/png",
+                    "key": "staging/3f2a9c0e5b7d4e8f9a1b2c3d4e5f6a7b",
+                    "policy": "eyJleHBpcmF0aW9uIjogIjIwMjUtMDEtMDFUMDA6MDA6MDBaIn0=",
+                },
+                "token": "eyJhbGciOiJIUzI1NiJ9.eyJ1cGxvYWQiOiJzdGFnaW5nIn0.c2ln",
+            }
+        }
+    )
+
+
+class TextureUploadComplete(BaseModel):
+    token: str
+
+
 class BulkRequest(BaseModel):
     uuids: list[UUID]
 
@@ -186,3 +243,27 @@ class BulkResponse(BaseModel):
             }
         }
     )
+
+
+class Job(BaseModel):
+    id: int
+    kind: str
+    status: Literal["pending", "running", "done", "failed"]
+    attempts: int
+    error: str | None = None
+    created_time: Timestamp
+    finished_time: Timestamp | None = None
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "id": 42,
+                "kind": "derivatives",
+                "status": "done",
+                "attempts": 1,
+                "error": None,
+                "createdTime": 1667697567511,
+                "finishedTime": 1667697567742,
+            }
+        }
+    )
@@ -0,0 +1,86 @@
+"""Serving of textures from this server, rather than from the bucket or a CDN."""
+
+import os
+from functools import cache
+from typing import Annotated
+
+import anyio.to_thread
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi import Path as PathParam
+from fastapi.responses import FileResponse
+from starlette import status
+
+from .config import settings
+from .files import (
+    CachedPath,
+    FilePath,
+    Filesystem,
+    TextureCache,
+    get_filesystem,
+    get_local_filesystem,
+    get_s3_http,
+)
+from .image import texture_key_pattern
+
+router = APIRouter(include_in_schema=False)
+
+# textures are stored by their hash, so they never change
+immutable = "public, max-age=31536000, immutable"
+
+texture_cache = TextureCache(settings.texture_cache_size)
+
+
+@cache
+def get_texture_storage() -> Filesystem:
+    """Get the storage textures are served from, shared by all requests.
+
+    It is created when the app starts, so that requests don't check the local
+    directory, and the S3 client is only made for a bucket.
+    """
+    if settings.textures_bucket is None:
+        return get_local_filesystem(settings)
+    return get_filesystem(settings, get_s3_http())
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+@router.api_route("/textures/{texture_hash}", methods=["GET", "HEAD"])
+async def get_texture_file(
+    texture_hash: Annotated[str, PathParam(pattern=texture_key_pattern)],
+    fs: Annotated[Filesystem, Depends(get_texture_storage)],
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Response:
+    etag = f'"{texture_hash}"'
+    headers = {"Cache-Control": immutable, "ETag": etag}
+    # answered once the texture is known to exist, since `*` matches any tag
+    not_modified = if_none_match is not None and etag_matches(etag, if_none_match)
+
+    file = fs / texture_hash
+    if isinstance(file, FilePath):
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, file.path)
+        except FileNotFoundError:
+            raise HTTPException(status.HTTP_404_NOT_FOUND) from None
+        if not_modified:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        # sent with zero-copy by servers supporting the ASGI pathsend extension,
+        # and kept in memory by the page cache rather than the texture cache
+        return FileResponse(
+            file.path, stat_result=stat_result, media_type="image/png", headers=headers
+        )
+
+    if texture_cache.max_size:
+        file = CachedPath(fs, texture_cache) / texture_hash
+    if not_modified:
+        if not await file.exists():
+            raise HTTPException(status.HTTP_404_NOT_FOUND)
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    try:
+        data = await file.read_bytes()
+    except FileNotFoundError:
+        raise HTTPException(status.HTTP_404_NOT_FOUND) from None
+    return Response(data, media_type="image/png", headers=headers)
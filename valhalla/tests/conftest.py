@@ -1,6 +1,8 @@
+import os
 from collections.abc import AsyncGenerator, Generator
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
+from io import BytesIO
 from pathlib import Path
 from typing import Annotated, Any, Literal
 from uuid import UUID, uuid4
@@ -8,20 +10,33 @@ from uuid import UUID, uuid4
 import pytest
 from fastapi import Depends, FastAPI, Header
 from fastapi.testclient import TestClient
+from PIL import Image
 from pytest_httpx import HTTPXMock
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from valhalla.models import User
 
+from .. import metrics
 from ..app import app
 from ..auth import current_user
-from ..config import Env, settings
+from ..config import Env, resolve_db, settings
 from ..crud import CRUD
 from ..db import get_db
 from ..models import Base
+from ..static import get_texture_storage
 
 assets = Path(__file__).parent / "assets"
 
+
+def random_skin() -> bytes:
+    """Generate a skin that has not been uploaded before."""
+    image = Image.frombytes("RGBA", (64, 64), os.urandom(64 * 64 * 4))
+    data = BytesIO()
+    image.save(data, "PNG")
+    return data.getvalue()
+
+
 settings.env = Env.TESTING
 
 SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
@@ -29,7 +44,8 @@ SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
-TestingSessionLocal = async_sessionmaker[AsyncSession](engine)
+metrics.track_engine(engine, "test")
+TestingSessionLocal = async_sessionmaker[AsyncSession](engine, expire_on_commit=False)
 
 
 @asynccontextmanager
@@ -70,10 +86,44 @@ app.dependency_overrides[current_user] = override_current_user
 @pytest.fixture
 def client(tmpdir: Path) -> Generator[TestClient]:
     settings.textures_path = str(tmpdir)
+    # the storage is created once for the app, so again for each test's directory
+    get_texture_storage.cache_clear()
     with TestClient(app) as client:
         yield client
 
 
+@pytest.fixture
+def postgres_url() -> str:
+    """The URL of a Postgres database to test with.
+
+    The tests using it are skipped unless `TEST_POSTGRES_URL` is set.
+    """
+    url = os.environ.get("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    return url
+
+
+@pytest.fixture
+async def postgres(
+    postgres_url: str,
+) -> AsyncGenerator[async_sessionmaker[AsyncSession]]:
+    """Sessions of the Postgres database, with the tables in a new schema."""
+    schema = f"test_{uuid4().hex}"
+    engine = create_async_engine(
+        resolve_db(postgres_url), connect_args={"options": f"-csearch_path={schema}"}
+    )
+    async with engine.begin() as conn:
+        await conn.execute(text(f"CREATE SCHEMA {schema}"))
+        await conn.run_sync(Base.metadata.create_all)
+    try:
+        yield async_sessionmaker[AsyncSession](engine, expire_on_commit=False)
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        await engine.dispose()
+
+
 @pytest.fixture(autouse=True)
 def anyio_backend() -> Literal["asyncio"]:
     return "asyncio"
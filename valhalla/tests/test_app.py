@@ -4,6 +4,7 @@ from pathlib import Path
 
 import pytest
 
+from ..app import supervise
 from ..config import settings
 from .conftest import TestClient, TestUser, assets
 
@@ -149,3 +150,18 @@ def test_skin_delete(client: TestClient, user: TestUser) -> None:
     )
 
     assert resp.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_supervise_restarts_failed_task() -> None:
+    runs = 0
+
+    async def flaky() -> None:
+        nonlocal runs
+        runs += 1
+        if runs < 3:
+            raise RuntimeError
+
+    await supervise(flaky, delay=0)
+
+    assert runs == 3
@@ -1,4 +1,10 @@
-from .conftest import TestClient, TestUser, assets
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from .. import models
+from ..crud import CRUD
+from .conftest import TestClient, TestingSessionLocal, TestUser, assets
 
 test_skin = assets / "good" / "64x64.png"
 
@@ -37,3 +43,57 @@ def test_bulk_users(client: TestClient, users: list[TestUser]) -> None:
     data = resp.json()
     original_users = [user["profileId"] for user in data["users"]]
     assert original_users == uuids
+
+
+@pytest.mark.anyio
+async def test_bulk_users_at(client: TestClient, users: list[TestUser]) -> None:
+    now = datetime.now(UTC)
+    times = [now - timedelta(hours=h) for h in (3, 2, 1)]
+
+    async with TestingSessionLocal() as db:
+        crud = CRUD(db)
+        for u in users[:2]:
+            user = await crud.get_or_create_user(u.uuid, u.name)
+            upload = models.Upload(hash=f"{u.uuid.hex}-1", user_id=user.id)
+            db.add(upload)
+            await db.flush()
+            db.add_all(
+                [
+                    models.Texture(
+                        user_id=user.id,
+                        upload_id=upload.id,
+                        tex_type="skin",
+                        meta={"n": "1"},
+                        start_time=times[0],
+                        end_time=times[1],
+                    ),
+                    models.Texture(
+                        user_id=user.id,
+                        upload_id=upload.id,
+                        tex_type="skin",
+                        meta={"n": "2"},
+                        start_time=times[1],
+                    ),
+                ]
+            )
+        await db.commit()
+
+    uuids = [str(u.uuid) for u in users[:2]]
+
+    def skins_at(at: datetime) -> list[str | None]:
+        resp = client.post(
+            "/api/v1/bulk_textures",
+            params={"at": at.isoformat()},
+            json={"uuids": uuids},
+        )
+        assert resp.status_code == 200
+        data = resp.json()
+        assert [user["profileId"] for user in data["users"]] == uuids
+        return [
+            user["textures"].get("skin", {}).get("metadata", {}).get("n")
+            for user in data["users"]
+        ]
+
+    assert skins_at(times[0] - timedelta(hours=1)) == [None, None]
+    assert skins_at(times[0] + timedelta(minutes=1)) == ["1", "1"]
+    assert skins_at(times[2]) == ["2", "2"]
@@ -0,0 +1,108 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ..api.v1.changes import get_profile_changes
+from ..crud import CRUD
+from ..models import User
+from ..schemas import ProfileChanges
+from .conftest import TestClient, TestUser, assets
+
+test_skin = assets / "good" / "64x64.png"
+
+
+def upload_skin(client: TestClient, user: TestUser) -> None:
+    resp = client.put(
+        "/api/v1/textures",
+        headers=user.auth_header,
+        files={"file": (test_skin.name, test_skin.read_bytes(), "image/png")},
+    )
+    assert resp.status_code == 200
+
+
+def get_changes(client: TestClient, **params: int) -> dict:
+    resp = client.get("/api/v1/changes", params=params)
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def test_changes_head(client: TestClient, user: TestUser) -> None:
+    head = get_changes(client)
+    assert head["profileIds"] == []
+    assert not head["hasMore"]
+
+    upload_skin(client, user)
+
+    assert get_changes(client)["cursor"] > head["cursor"]
+
+
+def test_changes_since(client: TestClient, users: list[TestUser]) -> None:
+    cursor = get_changes(client)["cursor"]
+
+    for u in users:
+        upload_skin(client, u)
+    # changing a user again moves them to the end of the feed
+    client.delete(
+        "/api/v1/textures", headers=users[0].auth_header, params={"type": "skin"}
+    )
+
+    expected = [str(u.uuid) for u in [*users[1:], users[0]]]
+    seen = []
+    while True:
+        page = get_changes(client, since=cursor, limit=3)
+        seen += page["profileIds"]
+        cursor = page["cursor"]
+        if not page["hasMore"]:
+            break
+
+    assert seen == expected
+    assert get_changes(client, since=cursor)["profileIds"] == []
+
+
+@pytest.mark.anyio
+async def test_changes_postgres(
+    postgres: async_sessionmaker[AsyncSession], users: list[TestUser]
+) -> None:
+    async def change(*changed: User) -> None:
+        async with postgres() as db:
+            crud = CRUD(db)
+            for user in changed:
+                await crud.put_texture(user, "skin", None)
+            await db.commit()
+
+    async def get_page(since: int, limit: int) -> ProfileChanges:
+        async with postgres() as db:
+            return await get_profile_changes(CRUD(db), since=since, limit=limit)
+
+    async with postgres() as db:
+        crud = CRUD(db)
+        db_users = [await crud.get_or_create_user(u.uuid, u.name) for u in users]
+        await db.commit()
+        cursor = await crud.get_changes_cursor()
+
+    # the last three share the cursor of their transaction
+    await change(db_users[0])
+    await change(db_users[1])
+    await change(*db_users[2:])
+
+    # the limit falls in the middle of the transaction
+    pages = []
+    while True:
+        page = await get_page(cursor, 3)
+        pages.append(page.profile_ids)
+        cursor = page.cursor
+        if not page.has_more:
+            break
+    uuids = [u.uuid for u in users]
+    assert [set(page) for page in pages] == [set(uuids[:2]), set(uuids[2:]), set()]
+
+    # a change committed while an older transaction is running is held back
+    async with postgres() as running:
+        await CRUD(running).put_texture(db_users[0], "cape", None)
+        await running.flush()
+        await change(db_users[1])
+        assert (await get_page(cursor, 3)).profile_ids == []
+        await running.commit()
+
+    page = await get_page(cursor, 3)
+    assert set(page.profile_ids) == set(uuids[:2])
+    assert page.cursor > cursor
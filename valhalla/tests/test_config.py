@@ -1,6 +1,7 @@
 import pytest
+from pydantic import ValidationError
 
-from ..config import resolve_db
+from ..config import Settings, resolve_db
 
 
 @pytest.mark.parametrize(
@@ -18,3 +19,10 @@ from ..config import resolve_db
 )
 def test_database_url(url: str, expected: str) -> None:
     assert resolve_db(url) == expected
+
+
+def test_job_settings_positive() -> None:
+    with pytest.raises(ValidationError):
+        Settings(job_concurrency=0)
+    with pytest.raises(ValidationError):
+        Settings(job_max_attempts=0)
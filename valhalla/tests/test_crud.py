@@ -0,0 +1,229 @@
+import asyncio
+import sqlite3
+from collections.abc import Generator
+from contextlib import closing
+from pathlib import Path
+from uuid import uuid4
+
+import anyio
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from ..api.v1.textures import store_texture, upload_file
+from ..config import Settings
+from ..crud import CRUD, recent_writers
+from ..database import create_engine
+from ..files import FilePath, Files
+from ..models import Base, User
+from ..writer import Writer, _Write
+from .conftest import TestClient, TestingSessionLocal, TestUser, engine, random_skin
+
+
+@pytest.fixture
+def statements() -> Generator[list[str]]:
+    """Collect the statements sent to the database, including commits."""
+    statements: list[str] = []
+
+    def before_cursor_execute(*args: object) -> None:
+        statement = str(args[2])
+        statements.append(" ".join(statement.split()[:3]))
+
+    def commit(*args: object) -> None:
+        statements.append("COMMIT")
+
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(sync_engine, "commit", commit)
+    yield statements
+    event.remove(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.remove(sync_engine, "commit", commit)
+
+
+@pytest.mark.anyio
+async def test_upload_statements(
+    client: TestClient, user: TestUser, tmp_path: Path, statements: list[str]
+) -> None:
+    texture_hash = await store_texture("skin", random_skin(), Files(FilePath(tmp_path)))
+
+    async with TestingSessionLocal() as db:
+        crud = CRUD(db)
+        db_user = await crud.get_or_create_user(user.uuid, user.name)
+        await db.commit()
+        await db.refresh(db_user)
+
+        statements.clear()
+        await upload_file(db_user, "skin", texture_hash, None, crud)
+        await db.commit()
+        new_upload = list(statements)
+
+        await db.refresh(db_user)
+        statements.clear()
+        await upload_file(db_user, "elytra", texture_hash, None, crud)
+        await db.commit()
+        known_upload = list(statements)
+
+    assert new_upload == [
+        "INSERT INTO uploads",
+        "INSERT INTO jobs",
+        "UPDATE textures SET",
+        "INSERT INTO textures",
+        "INSERT INTO texture_changes",
+        "COMMIT",
+    ]
+    assert known_upload == [
+        "INSERT INTO uploads",
+        "UPDATE uploads SET",
+        "UPDATE textures SET",
+        "INSERT INTO textures",
+        "INSERT INTO texture_changes",
+        "COMMIT",
+    ]
+
+
+@pytest.mark.anyio
+async def test_concurrent_logins(tmp_path: Path) -> None:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'logins.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_local = async_sessionmaker[AsyncSession](engine)
+
+    uuid = uuid4()
+
+    async def login(n: int) -> int:
+        async with session_local() as db:
+            user = await CRUD(db).get_or_create_user(uuid, f"TestUser{n}")
+            user_id = user.id
+            await db.commit()
+            return user_id
+
+    user_ids = await asyncio.gather(*(login(n) for n in range(2000)))
+
+    async with session_local() as db:
+        users = (await db.scalars(select(User))).all()
+    await engine.dispose()
+
+    assert len(users) == 1
+    assert set(user_ids) == {users[0].id}
+    assert users[0].name.startswith("TestUser")
+
+
+@pytest.mark.anyio
+async def test_replica_routing(tmp_path: Path) -> None:
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    for db_engine in (primary, replica):
+        async with db_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    primary_local = async_sessionmaker[AsyncSession](primary)
+    replica_local = async_sessionmaker[AsyncSession](replica)
+
+    uuid = uuid4()
+    async with primary_local() as db, replica_local() as replica_db:
+        crud = CRUD(db, replica_db)
+        # nothing is written to the replica, so reads from it find nothing
+        assert await crud.get_user_by_uuid(uuid) is None
+
+        user = await crud.get_or_create_user(uuid, "TestUser")
+        await crud.put_texture(user, "skin", None)
+        # reads after a write in the same request go to the primary
+        assert await crud.get_user_by_uuid(uuid) is user
+        await db.commit()
+
+    async with primary_local() as db, replica_local() as replica_db:
+        db_user = await CRUD(db).get_user_by_uuid(uuid)
+        assert db_user is not None
+        crud = CRUD(db, replica_db)
+        # the user changed recently, so the replica might be stale
+        assert crud.reader(db_user) is db
+        recent_writers.clear()
+        assert crud.reader(db_user) is replica_db
+        assert crud.reader() is replica_db
+
+    async with primary_local() as db:
+        # a login creating the user is a change of it too
+        user = await CRUD(db).get_or_create_user(uuid4(), "NewUser")
+        user_id = user.id
+        await db.commit()
+    async with primary_local() as db, replica_local() as replica_db:
+        new_user = await db.get(User, user_id)
+        assert new_user is not None
+        assert CRUD(db, replica_db).reader(new_user) is db
+
+    await primary.dispose()
+    await replica.dispose()
+
+
+@pytest.mark.anyio
+async def test_write_queue(tmp_path: Path) -> None:
+    engine = create_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'writes.db'}", Settings(), name="test"
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_local = async_sessionmaker[AsyncSession](engine, expire_on_commit=False)
+    writer = Writer(session_local, max_batch=16)
+
+    transactions = 0
+
+    def before_cursor_execute(*args: object) -> None:
+        nonlocal transactions
+        if args[2] == "BEGIN":
+            transactions += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+    async def fail(crud: CRUD) -> None:
+        await crud.get_or_create_user(uuid4(), "Failed")
+        raise ValueError
+
+    async def login(n: int) -> User:
+        async with session_local() as db:
+            crud = CRUD(db, writer=writer)
+            if n == 0:
+                with pytest.raises(ValueError):
+                    await crud.transaction(fail)
+            user = await crud.transaction(
+                lambda crud: crud.get_or_create_user(uuid4(), f"TestUser{n}")
+            )
+            await crud.transaction(lambda crud: crud.put_texture(user, "skin", None))
+            return user
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(writer.run)
+        users = await asyncio.gather(*(login(n) for n in range(200)))
+        tg.cancel_scope.cancel()
+
+    async with session_local() as db:
+        names = set((await db.scalars(select(User.name))).all())
+    await engine.dispose()
+
+    assert names == {user.name for user in users}
+    assert 0 < transactions < 400
+
+
+@pytest.mark.anyio
+async def test_write_queue_commits_batch_once(tmp_path: Path) -> None:
+    path = tmp_path / "writes.db"
+    engine = create_engine(f"sqlite+aiosqlite:///{path}", Settings(), name="test")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_local = async_sessionmaker[AsyncSession](engine, expire_on_commit=False)
+    writer = Writer(session_local)
+
+    def visible_users() -> int:
+        with closing(sqlite3.connect(path)) as conn:
+            return conn.execute("SELECT count(*) FROM users").fetchone()[0]
+
+    async def login(db: AsyncSession) -> int:
+        await CRUD(db).get_or_create_user(uuid4(), "TestUser")
+        return await anyio.to_thread.run_sync(visible_users)
+
+    futures = [asyncio.get_running_loop().create_future() for _ in range(3)]
+    await writer.apply([_Write(login, future) for future in futures])
+    visible = [future.result() for future in futures]
+    committed = await anyio.to_thread.run_sync(visible_users)
+    await engine.dispose()
+
+    assert visible == [0, 0, 0]
+    assert committed == 3
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+import pytest
+from sqlalchemy import text
+
+from ..config import Settings
+from ..database import create_engine
+from .conftest import TestClient
+
+
+@pytest.mark.anyio
+async def test_sqlite_pragmas(tmp_path: Path) -> None:
+    config = Settings(sqlite_busy_timeout=1234)
+    engine = create_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", config, name="test"
+    )
+    async with engine.connect() as conn:
+        journal_mode = await conn.scalar(text("PRAGMA journal_mode"))
+        busy_timeout = await conn.scalar(text("PRAGMA busy_timeout"))
+        synchronous = await conn.scalar(text("PRAGMA synchronous"))
+    await engine.dispose()
+
+    assert journal_mode == "wal"
+    assert busy_timeout == 1234
+    assert synchronous == 1  # NORMAL
+
+
+def test_pool_metrics(client: TestClient) -> None:
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert "valhalla_db_pool_checkout_seconds_count" in resp.text
+    assert 'valhalla_db_pool_size{engine="primary"}' in resp.text
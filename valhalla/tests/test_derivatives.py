@@ -0,0 +1,132 @@
+from collections.abc import Generator
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from .. import derivatives, image
+from ..app import app
+from ..config import get_settings, settings
+from ..crud import CRUD
+from ..files import FilePath, Files
+from ..jobs import JobQueue
+from ..worker import handlers
+from .conftest import TestClient, TestingSessionLocal, TestUser, random_skin
+
+red = (255, 0, 0, 255)
+green = (0, 255, 0, 255)
+blue = (0, 0, 255, 255)
+clear = (0, 0, 0, 0)
+
+
+def make_skin(width: int, height: int) -> Image.Image:
+    skin = Image.new("RGBA", (width, height))
+    scale = width // 64
+    skin.paste(red, (8 * scale, 8 * scale, 16 * scale, 16 * scale))
+    skin.paste(blue, (20 * scale, 20 * scale, 28 * scale, 32 * scale))
+    return skin
+
+
+@pytest.mark.parametrize("size", [64, 128])
+def test_render_bust(size: int) -> None:
+    bust = image.render_bust(make_skin(size, size))
+
+    scale = size // 64
+    assert bust.size == (16 * scale, 16 * scale)
+    assert bust.getpixel((0, 0)) == clear
+    assert bust.getpixel((4 * scale, 0)) == red
+    assert bust.getpixel((12 * scale - 1, 8 * scale - 1)) == red
+    assert bust.getpixel((4 * scale, 8 * scale)) == blue
+    assert bust.getpixel((12 * scale, 8 * scale)) == clear
+
+
+def test_render_face_hat() -> None:
+    skin = make_skin(64, 64)
+    skin.paste(green, (40, 8, 48, 9))
+    assert image.render_face(skin).getpixel((0, 0)) == green
+    assert image.render_face(skin).getpixel((0, 1)) == red
+
+    # old skins often have an opaque hat, which is not drawn
+    legacy = make_skin(64, 32)
+    legacy.paste(green, (40, 8, 48, 16))
+    assert set(image.render_face(legacy).getdata()) == {red}
+
+
+def test_render_derivatives() -> None:
+    data = BytesIO()
+    make_skin(64, 64).save(data, "PNG")
+
+    images = image.render_derivatives(data.getvalue())
+
+    assert list(images) == image.derivative_names
+    for name, png in images.items():
+        size = int(name.rsplit("-", 1)[1])
+        assert Image.open(BytesIO(png)).size == (size, size)
+
+
+@pytest.fixture
+def local_files() -> Generator[None]:
+    # store uploads where the texture route serves them from
+    app.dependency_overrides[get_settings] = lambda: settings
+    yield
+    del app.dependency_overrides[get_settings]
+
+
+@pytest.mark.anyio
+async def test_upload_derivatives(
+    local_files: None, client: TestClient, user: TestUser
+) -> None:
+    resp = client.put(
+        "/api/v1/textures",
+        headers=user.auth_header,
+        files={"file": ("skin.png", random_skin(), "image/png")},
+        data={"type": "skin"},
+    )
+    assert resp.status_code == 200, resp.json()
+
+    skin = client.get(f"/api/v1/user/{user.uuid}").json()["textures"]["skin"]
+    assert skin["derivatives"] is None
+    [job] = client.get("/api/v1/jobs", headers=user.auth_header).json()
+    assert job["kind"] == "derivatives"
+    assert job["status"] == "pending"
+
+    await JobQueue(TestingSessionLocal, handlers).run_once()
+
+    [job] = client.get("/api/v1/jobs", headers=user.auth_header).json()
+    assert job["status"] == "done"
+    for limit in [0, 101]:
+        resp = client.get(
+            "/api/v1/jobs", headers=user.auth_header, params={"limit": limit}
+        )
+        assert resp.status_code == 422
+    skin = client.get(f"/api/v1/user/{user.uuid}").json()["textures"]["skin"]
+    assert list(skin["derivatives"]) == image.derivative_names
+    assert skin["derivatives"]["face-64"] == skin["url"] + "-face-64"
+
+    resp = client.get(skin["derivatives"]["bust-128"])
+    assert resp.status_code == 200
+    assert Image.open(BytesIO(resp.content)).size == (128, 128)
+
+
+@pytest.mark.anyio
+async def test_backfill(client: TestClient, user: TestUser, tmp_path: Path) -> None:
+    files = Files(FilePath(tmp_path))
+    data = random_skin()
+    skin_hash = image.gen_skin_hash(data)
+    await files.put_file(skin_hash, data)
+
+    async with TestingSessionLocal() as db:
+        crud = CRUD(db)
+        db_user = await crud.get_or_create_user(user.uuid, user.name)
+        # as uploaded before derivatives were rendered
+        upload, _ = await crud.put_upload(db_user, skin_hash)
+        await crud.put_texture(db_user, "skin", upload)
+        await db.commit()
+
+        # skins of other tests are not in tmp_path, so they are skipped
+        assert await derivatives.backfill(crud, files, batch_size=2) == 1
+        assert await derivatives.backfill(crud, files) == 0
+
+    for name in image.derivative_names:
+        assert (tmp_path / image.derivative_key(skin_hash, name)).exists()
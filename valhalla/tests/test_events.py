@@ -0,0 +1,121 @@
+import asyncio
+from uuid import uuid4
+
+import anyio
+import pytest
+
+from ..api.v1.changes import stream_profile_changes
+from ..crud import CRUD
+from ..events import Broker, PostgresBackend, broker, libpq_url
+from .conftest import TestClient, TestingSessionLocal, TestUser
+
+
+@pytest.mark.anyio
+async def test_subscription_coalesces() -> None:
+    local_broker = Broker(max_pending=10)
+    first, second = uuid4(), uuid4()
+
+    with local_broker.subscribe([first, second]) as sub:
+        local_broker.publish(first)
+        local_broker.publish(uuid4())
+        local_broker.publish(first)
+        local_broker.publish(second)
+
+        assert await sub.get() == [first, second]
+
+    local_broker.publish(first)
+    assert not local_broker._subscriptions  # noqa: SLF001
+
+
+@pytest.mark.anyio
+async def test_subscription_overflow() -> None:
+    local_broker = Broker(max_pending=2)
+    profile_ids = [uuid4() for _ in range(3)]
+
+    with local_broker.subscribe(profile_ids) as sub:
+        for profile_id in profile_ids:
+            local_broker.publish(profile_id)
+
+        assert await sub.get() is None
+
+        local_broker.publish(profile_ids[0])
+        assert await sub.get() == [profile_ids[0]]
+
+
+@pytest.mark.anyio
+async def test_resync() -> None:
+    local_broker = Broker(max_pending=10)
+    profile_id = uuid4()
+
+    with local_broker.subscribe([profile_id]) as sub:
+        local_broker.publish(profile_id)
+        local_broker.resync()
+
+        assert await sub.get() is None
+
+
+def test_postgres_outbox_overflow() -> None:
+    backend = PostgresBackend("postgres://db/valhalla", max_outbox=2)
+    for _ in range(3):
+        backend.publish(uuid4())
+    profile_id = uuid4()
+    backend.publish(profile_id)
+
+    outbox = backend._outbox  # noqa: SLF001
+    assert [outbox.get_nowait() for _ in range(outbox.qsize())] == [None, profile_id]
+
+
+@pytest.mark.anyio
+async def test_postgres_resync_other_nodes(postgres_url: str) -> None:
+    other_node = Broker()
+    other_node.backend = PostgresBackend(postgres_url)
+    node = PostgresBackend(postgres_url, max_outbox=2)
+    profile_id = uuid4()
+
+    with other_node.subscribe([profile_id]) as sub:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(other_node.run)
+            # after connecting
+            assert await sub.get() is None
+
+            # the changes dropped while this node couldn't send them
+            for _ in range(3):
+                node.publish(profile_id)
+            tg.start_soon(node.run, lambda profile_id: None, lambda: None)
+            with anyio.fail_after(5):
+                assert await sub.get() is None
+
+            node.publish(profile_id)
+            with anyio.fail_after(5):
+                assert await sub.get() == [profile_id]
+            tg.cancel_scope.cancel()
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "postgres://user:pass@db:5432/valhalla",
+        "postgresql+psycopg://user:pass@db:5432/valhalla",
+    ],
+)
+def test_libpq_url(url: str) -> None:
+    assert libpq_url(url) == "postgresql://user:pass@db:5432/valhalla"
+
+
+@pytest.mark.anyio
+async def test_stream_published_on_commit(client: TestClient, user: TestUser) -> None:
+    stream = stream_profile_changes([user.uuid])
+    pending = asyncio.create_task(anext(stream))
+    # let the stream subscribe before the change is made
+    await asyncio.sleep(0)
+
+    async with TestingSessionLocal() as db:
+        crud = CRUD(db)
+        db_user = await crud.get_or_create_user(user.uuid, user.name)
+        await crud.put_texture(db_user, "skin", None)
+        await db.commit()
+
+    event = await pending
+    assert event == f'event: change\ndata: {{"profileId":"{user.uuid}"}}\n\n'
+    await stream.aclose()
+    assert not broker._subscriptions  # noqa: SLF001
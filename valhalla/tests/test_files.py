@@ -0,0 +1,100 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from ..config import settings
+from ..files import CachedPath, FilePath, TextureCache, relayout
+from ..static import get_texture_storage
+from .conftest import TestClient
+
+
+@pytest.mark.anyio
+async def test_sharded_write(tmp_path: Path) -> None:
+    fs = FilePath(tmp_path, shard_depth=2)
+
+    await (fs / "abcdef").write_bytes(b"texture")
+
+    assert (tmp_path / "ab" / "cd" / "abcdef").read_bytes() == b"texture"
+    assert os.listdir(tmp_path / "ab" / "cd") == ["abcdef"]
+
+
+@pytest.mark.anyio
+async def test_texture_file(client: TestClient) -> None:
+    settings.textures_shard_depth = 2
+    get_texture_storage.cache_clear()
+    try:
+        await (FilePath(Path(settings.textures_path), 2) / "abcdef").create(b"png")
+        resp = client.get("/textures/abcdef")
+        not_modified = client.get(
+            "/textures/abcdef", headers={"If-None-Match": '"abcdef"'}
+        )
+        missing = [
+            client.get("/textures/012345", headers=headers)
+            for headers in ({}, {"If-None-Match": '"012345"'}, {"If-None-Match": "*"})
+        ]
+    finally:
+        settings.textures_shard_depth = 0
+        get_texture_storage.cache_clear()
+
+    assert resp.status_code == 200
+    assert resp.content == b"png"
+    assert resp.headers["content-type"] == "image/png"
+    assert resp.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert resp.headers["etag"] == '"abcdef"'
+
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == '"abcdef"'
+
+    assert [resp.status_code for resp in missing] == [404, 404, 404]
+    assert client.get("/textures/..%2Fvalhalla.db").status_code in (404, 422)
+
+
+def test_relayout(tmp_path: Path) -> None:
+    for key in ("abcdef", "abcd12", "123456"):
+        (tmp_path / key).write_text(key)
+    (tmp_path / ".abcdef.tmp").write_text("partial")
+
+    assert relayout(tmp_path, 2, workers=2) == 3
+    assert (tmp_path / "ab" / "cd" / "abcd12").read_text() == "abcd12"
+    assert (tmp_path / "12" / "34" / "123456").read_text() == "123456"
+    assert (tmp_path / ".abcdef.tmp").exists()
+
+    assert relayout(tmp_path, 0, workers=2) == 3
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        ".abcdef.tmp",
+        "123456",
+        "abcd12",
+        "abcdef",
+    ]
+
+
+def test_texture_cache_eviction() -> None:
+    cache = TextureCache(10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+
+    # evicts b, which was used least recently
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.size == 8
+
+    # too big to be cached at all
+    cache.put("d", b"d" * 11)
+    assert "d" not in cache
+    assert "c" in cache
+
+
+@pytest.mark.anyio
+async def test_cached_path(tmp_path: Path) -> None:
+    fs = CachedPath(FilePath(tmp_path), TextureCache(1024))
+    await (fs / "abcdef").create(b"png")
+
+    assert await (fs / "abcdef").read_bytes() == b"png"
+    os.remove(tmp_path / "abcdef")
+    assert await (fs / "abcdef").read_bytes() == b"png"
+
+    with pytest.raises(FileNotFoundError):
+        await (fs / "012345").read_bytes()
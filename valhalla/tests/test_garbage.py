@@ -0,0 +1,126 @@
+import os
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import update
+
+from .. import garbage, image
+from ..crud import CRUD
+from ..files import FilePath, Files
+from ..models import Upload
+from .conftest import TestClient, TestingSessionLocal, TestUser
+
+# so that everything written by the test counts as old
+no_grace = timedelta(seconds=-1)
+
+
+@pytest.mark.anyio
+async def test_collect_uploads(
+    client: TestClient, user: TestUser, tmp_path: Path
+) -> None:
+    files = Files(FilePath(tmp_path))
+    used, unused = os.urandom(20).hex(), os.urandom(20).hex()
+    for key in (*garbage.upload_keys(used), *garbage.upload_keys(unused)):
+        await (files.fs / key).create(b"png")
+
+    async with TestingSessionLocal() as db:
+        crud = CRUD(db)
+        db_user = await crud.get_or_create_user(user.uuid, user.name)
+        used_upload, _ = await crud.put_upload(db_user, used)
+        # left by an old texture, after its history was removed
+        unused_upload, _ = await crud.put_upload(db_user, unused)
+        await crud.put_texture(db_user, "skin", used_upload)
+        await db.commit()
+
+        assert await garbage.collect_uploads(crud, files, grace=timedelta(hours=1)) == 0
+        assert (
+            await garbage.collect_uploads(crud, files, grace=no_grace, dry_run=True)
+            >= 1
+        )
+        assert await db.get(Upload, unused_upload.id) is not None
+
+        assert (
+            await garbage.collect_uploads(crud, files, grace=no_grace, batch_size=1)
+            >= 1
+        )
+        assert await db.get(Upload, unused_upload.id) is None
+        assert await db.get(Upload, used_upload.id) is not None
+
+    assert sorted(os.listdir(tmp_path)) == sorted(garbage.upload_keys(used))
+
+
+@pytest.mark.anyio
+async def test_collect_files(
+    client: TestClient, user: TestUser, tmp_path: Path
+) -> None:
+    files = Files(FilePath(tmp_path, shard_depth=1))
+    known, orphan = os.urandom(20).hex(), os.urandom(20).hex()
+    keys = [known, image.derivative_key(known, "face-64"), orphan]
+    keys.append(image.derivative_key(orphan, "face-64"))
+    for key in keys:
+        await (files.fs / key).create(b"png")
+    (tmp_path / "README.txt").write_text("not a texture")
+
+    async with TestingSessionLocal() as db:
+        crud = CRUD(db)
+        db_user = await crud.get_or_create_user(user.uuid, user.name)
+        await crud.put_upload(db_user, known)
+        await db.commit()
+
+        assert await garbage.collect_files(crud, files, grace=timedelta(hours=1)) == 0
+        assert (
+            await garbage.collect_files(crud, files, grace=no_grace, dry_run=True) == 2
+        )
+        assert (
+            await garbage.collect_files(crud, files, grace=no_grace, batch_size=1) == 2
+        )
+
+    remaining = sorted([file.key async for file in files.fs.iter_files()])
+    assert remaining == sorted(["README.txt", *keys[:2]])
+
+
+@pytest.mark.anyio
+async def test_collect_staged(tmp_path: Path) -> None:
+    staging = FilePath(tmp_path)
+    for key in ("a1", "b2", "c3"):
+        await (staging / key).create(b"png")
+
+    assert await garbage.collect_staged(staging, grace=timedelta(hours=1)) == 0
+    assert await garbage.collect_staged(staging, grace=no_grace, dry_run=True) == 3
+    assert await garbage.collect_staged(staging, grace=no_grace, batch_size=2) == 3
+    assert [file async for file in staging.iter_files()] == []
+
+
+@pytest.mark.anyio
+async def test_collect_uploads_used_again(
+    client: TestClient, user: TestUser, tmp_path: Path
+) -> None:
+    files = Files(FilePath(tmp_path))
+    reused, restored = os.urandom(20).hex(), os.urandom(20).hex()
+    old = datetime.now(UTC) - timedelta(days=1)
+    for key in (*garbage.upload_keys(reused), *garbage.upload_keys(restored)):
+        await (files.fs / key).create(b"png")
+        os.utime(tmp_path / key, (old.timestamp(), old.timestamp()))
+
+    async with TestingSessionLocal() as db:
+        crud = CRUD(db)
+        db_user = await crud.get_or_create_user(user.uuid, user.name)
+        await crud.put_upload(db_user, reused)
+        await crud.put_upload(db_user, restored)
+        await db.execute(update(Upload).values(upload_time=old))
+        await db.commit()
+
+        # uploaded again, but not used by a texture yet
+        _, created = await crud.put_upload(db_user, reused)
+        await db.commit()
+        assert not created
+        # stored again, but its upload isn't committed yet
+        await files.put_file(restored, b"png")
+
+        assert await garbage.collect_uploads(crud, files, grace=timedelta(hours=1)) >= 1
+        assert await crud.get_known_hashes([reused, restored]) == {reused}
+
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [*garbage.upload_keys(reused), restored]
+    )
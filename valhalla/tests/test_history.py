@@ -0,0 +1,56 @@
+from .conftest import TestClient, TestUser, assets
+
+skins = sorted((assets / "good").glob("*.png"))
+
+
+def test_history_limit(client: TestClient, user: TestUser) -> None:
+    for skin in skins:
+        for tex_type in ["skin", "elytra"]:
+            resp = client.put(
+                "/api/v1/textures",
+                headers=user.auth_header,
+                data={"type": tex_type},
+                files={"file": (skin.name, skin.read_bytes(), "image/png")},
+            )
+            assert resp.status_code == 200
+
+    resp = client.get("/api/v1/history", headers=user.auth_header)
+    assert resp.status_code == 200
+    history = resp.json()["textures"]
+    assert len(history["skin"]) == len(history["elytra"]) == len(skins)
+    assert history["skin"][0]["endTime"] is None
+    assert all(entry["endTime"] is not None for entry in history["skin"][1:])
+
+    resp = client.get(f"/api/v1/history/{user.uuid}", params={"limit": 2})
+    assert resp.status_code == 200
+    limited = resp.json()["textures"]
+    assert limited == {"skin": history["skin"][:2], "elytra": history["elytra"][:2]}
+
+    for limit in [0, 1001]:
+        resp = client.get(f"/api/v1/history/{user.uuid}", params={"limit": limit})
+        assert resp.status_code == 422
+
+
+def test_history_pages(client: TestClient, user: TestUser) -> None:
+    for skin in skins:
+        resp = client.put(
+            "/api/v1/textures",
+            headers=user.auth_header,
+            files={"file": (skin.name, skin.read_bytes(), "image/png")},
+        )
+        assert resp.status_code == 200
+
+    entries: list[dict] = []
+    params: dict[str, str | int] = {"type": "skin", "limit": 4}
+    while True:
+        resp = client.get(f"/api/v1/history/{user.uuid}", params=params)
+        assert resp.status_code == 200
+        page = resp.json()["textures"].get("skin", [])
+        if not page:
+            break
+        entries += page
+        params["before"] = page[-1]["id"]
+
+    ids = [entry["id"] for entry in entries]
+    assert len(ids) == len(skins)
+    assert ids == sorted(ids, reverse=True)
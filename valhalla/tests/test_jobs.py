@@ -0,0 +1,132 @@
+from datetime import timedelta
+from typing import Any
+
+import anyio
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..crud import CRUD
+from ..jobs import JobQueue
+from ..models import Job
+from .conftest import TestingSessionLocal
+
+# the client creates the tables
+pytestmark = pytest.mark.usefixtures("client")
+
+
+async def add_job(kind: str) -> Job:
+    async with TestingSessionLocal() as db:
+        job = await CRUD(db).add_job(kind, {"n": 1})
+        await db.commit()
+    return job
+
+
+async def get_job(job_id: int) -> Job:
+    async with TestingSessionLocal() as db:
+        job = await db.get(Job, job_id)
+    assert job is not None
+    return job
+
+
+@pytest.mark.anyio
+async def test_job_retried() -> None:
+    payloads: list[dict[str, Any]] = []
+
+    async def flaky(db: AsyncSession, payload: dict[str, Any]) -> None:
+        payloads.append(payload)
+        if len(payloads) == 1:
+            raise ValueError("flaky")
+
+    job = await add_job("flaky")
+    queue = JobQueue(TestingSessionLocal, {"flaky": flaky}, retry_delay=timedelta())
+
+    assert await queue.run_once() == 2
+
+    job = await get_job(job.id)
+    assert payloads == [{"n": 1}, {"n": 1}]
+    assert job.status == "done"
+    assert job.attempts == 2
+    assert job.error is None
+    assert job.finished_time is not None
+
+
+@pytest.mark.anyio
+async def test_job_failed() -> None:
+    async def broken(db: AsyncSession, payload: dict[str, Any]) -> None:
+        raise ValueError("broken")
+
+    job = await add_job("broken")
+    queue = JobQueue(
+        TestingSessionLocal,
+        {"broken": broken},
+        max_attempts=3,
+        retry_delay=timedelta(),
+    )
+
+    assert await queue.run_once() == 3
+    assert await queue.run_once() == 0
+
+    job = await get_job(job.id)
+    assert job.status == "failed"
+    assert job.attempts == 3
+    assert job.error == "ValueError: broken"
+
+
+@pytest.mark.anyio
+async def test_job_lease_expired() -> None:
+    async def ok(db: AsyncSession, payload: dict[str, Any]) -> None:
+        pass
+
+    job = await add_job("lost")
+    lost = JobQueue(TestingSessionLocal, {"lost": ok}, lease=timedelta())
+    # the worker which claimed the job never finishes it
+    assert [claimed.id for claimed in await lost.claim(1)] == [job.id]
+
+    assert await JobQueue(TestingSessionLocal, {"lost": ok}).run_once() == 1
+    job = await get_job(job.id)
+    assert job.status == "done"
+    assert job.attempts == 2
+
+
+@pytest.mark.anyio
+async def test_queue_woken_on_commit() -> None:
+    done = anyio.Event()
+
+    async def handler(db: AsyncSession, payload: dict[str, Any]) -> None:
+        done.set()
+
+    # without being woken, the job would wait for the next poll
+    queue = JobQueue(TestingSessionLocal, {"wake": handler}, poll_interval=60)
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(queue.run)
+        await anyio.sleep(0.1)
+        await add_job("wake")
+        with anyio.fail_after(5):
+            await done.wait()
+        tg.cancel_scope.cancel()
+
+
+@pytest.mark.anyio
+async def test_queue_survives_claim_errors() -> None:
+    done = anyio.Event()
+    claims = 0
+
+    async def handler(db: AsyncSession, payload: dict[str, Any]) -> None:
+        done.set()
+
+    class FlakyQueue(JobQueue):
+        async def claim(self, limit: int) -> list[Job]:
+            nonlocal claims
+            claims += 1
+            if claims == 1:
+                raise ConnectionError
+            return await super().claim(limit)
+
+    await add_job("flaky_claim")
+    queue = FlakyQueue(TestingSessionLocal, {"flaky_claim": handler}, poll_interval=0)
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(queue.run)
+        with anyio.fail_after(5):
+            await done.wait()
+        tg.cancel_scope.cancel()
+    assert claims > 1
@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import pytest
+from prometheus_client import REGISTRY
+
+from ..files import FilePath
+from ..image import gen_skin_hash
+from .conftest import TestClient, TestUser, random_skin
+
+
+def sample(name: str, **labels: str) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_request_metrics(client: TestClient, user: TestUser) -> None:
+    route = "/api/v1/user/{user_id}"
+    labels = {"method": "GET", "route": route, "status": "404"}
+    requests = sample("valhalla_http_request_seconds_count", **labels)
+    statements = sample("valhalla_http_request_db_statements_sum", route=route)
+
+    # not found, as the user has not logged in yet
+    resp = client.get(f"/api/v1/user/{user.uuid}")
+    assert resp.status_code == 404
+
+    assert sample("valhalla_http_request_seconds_count", **labels) == requests + 1
+    # counted by the engine listeners, in the context of the request
+    assert sample("valhalla_http_request_db_statements_sum", route=route) > statements
+
+
+def test_unmatched_route_metrics(client: TestClient) -> None:
+    labels = {"method": "GET", "route": "unmatched", "status": "404"}
+    requests = sample("valhalla_http_request_seconds_count", **labels)
+
+    resp = client.get("/no/such/page")
+    assert resp.status_code == 404
+
+    assert sample("valhalla_http_request_seconds_count", **labels) == requests + 1
+
+
+def test_image_metrics() -> None:
+    decoded = sample("valhalla_image_seconds_count", step="decode")
+    hashed = sample("valhalla_image_seconds_count", step="hash")
+
+    gen_skin_hash(random_skin())
+
+    assert sample("valhalla_image_seconds_count", step="decode") == decoded + 1
+    assert sample("valhalla_image_seconds_count", step="hash") == hashed + 1
+
+
+@pytest.mark.anyio
+async def test_storage_metrics(tmp_path: Path) -> None:
+    writes = sample("valhalla_storage_seconds_count", backend="file", operation="write")
+    reads = sample("valhalla_storage_seconds_count", backend="file", operation="read")
+
+    file = FilePath(tmp_path) / "texture"
+    await file.write_bytes(b"data")
+    await file.read_bytes()
+
+    assert (
+        sample("valhalla_storage_seconds_count", backend="file", operation="write")
+        == writes + 1
+    )
+    assert (
+        sample("valhalla_storage_seconds_count", backend="file", operation="read")
+        == reads + 1
+    )
@@ -0,0 +1,79 @@
+import os
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from ..crud import CRUD
+from ..models import ArchivedTexture
+from .conftest import TestClient, TestingSessionLocal, TestUser
+
+
+@pytest.mark.anyio
+async def test_archive_textures(client: TestClient, user: TestUser) -> None:
+    async with TestingSessionLocal() as db:
+        crud = CRUD(db)
+        db_user = await crud.get_or_create_user(user.uuid, user.name)
+        uploads = []
+        for _ in range(5):
+            upload, _ = await crud.put_upload(db_user, os.urandom(20).hex())
+            await crud.put_texture(db_user, "skin", upload)
+            uploads.append(upload)
+        await crud.put_texture(db_user, "cape", uploads[0])
+        await db.commit()
+        history = await crud.get_user_textures_history(db_user)
+
+        archived = await crud.archive_textures(
+            [db_user.id], keep_last=2, keep_since=None
+        )
+        await db.commit()
+
+        assert archived == 3
+        kept = await crud.get_user_textures_history(db_user)
+        assert kept["skin"] == history["skin"][:2]
+        assert kept["cape"] == history["cape"]
+        result = await db.scalars(
+            select(ArchivedTexture).where(ArchivedTexture.user_id == db_user.id)
+        )
+        assert sorted(texture.id for texture in result) == sorted(
+            texture.id for texture in history["skin"][2:]
+        )
+        # the archived textures still use their uploads
+        unreferenced = await crud.get_unreferenced_uploads(
+            0, before=datetime.now(UTC) + timedelta(minutes=1), limit=1000
+        )
+        assert not {u.id for u in unreferenced} & {u.id for u in uploads}
+
+        # the current textures are never archived
+        archived = await crud.archive_textures(
+            [db_user.id],
+            keep_last=None,
+            keep_since=datetime.now(UTC) + timedelta(minutes=1),
+        )
+        await db.commit()
+
+        assert archived == 1
+        textures = await crud.get_user_textures(db_user)
+        assert textures["skin"].upload_id == uploads[-1].id
+        assert textures["cape"].upload_id == uploads[0].id
+
+
+@pytest.mark.anyio
+async def test_prune_changes(client: TestClient, users: list[TestUser]) -> None:
+    async with TestingSessionLocal() as db:
+        crud = CRUD(db)
+        db_users = [await crud.get_or_create_user(u.uuid, u.name) for u in users[:2]]
+        since = await crud.get_changes_cursor()
+        for db_user in [*db_users, db_users[0]]:
+            await crud.put_texture(db_user, "skin", None)
+            await crud.put_texture(db_user, "cape", None)
+        await db.commit()
+        changes = await crud.get_changed_users(since, limit=10)
+
+        pruned = await crud.prune_changes([u.id for u in db_users])
+        await db.commit()
+
+        assert pruned == 4
+        # the feed returns the same users, with the same cursors
+        assert await crud.get_changed_users(since, limit=10) == changes
+        assert [uuid for uuid, _ in changes] == [users[1].uuid, users[0].uuid]
@@ -1,13 +1,61 @@
+import asyncio
 import os
-from collections.abc import Generator
+import threading
+from collections.abc import AsyncGenerator, Generator
+from datetime import UTC, datetime, timedelta
 from pathlib import Path
+from typing import override
 
+import anyio
+import anyio.to_thread
 import boto3
+import httpx
 import pytest
+import requests
+from botocore.credentials import DeferredRefreshableCredentials
 from moto import mock_aws
 
-from valhalla.config import Settings
-from valhalla.files import get_filesystem
+from valhalla.app import app
+from valhalla.config import Settings, get_settings
+from valhalla.files import (
+    DiskCache,
+    FilePath,
+    S3Path,
+    TieredPath,
+    get_filesystem,
+    get_s3_client,
+    get_s3_http,
+)
+from valhalla.image import gen_skin_hash
+
+from .conftest import TestClient, TestUser, random_skin
+
+
+class RequestsTransport(httpx.AsyncBaseTransport):
+    """Send httpx requests through requests, which moto intercepts."""
+
+    def __init__(self) -> None:
+        self.session = requests.Session()
+        self.methods: list[str] = []
+
+    @override
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.methods.append(request.method)
+        content = await request.aread()
+        response = await anyio.to_thread.run_sync(
+            lambda: self.session.request(
+                request.method,
+                str(request.url),
+                headers=dict(request.headers),
+                data=content,
+                stream=True,
+            )
+        )
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            content=b"" if request.method == "HEAD" else response.content,
+        )
 
 
 @pytest.fixture(scope="function")
@@ -21,8 +69,16 @@ def aws_credentials() -> None:
 
 @pytest.fixture(scope="function")
 def aws(aws_credentials: None) -> Generator[None]:
+    get_s3_client.cache_clear()
     with mock_aws():
         yield
+    get_s3_client.cache_clear()
+
+
+@pytest.fixture
+async def http() -> AsyncGenerator[httpx.AsyncClient]:
+    async with httpx.AsyncClient(transport=RequestsTransport()) as client:
+        yield client
 
 
 @pytest.fixture(scope="function")
@@ -42,6 +98,7 @@ def local_filesystem(tmpdir: Path) -> Settings:
     )
 
 
+@pytest.mark.anyio
 @pytest.mark.parametrize(
     "config_fixture",
     [
@@ -49,12 +106,281 @@ def local_filesystem(tmpdir: Path) -> Settings:
         "s3_filesystem",
     ],
 )
-def test_filesystem(config_fixture: str, request: pytest.FixtureRequest) -> None:
+async def test_filesystem(
+    config_fixture: str, request: pytest.FixtureRequest, http: httpx.AsyncClient
+) -> None:
     config: Settings = request.getfixturevalue(config_fixture)
-    fs = get_filesystem(config)
+    fs = get_filesystem(config, http)
     file = fs / "file.txt"
-    assert not file.exists()
+    assert not await file.exists()
+
+    await file.write_bytes(b"hello, world", content_type="text/plain")
+
+    assert await file.exists()
+
+
+def test_s3_client_reused(aws: None) -> None:
+    assert get_s3_client() is get_s3_client()
+
+
+@pytest.mark.anyio
+async def test_s3_credentials_refreshed_in_thread(
+    s3_filesystem: Settings, http: httpx.AsyncClient
+) -> None:
+    refreshed_in: list[int] = []
+
+    def refresh() -> dict[str, str]:
+        refreshed_in.append(threading.get_ident())
+        expiry = datetime.now(UTC) + timedelta(hours=1)
+        return {
+            "access_key": "testing",
+            "secret_key": "testing",
+            "token": "testing",
+            "expiry_time": expiry.isoformat(),
+        }
+
+    s3_client = boto3.client("s3")
+    credentials = DeferredRefreshableCredentials(refresh, "test")
+    s3_client._request_signer._credentials = credentials  # type: ignore[attr-defined]  # noqa: SLF001
+    file = S3Path(s3_client, http, "bucket.com", "path") / "texture"
+
+    assert not await file.exists()
+    assert not await file.exists()
+    assert len(refreshed_in) == 1
+    assert refreshed_in[0] != threading.get_ident()
+
+
+@pytest.mark.anyio
+async def test_s3_write(s3_filesystem: Settings, http: httpx.AsyncClient) -> None:
+    fs = get_filesystem(s3_filesystem, http)
+    await (fs / "texture").write_bytes(b"texture", content_type="image/png")
+
+    obj = boto3.client("s3").get_object(Bucket="bucket.com", Key="path/texture")
+    assert obj["Body"].read() == b"texture"
+    assert obj["ContentType"] == "image/png"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "config_fixture",
+    [
+        "local_filesystem",
+        "s3_filesystem",
+    ],
+)
+async def test_filesystem_create(
+    config_fixture: str, request: pytest.FixtureRequest, http: httpx.AsyncClient
+) -> None:
+    config: Settings = request.getfixturevalue(config_fixture)
+    file = get_filesystem(config, http) / "texture"
+
+    assert await file.create(b"first", content_type="image/png")
+    assert not await file.create(b"second", content_type="image/png")
+    assert await file.read_bytes() == b"first"
+    with pytest.raises(FileNotFoundError):
+        await (get_filesystem(config, http) / "missing").read_bytes()
 
-    file.write_bytes(b"hello, world")
+    if isinstance(file, FilePath):
+        assert file.path.read_bytes() == b"first"
+        assert os.listdir(file.path.parent) == ["texture"]
 
-    assert file.exists()
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "config_fixture",
+    [
+        "local_filesystem",
+        "s3_filesystem",
+    ],
+)
+async def test_filesystem_touch(
+    config_fixture: str, request: pytest.FixtureRequest, http: httpx.AsyncClient
+) -> None:
+    config: Settings = request.getfixturevalue(config_fixture)
+    file = get_filesystem(config, http) / "texture"
+    missing = get_filesystem(config, http) / "missing"
+    assert not await missing.touch()
+    assert await missing.modified() is None
+
+    await file.create(b"texture", content_type="image/png")
+    if isinstance(file, FilePath):
+        os.utime(file.path, (0, 0))
+        before = datetime.now(UTC) - timedelta(seconds=1)
+    else:
+        # S3 only keeps the time to the second
+        await anyio.sleep(1)
+        before = datetime.now(UTC)
+    modified = await file.modified()
+    assert modified is not None
+    assert modified < before
+
+    assert await file.touch(content_type="image/png")
+    modified = await file.modified()
+    assert modified is not None
+    assert modified >= before.replace(microsecond=0)
+    assert await file.read_bytes() == b"texture"
+    if not isinstance(file, FilePath):
+        obj = boto3.client("s3").head_object(Bucket="bucket.com", Key="path/texture")
+        assert obj["ContentType"] == "image/png"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "config_fixture",
+    [
+        "local_filesystem",
+        "s3_filesystem",
+    ],
+)
+async def test_filesystem_listing(
+    config_fixture: str, request: pytest.FixtureRequest, http: httpx.AsyncClient
+) -> None:
+    config: Settings = request.getfixturevalue(config_fixture)
+    fs = get_filesystem(config, http)
+    for key in ("a", "b", "c"):
+        await (fs / key).write_bytes(b"texture")
+
+    files = [file async for file in fs.iter_files()]
+    assert sorted(file.key for file in files) == ["a", "b", "c"]
+    assert all(file.modified.tzinfo is not None for file in files)
+
+    await fs.delete_many(["a", "b", "missing"])
+    assert [file.key async for file in fs.iter_files()] == ["c"]
+
+
+@pytest.mark.anyio
+async def test_tiered_storage(s3_filesystem: Settings, tmp_path: Path) -> None:
+    transport = RequestsTransport()
+    async with httpx.AsyncClient(transport=transport) as http:
+        s3 = get_filesystem(s3_filesystem, http)
+        cache = DiskCache(tmp_path, 10)
+        fs = TieredPath(s3, cache)
+
+        # written to both
+        assert await (fs / "a").create(b"aaaa")
+        assert "a" in cache
+        obj = boto3.client("s3").get_object(Bucket="bucket.com", Key="path/a")
+        assert obj["Body"].read() == b"aaaa"
+
+        # concurrent misses are filled by a single read
+        await (s3 / "b").write_bytes(b"bbbb")
+        transport.methods.clear()
+        reads = await asyncio.gather(*((fs / "b").read_bytes() for _ in range(5)))
+        assert reads == [b"bbbb"] * 5
+        assert transport.methods == ["GET"]
+
+        transport.methods.clear()
+        assert await (fs / "b").read_bytes() == b"bbbb"
+        assert transport.methods == []
+
+        # evicts a, which was used least recently
+        await (fs / "c").write_bytes(b"cccc")
+        assert "a" not in cache
+        assert cache.size == 8
+
+    assert "b" in DiskCache(tmp_path, 10)
+
+
+@pytest.mark.anyio
+async def test_disk_cache_concurrent_puts(tmp_path: Path) -> None:
+    cache = DiskCache(tmp_path, 10)
+
+    await asyncio.gather(*(cache.put(key, b"data") for key in ["a", "a", "b", "c"]))
+
+    # each key is counted once, and the evicted one is removed from the disk
+    assert cache.size == 8
+    assert "a" not in cache
+    stored = [
+        path.name
+        async for path in anyio.Path(tmp_path).rglob("*")
+        if await path.is_file()
+    ]
+    assert sorted(stored) == ["b", "c"]
+
+
+@pytest.fixture
+def s3_app(s3_filesystem: Settings) -> Generator[None]:
+    http = httpx.AsyncClient(transport=RequestsTransport())
+    app.dependency_overrides[get_settings] = lambda: s3_filesystem
+    app.dependency_overrides[get_s3_http] = lambda: http
+    yield
+    del app.dependency_overrides[get_settings]
+    del app.dependency_overrides[get_s3_http]
+
+
+def test_direct_upload(s3_app: None, client: TestClient, user: TestUser) -> None:
+    skin = random_skin()
+    skin_hash = gen_skin_hash(skin)
+
+    resp = client.post(
+        "/api/v1/textures/uploads",
+        json={"type": "skin", "meta": {"model": "slim"}},
+        headers=user.auth_header,
+    )
+    assert resp.status_code == 200, resp.json()
+    intent = resp.json()
+
+    s3_resp = requests.post(
+        intent["url"],
+        data=intent["fields"],
+        files={"file": ("skin.png", skin)},
+    )
+    assert s3_resp.ok
+
+    complete = {"token": intent["token"]}
+    resp = client.post(
+        "/api/v1/textures/uploads/complete", json=complete, headers=user.auth_header
+    )
+    assert resp.status_code == 200, resp.json()
+
+    texture = client.get("/api/v1/textures", headers=user.auth_header).json()["skin"]
+    assert texture["url"].endswith(skin_hash)
+    assert texture["metadata"] == {"model": "slim"}
+
+    objects = boto3.client("s3").list_objects_v2(Bucket="bucket.com")["Contents"]
+    assert [obj["Key"] for obj in objects] == [f"path/{skin_hash}"]
+
+    # the staged texture is gone
+    resp = client.post(
+        "/api/v1/textures/uploads/complete", json=complete, headers=user.auth_header
+    )
+    assert resp.status_code == 400
+
+
+def test_direct_upload_invalid(
+    s3_app: None, client: TestClient, user: TestUser
+) -> None:
+    resp = client.post(
+        "/api/v1/textures/uploads", json={"type": "skin"}, headers=user.auth_header
+    )
+    intent = resp.json()
+    s3_resp = requests.post(
+        intent["url"], data=intent["fields"], files={"file": ("skin.png", b"png")}
+    )
+    assert s3_resp.ok
+
+    resp = client.post(
+        "/api/v1/textures/uploads/complete",
+        json={"token": intent["token"]},
+        headers=user.auth_header,
+    )
+    assert resp.status_code == 400
+
+    # the rejected texture is not kept in the staging prefix
+    assert "Contents" not in boto3.client("s3").list_objects_v2(Bucket="bucket.com")
+
+
+def test_direct_upload_other_user(
+    s3_app: None, client: TestClient, users: list[TestUser]
+) -> None:
+    resp = client.post(
+        "/api/v1/textures/uploads",
+        json={"type": "skin"},
+        headers=users[0].auth_header,
+    )
+    resp = client.post(
+        "/api/v1/textures/uploads/complete",
+        json={"token": resp.json()["token"]},
+        headers=users[1].auth_header,
+    )
+    assert resp.status_code == 403
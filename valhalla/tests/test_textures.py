@@ -1,7 +1,12 @@
+import struct
+import zlib
+from io import BytesIO
 from pathlib import Path
 
 import pytest
 from fastapi import HTTPException
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
 
 from .. import image
 from .conftest import assets
@@ -33,3 +38,45 @@ def test_valid_images(path: Path) -> None:
     actual_hash = image.gen_skin_hash(image_data)
 
     assert actual_hash == target_hash
+
+
+def test_optimize_png() -> None:
+    original = Image.open(good / "64x64.png")
+    info = PngInfo()
+    info.add_text("Comment", "x" * 10_000)
+    data = BytesIO()
+    original.save(data, "PNG", compress_level=0, pnginfo=info)
+    bloated = data.getvalue()
+
+    texture_hash, optimized = image.prepare_skin(bloated)
+
+    assert texture_hash == (good / "64x64.txt").read_text().strip()
+    assert len(optimized) < len(bloated)
+    reencoded = Image.open(BytesIO(optimized))
+    assert "Comment" not in reencoded.info
+    assert reencoded.mode == original.mode
+    assert reencoded.tobytes() == original.tobytes()
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    body = kind + data
+    return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+
+def test_optimize_keeps_16_bit_png() -> None:
+    # Pillow can't write RGBA with 16 bits per sample, so build it by hand
+    row = bytes(range(256)) * 2
+    pixels = b"".join(b"\0" + row for _ in range(64))
+    sixteen_bit = b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            png_chunk(b"IHDR", struct.pack(">IIBBBBB", 64, 64, 16, 6, 0, 0, 0)),
+            png_chunk(b"tEXt", b"Comment\0" + b"x" * 10_000),
+            png_chunk(b"IDAT", zlib.compress(pixels, 0)),
+            png_chunk(b"IEND", b""),
+        ]
+    )
+
+    _, optimized = image.prepare_skin(sixteen_bit)
+
+    assert optimized == sixteen_bit
@@ -0,0 +1,59 @@
+"""Background job worker, run separately from the app with `python -m valhalla.worker`.
+
+Set `JOBS_IN_PROCESS=false` for the app to leave all jobs to the workers.
+"""
+
+import argparse
+
+import anyio
+
+from . import derivatives
+from .config import settings
+from .database import SessionLocal
+from .files import get_s3_http
+from .jobs import Handler, JobQueue
+
+handlers: dict[str, Handler] = {
+    derivatives.job_kind: derivatives.render_job,
+}
+
+queue = JobQueue(
+    SessionLocal,
+    handlers,
+    concurrency=settings.job_concurrency,
+    max_attempts=settings.job_max_attempts,
+)
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        msg = f"must be at least 1, not {number}"
+        raise argparse.ArgumentTypeError(msg)
+    return number
+
+
+async def run(args: argparse.Namespace) -> None:
+    queue.concurrency = args.concurrency
+    try:
+        if args.burst:
+            print(f"Ran {await queue.run_once()} jobs")
+        else:
+            await queue.run()
+    finally:
+        await get_s3_http().aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m valhalla.worker")
+    parser.add_argument(
+        "--concurrency", type=positive_int, default=settings.job_concurrency
+    )
+    parser.add_argument(
+        "--burst", action="store_true", help="exit once there are no jobs left"
+    )
+    anyio.run(run, parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
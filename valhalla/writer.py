@@ -0,0 +1,89 @@
+"""Single writer for databases which only allow one write transaction at a time.
+
+SQLite locks the whole database while writing, so concurrent requests wait on
+each other's commits and eventually fail with "database is locked". With the
+write queue enabled, the writes of all requests go through one task, which
+commits them together in small batches.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+type WriteOp[T] = Callable[[AsyncSession], Awaitable[T]]
+
+
+@dataclass
+class _Write[T]:
+    op: WriteOp[T]
+    future: asyncio.Future[T]
+
+
+def _resolve[T](
+    write: _Write[T], result: T | None, error: BaseException | None
+) -> None:
+    if write.future.done():
+        # the caller is gone
+        return
+    if error is not None:
+        write.future.set_exception(error)
+    else:
+        write.future.set_result(result)  # type: ignore[arg-type]
+
+
+class Writer:
+    """Apply write operations one after another from a single task.
+
+    Each operation runs in a savepoint, so a failing operation is rolled back
+    without affecting the others in its batch. The sessions should not expire
+    on commit, since the results are handed back to the callers afterwards.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        *,
+        max_batch: int = 64,
+    ) -> None:
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue[_Write[Any]] = asyncio.Queue(max_batch * 16)
+
+    async def submit[T](self, op: WriteOp[T]) -> T:
+        """Queue an operation and wait until it is committed.
+
+        The operation must not commit the session itself.
+        """
+        future: asyncio.Future[T] = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Write(op, future))
+        return await future
+
+    async def run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self.apply(batch)
+
+    async def apply(self, batch: list[_Write[Any]]) -> None:
+        results: list[tuple[_Write[Any], Any, Exception | None]] = []
+        async with self.session_factory() as db:
+            for write in batch:
+                try:
+                    async with db.begin_nested():
+                        results.append((write, await write.op(db), None))
+                except Exception as e:
+                    results.append((write, None, e))
+
+            try:
+                await db.commit()
+            except Exception as e:
+                for write in batch:
+                    _resolve(write, None, e)
+                return
+
+        for write, result, error in results:
+            _resolve(write, result, error)
@@ -7,6 +7,8 @@ from uuid import UUID
 import httpx
 from pydantic import AnyHttpUrl, BaseModel
 
+from . import metrics
+
 XBOX_AUTH_BASE = "https://{0}.auth.xboxlive.com/{0}/{1}"
 XBOX_USER_AUTH = XBOX_AUTH_BASE.format("user", "authenticate")
 XBOX_XSTS_AUTH = XBOX_AUTH_BASE.format("xsts", "authorize")
@@ -93,6 +95,7 @@ class XboxAuth(BaseModel):
     DisplayClaims: dict[str, list[dict[str, str]]]
 
 
+@metrics.timed(metrics.outbound_request_seconds.labels("xbox"))
 async def login_with_xbox(xbl_access_token: str) -> MinecraftProfile:
     async with httpx.AsyncClient() as client:
 